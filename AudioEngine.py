@@ -0,0 +1,293 @@
+import threading
+import time
+import wave
+from collections import namedtuple
+import importlib.util
+import numpy as np
+
+# pyaudio is imported when a PyAudioSink starts, headless runs never load it
+PY_AUDIO = importlib.util.find_spec("pyaudio") is not None
+
+"""
+One long-lived audio output stream for AudioGenerator.
+
+Instead of forking a process per sound, the engine owns a single output
+    stream (a PyAudio callback stream on the pi) that keeps pulling buffers
+    from AudioEngine.render(). The vision loop never touches the stream, it
+    only swaps the current cue via AudioEngine.update(), which is a single
+    attribute assignment. The callback picks the new cue up at the start of
+    its next buffer, so there is no process churn and no sleeping on the
+    caller's thread.
+
+Sinks decide where the rendered buffers go:
+    PyAudioSink  - the speaker/bluetooth device, callback driven
+    NullSink     - nowhere, for running headless (pull() buffers by hand)
+    WaveFileSink - a .wav file, paced in real time so cue timing is kept
+
+Switching cues is click free: the old cue keeps playing under the new one
+    for crossfade_frames while one fades out and the other in. If the new
+    cue is sounding at the old cue's offset mod phase_frames, it starts
+    there instead of at its top, which for cues rendered by ToneSynth (loops
+    padded to phase_frames) means the tone carries on w/o a phase jump.
+"""
+
+# The parameter block shared w/ the audio callback. It is immutable, so
+#   swapping AudioEngine.cue for a new one is atomic and needs no lock.
+Cue = namedtuple('Cue', ['pcm', 'balance', 'volume', 'pacing', 'classification', 'serial'])
+
+
+class AudioEngine:
+    """
+    Loops the PCM of the current cue until it is replaced or silenced.
+    All audio is 16 bit stereo at sample_rate, AudioEngine.update() converts
+        incoming pydub segments to that format.
+
+    :sink -> NullSink: where rendered buffers go, defaults to PyAudioSink
+    :cue -> Cue: current parameter block, None means silence
+    :position -> int: byte offset into the current cue's pcm
+    :updates -> int: number of cues handed to us so far
+    :buffers -> int: number of buffers rendered so far
+    :crossfade_frames -> int: length of the fade between two cues, 0 to cut
+    :phase_frames -> int: see above, 0 to always start new cues at the top
+    """
+    sample_rate = 44100
+    channels = 2
+    sample_width = 2
+    frames_per_buffer = 1024
+    crossfade_frames = 256
+    phase_frames = 2205
+
+    def __init__(self, sink=None):
+        self.sink = sink if sink is not None else PyAudioSink()
+        self.cue = None
+        self.position = 0
+        self.updates = 0
+        self.buffers = 0
+        self._playing_serial = None
+        self._playing = None
+        self._silence = bytes(self.frames_per_buffer * self.frame_bytes())
+
+    def frame_bytes(self):
+        return self.channels * self.sample_width
+
+    def start(self):
+        self.sink.start(self)
+
+    def stop(self):
+        self.silence()
+        self.sink.stop()
+
+    def to_pcm(self, sound):
+        """
+        Convert a pydub segment into the raw format the stream plays
+        :sound -> pydub.AudioSegment: one cycle of the cue
+        :returns -> bytes: 16 bit interleaved stereo pcm
+        """
+        sound = sound.set_frame_rate(self.sample_rate).set_channels(self.channels).set_sample_width(self.sample_width)
+        return sound.raw_data
+
+    def update(self, sound, balance, volume, pacing, classification):
+        """
+        Swap in a new cue. Takes effect at the next audio buffer.
+        :sound -> pydub.AudioSegment or bytes: one cycle of the cue, looped by the engine
+        """
+        pcm = sound if isinstance(sound, (bytes, bytearray)) else self.to_pcm(sound)
+        if len(pcm) < self.frame_bytes():
+            self.silence()
+            return
+        self.updates += 1
+        self.cue = Cue(pcm, balance, volume, pacing, classification, self.updates)
+
+    def silence(self):
+        self.cue = None
+
+    def render(self, frame_count):
+        """
+        Produce the next frame_count frames of audio. This is what the
+            stream callback calls, so it must never block.
+        :frame_count -> int: frames requested by the sink
+        :returns -> bytes: frame_count frames of pcm
+        """
+        self.buffers += 1
+        cue = self.cue
+        need = frame_count * self.frame_bytes()
+        previous = self._playing
+        if cue is None:
+            self._playing_serial = None
+            self._playing = None
+            if previous is not None and self.crossfade_frames:
+                return self._crossfade(previous.pcm, self.position, None, 0, need)
+            if need == len(self._silence):
+                return self._silence
+            return bytes(need)
+        if cue.serial == self._playing_serial:
+            data, self.position = self._read(cue.pcm, self.position, need)
+            return data
+        self._playing_serial = cue.serial
+        self._playing = cue
+        start = self._aligned(cue.pcm, self.position) if previous is not None else 0
+        if previous is not None and self.crossfade_frames:
+            return self._crossfade(previous.pcm, self.position, cue.pcm, start, need)
+        data, self.position = self._read(cue.pcm, start, need)
+        return data
+
+    def _read(self, pcm, pos, need):
+        """
+        :returns -> (bytes, int): need bytes of pcm looped from pos, & the position after
+        """
+        if pos + need <= len(pcm):
+            return pcm[pos:pos + need], (pos + need) % len(pcm)
+        chunks = []
+        while need > 0:
+            take = min(need, len(pcm) - pos)
+            chunks.append(pcm[pos:pos + take])
+            need -= take
+            pos = (pos + take) % len(pcm)
+        return b''.join(chunks), pos
+
+    def _aligned(self, pcm, position):
+        """
+        Where to start a new cue: at the old position mod phase_frames if
+            the new cue is sounding there, else at its top
+        """
+        if not self.phase_frames:
+            return 0
+        frame_bytes = self.frame_bytes()
+        if (len(pcm) // frame_bytes) % self.phase_frames:
+            return 0
+        start = (position // frame_bytes) % self.phase_frames * frame_bytes
+        if not any(pcm[start:start + 4 * frame_bytes]):
+            return 0
+        return start
+
+    def _crossfade(self, old, old_pos, new, new_pos, need):
+        """
+        Mix the tail of the old cue into the start of the new one (None
+            for silence) w/ equal-power gains
+        """
+        frame_bytes = self.frame_bytes()
+        fade = min(self.crossfade_frames, need // frame_bytes)
+        tail, _ = self._read(old, old_pos, fade * frame_bytes)
+        if new is None:
+            head, self.position = bytes(need), 0
+        else:
+            head, self.position = self._read(new, new_pos, need)
+        mixed = np.frombuffer(head, np.int16).reshape(-1, self.channels).astype(np.float32)
+        ramp = np.linspace(0, np.pi / 2, fade, endpoint=False, dtype=np.float32)[:, np.newaxis]
+        mixed[:fade] *= np.sin(ramp)
+        mixed[:fade] += np.frombuffer(tail, np.int16).reshape(-1, self.channels) * np.cos(ramp)
+        return np.clip(mixed, -32768, 32767).astype(np.int16).tobytes()
+
+
+class NullSink:
+    """
+    Sink that plays nothing. By default buffers are only rendered when
+        pull() is called, which makes the engine easy to drive headless.
+    :realtime -> bool: if true, render buffers from a thread at the
+                       rate a real device would ask for them
+    """
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self.engine = None
+        self._thread = None
+        self._running = False
+
+    def start(self, engine):
+        self.engine = engine
+        if self.realtime:
+            self._running = True
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def pull(self, buffers=1):
+        """
+        Render some buffers by hand
+        :buffers -> int: how many buffers to render
+        :returns -> bytes: the rendered pcm
+        """
+        data = b''.join(self.engine.render(self.engine.frames_per_buffer) for _ in range(buffers))
+        self._write(data)
+        return data
+
+    def _write(self, data):
+        pass
+
+    def _loop(self):
+        period = self.engine.frames_per_buffer / self.engine.sample_rate
+        deadline = time.monotonic()
+        while self._running:
+            self._write(self.engine.render(self.engine.frames_per_buffer))
+            deadline += period
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+
+class WaveFileSink(NullSink):
+    """
+    Sink that writes everything the engine renders into a .wav file
+    :path -> str: file to write
+    """
+    def __init__(self, path, realtime=True):
+        super().__init__(realtime=realtime)
+        self.path = path
+        self._file = None
+
+    def start(self, engine):
+        self._file = wave.open(self.path, 'wb')
+        self._file.setnchannels(engine.channels)
+        self._file.setsampwidth(engine.sample_width)
+        self._file.setframerate(engine.sample_rate)
+        super().start(engine)
+
+    def stop(self):
+        super().stop()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, data):
+        self._file.writeframes(data)
+
+
+class PyAudioSink:
+    """
+    Sink backed by a PyAudio callback stream on the default output device.
+    PyAudio calls AudioEngine.render() from its own thread whenever the
+        device wants more audio.
+    """
+    def __init__(self):
+        self.audio = None
+        self.stream = None
+
+    def start(self, engine):
+        if not PY_AUDIO:
+            raise RuntimeError("pyaudio is not installed, use a NullSink to run without audio")
+        import pyaudio
+
+        def callback(in_data, frame_count, time_info, status):
+            return (engine.render(frame_count), pyaudio.paContinue)
+
+        self.audio = pyaudio.PyAudio()
+        self.stream = self.audio.open(format=self.audio.get_format_from_width(engine.sample_width),
+                                      channels=engine.channels,
+                                      rate=engine.sample_rate,
+                                      output=True,
+                                      frames_per_buffer=engine.frames_per_buffer,
+                                      stream_callback=callback)
+        self.stream.start_stream()
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        if self.audio is not None:
+            self.audio.terminate()
+            self.audio = None
@@ -1,17 +1,21 @@
-from multiprocessing import Process
-from pydub.generators import Sine
-from pydub import AudioSegment
-from pydub.playback import play
-import pyaudio
 import time
-import os
 import random
 from copy import copy
 import sys
 import math
 import json
+import logging
+import threading
 from enum import Enum
-import serial
+from AudioEngine import AudioEngine
+from WaveCache import WaveCache
+from LidarReader import LidarReader, SerialSource
+from CueTable import CueTable
+from ToneSynth import ToneSynth
+from CuePolicy import CuePolicy
+from Metrics import Metrics
+
+log = logging.getLogger(__name__)
 
 """
 width of image 640, abt 600 is non-target at 18m
@@ -24,15 +28,18 @@ SOOOO our panning needs to be vvv quiet from about x [[0..250], [390..639]]
 TODO:
 make the lidar readouts adjust our boundaries for WIDE_LEFT/WIDE_RIGHT, and
     sensitivity for balancing and distancing.
+    (first pass: AudioGenerator.band_thresholds shrinks thresh_balance w/
+        range, baked into CueTable per 1m band. numbers still need tuning
+        on the range.)
     EXPLANATION: At close ranges, the target will take up a larger section
         of each frame, so larger arm movement will correspond to smaller
         target displacement distances.
         Similarly, at larger ranges, the target will take up a smaller section,
             so tiny shifts in arm movement will cause huge changes in audio
             output.
-    To implement this correctly, the lidar should run in its own thread
-        and populate a stack of VALID (non negative 1) ranges.
-        That way we can guarantee a value at any time, w/o performance hits.
+    The lidar now runs in its own thread (see LidarReader) and keeps a ring
+        buffer of VALID (non negative 1) ranges, so we can get a value at
+        any time w/o performance hits.
     The reason for this is that at 18meter ranges, it was super hard to
         differentiate between close to bulls and slightly closer to bulls.
     The gist of this should come down to this:
@@ -56,15 +63,15 @@ class AudioGenerator:
     Class for generating audio feedback. Main func is AudioGenerator.run()
     The design of this class shall integrate directly with the camera code.
     This design will CONSTANTLY generate audio, even if the OpenCV performance
-        is lagging. So the audio runs in sub-processes while OpenCV runs
-        in the main process.
+        is lagging. So the audio is played by a long-lived AudioEngine stream
+        on its own thread while OpenCV runs in the main thread.
 
     The core logic is:
         AudioGenerator.run(current_circle)
-            if current_circle != AudioGenerator.prev_circle
-                kill the process which is running the previous_circles audio
-                spawn a new process playing audio for current_circle
-                save the process id of the new process
+            if the policy says current_circle sounds different enough
+                from what is playing (see CuePolicy.py)
+                hand the audio for current_circle to the engine, which
+                swaps it in at its next buffer and keeps looping it
             else
                 pass
 
@@ -72,10 +79,23 @@ class AudioGenerator:
     :sine_generator -> Pydub.Generator: sine tone generator
     :cycle_time -> int: how long each audio chunk is
     :prev_circle -> [int, int]: last identified target
-    :prev_pid -> int: process id of most recently spawned audio process
     :boundaries -> [int, int]: x-y boundaries of the camera window
-    :sleep_time -> int: time delay between starting new sound and
-                        killing old process
+    :engine -> AudioEngine: the output stream all cues are played on
+    :cache -> WaveCache: rendered cues, keyed on quantized cue parameters
+    :quant_* -> float: grid the cue parameters are rounded to before rendering
+    :thresh_balance_far -> float: thresh_balance at range_far and beyond
+    :range_near/range_far -> int: lidar ranges (mm) the thresholds are interpolated between
+    :band_size -> int: width of one lidar range band in mm
+    :range_max_age -> float: sec a lidar reading is good for, a few Evo frames.
+                             Older than that the sensor has stopped sending
+    :table -> CueTable: precomputed cues per range band, see CueTable.py
+    :synth -> ToneSynth: renders cues, see ToneSynth.py. None falls back to
+                         the pydub generate_sound path
+    :policy -> CuePolicy: decides which detections become cue updates. None
+                          only skips repeats of non-TRACK classifications
+    :metrics -> Metrics: cue/dispatch timers and audio counters
+    :ready -> threading.Event: set once the engine & lidar are up, see start_hardware
+    :error -> Exception: what start_hardware failed w/, raised by wait_ready
     """
     ONLY_VERT_PACING = True
     center_freq = 440
@@ -89,95 +109,172 @@ class AudioGenerator:
     thresh_center = 0.06
     thresh_min_volume = -16.0
 
-    sleep_time = 0.2
-    
+    thresh_balance_far = 0.3
+    range_near = 5000
+    range_far = 18000
+    band_size = 1000
+    band_count = 20
+    range_max_age = 0.1
+
+    quant_balance = 0.05
+    quant_volume = 0.5
+    quant_pacing = 0.02
+
     boundaries = []
     max_displacement = 0
 
-    prev_pid = None
     prev_type = Classification.NONE
 
     error_cycles = 0
     error_limit = 10
 
+    # what the last run() saw, for session recordings
+    last_range = -1
+    last_classification = None
+
     lidar = None
+    engine = None
+    cache = None
+    table = None
+    synth = None
+    policy = None
+    metrics = None
 
-    def __init__(self, boundaries):
+    def __init__(self, boundaries, engine=None, cache_size=512, warm=False, lidar=None, metrics=None, synth=None, policy=None,
+                 defer=False):
         """
         Initialize our class, w/ the resolution of the camera image, aka
             the boundaries
         :boundaries -> [int, int]: x, y dimensions
+        :engine -> AudioEngine: output stream to play on, pass one w/ a
+                                NullSink to run headless
+        :cache_size -> int: max number of rendered cues to keep
+        :warm -> bool: pre-render the common cues before returning
+        :lidar -> LidarReader: range source, by default we try the Evo on
+                               /dev/ttyACM0 and run w/o ranges if it's missing.
+                               Pass False to not look for one at all
+        :metrics -> Metrics: where to record, defaults to the shared one
+        :synth -> ToneSynth: cue renderer, by default an equal-power one at the
+                             engine's rate. Pass False to render w/ pydub
+        :policy -> CuePolicy: update policy, defaults to one w/ CuePolicy's
+                              defaults. Pass False to update on every TRACK frame
+        :defer -> bool: open the audio device & lidar (and warm up) on
+                        background threads instead of one after another
+                        before returning, so the camera can come up at the
+                        same time. run() waits for them the first time
+                        it's called
         """
         self.boundaries = boundaries
+        self.metrics = metrics if metrics is not None else Metrics.metrics
+        self.engine = engine if engine is not None else AudioEngine()
+        self.ready = threading.Event()
+        self.error = None
+        self.defer = defer
+        self._warm = warm
+        self._lidar = lidar
+        if synth is None:
+            self.synth = ToneSynth(self.engine.sample_rate)
+        elif synth:
+            self.synth = synth
+        self.cache = WaveCache(cache_size)
+        self.table = CueTable(self)
+        if policy is None:
+            self.policy = CuePolicy(self, metrics=self.metrics)
+        elif policy:
+            self.policy = policy
         self.max_displacement = math.sqrt(math.pow(boundaries[0] / 2, 2) + math.pow(boundaries[1] / 2, 2))
+        self.metrics.gauge("audio.cache_hit_rate", lambda: round(self.cache.stats()["hit_rate"], 3))
+        if defer:
+            threading.Thread(target=self.start_hardware, name="audio-init", daemon=True).start()
+        else:
+            self.start_hardware()
+            self.wait_ready()
+
+    def start_hardware(self):
+        """
+        Open the audio stream and the lidar, then get the first cues ready:
+            the range band the first target will most likely be looked up
+            in (no range yet) and, w/ warm, the cache. Sets ready when done,
+            even if something failed, so run() never hangs on it.
+        """
+        began = self.metrics.clock()
         try:
-            self.lidar = serial.Serial('/dev/ttyACM0',115200, timeout=1)
-            self.lidar.write(bytes(b'\x00\x11\x01\x45'))
+            if self._lidar is not None:
+                self.lidar = self._lidar
+                self.engine.start()
+            elif not self.defer:
+                self.open_lidar()
+                self.engine.start()
+            else:
+                # the serial port opens while the audio device does
+                lidar = threading.Thread(target=self.open_lidar, name="lidar-init", daemon=True)
+                lidar.start()
+                try:
+                    self.engine.start()
+                finally:
+                    lidar.join()
+            if self.lidar:
+                self.metrics.gauge("lidar.reads", lambda: self.lidar.reads)
+                self.metrics.gauge("lidar.timeouts", lambda: self.lidar.timeouts)
+            self.table.get_band(0)
+            if self._warm:
+                self.warm_up()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.metrics.record("startup.audio", began)
+            self.ready.set()
+
+    def open_lidar(self):
+        try:
+            self.lidar = LidarReader(SerialSource.open('/dev/ttyACM0', 115200)).start()
         except:
-            pass
-    
-    def extend(self, soundItems):
+            log.warning("no lidar on /dev/ttyACM0, running w/o ranges")
+
+    def wait_ready(self):
         """
-        We generate audio (two) cycles at a time, so for the audio to continue
-            playing for a longer duration, we double this sound stream 10
-            times.
-        :soundItems -> PyAudio.AudioSegment: one sound cycle
-        :return -> PyAudio.AudioSegment: 10 sound cycles
+        Block until start_hardware is done, raising whatever it failed w/
         """
-        for i in range(10):
-            soundItems = soundItems + soundItems
-        return soundItems
-
+        self.ready.wait()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+    
     def no(self, lol=None):
         # ignore me
         pass
     
-    def play(self, audio, sleep_length, classification):
-        play(audio)
-    
-    def spawn_play(self, sound, sleep_length, classification):
+    def play(self, sound, balance, volume, dist_from_center, classification):
         """
-        Based on a sound object, spawn a new process and play that audio
-        If we have another process running somewhere else, kill it so 
-            we don't have two audios playing at once
-        Save the pid of the new process so we can kill it later if need be
-        :sound -> PyAudio.AudioSegment: spatialized & extended sound cycles
+        Hand a sound to the engine. Whatever was playing before is replaced
+            at the next audio buffer, so we never have two audios at once
+            and never wait on the old one to die.
+        :sound -> bytes: one spatialized sound cycle, looped by the engine
         """
-        p = Process(target=self.play, args=(sound, sleep_length, classification ))
-        p.start()
-        self.kill_process(self.prev_pid)
-        self.prev_pid = p.pid
-    
-    def kill_process(self, pid):
-        if pid is not None:
-            time.sleep(self.sleep_time)
-            try:
-                os.kill(pid, 1)
-            except:
-                pass
-        else:
-            pass
+        self.engine.update(sound, balance, volume, dist_from_center, classification)
 
-    def get_balance(self, balance):
+    def get_balance(self, balance, thresh_balance=None, thresh_center=None):
+        thresh_balance = self.thresh_balance if thresh_balance is None else thresh_balance
+        thresh_center = self.thresh_center if thresh_center is None else thresh_center
         balance_ = 0
-        if balance > self.thresh_balance:
+        if balance > thresh_balance:
             # between 1 <-> .5             - hard right
             balance_ = 1.0
-        elif balance < - self.thresh_balance:
+        elif balance < - thresh_balance:
             # between -1 <-> -0.5           - hard left
             balance_ = -1.0
         else:
             # between -0.5 <-> 0.5          - actually do some pan logic
-            if balance >= - self.thresh_center and balance <= self.thresh_center:
+            if balance >= - thresh_center and balance <= thresh_center:
                 # between -0.02 <-> 0.02    - close enough to bulls
                 balance_ = 0
-            elif balance < - self.thresh_center:
+            elif balance < - thresh_center:
                 # between -0.5 <-> -0.02    -   fancy pan left
-                balance_ = ( balance + self.thresh_center ) * ( self.thresh_balance / ( self.thresh_balance - self.thresh_center )) * ( 1 / self.thresh_balance)
+                balance_ = ( balance + thresh_center ) * ( thresh_balance / ( thresh_balance - thresh_center )) * ( 1 / thresh_balance)
                 balance_ = - math.pow(- balance_, (1 / 2)) #TODO: maybe 1/3? or more complex
-            elif balance > self.thresh_center:
+            elif balance > thresh_center:
                 # between 0.5 <-> 0.2       - fancy pan right
-                balance_ = ( balance - self.thresh_center ) * ( self.thresh_balance / ( self.thresh_balance - self.thresh_center )) * ( 1 / self.thresh_balance)
+                balance_ = ( balance - thresh_center ) * ( thresh_balance / ( thresh_balance - thresh_center )) * ( 1 / thresh_balance)
                 balance_ = math.pow(balance_, (1 / 2)) #TODO: maybe 1/3? or more complex
         return balance_
 
@@ -188,7 +285,8 @@ class AudioGenerator:
             center_region = 0.375 # hardcoded, sry. it basically makes it so that dist from center is 1 at the WIDE_{LEFT/RIGHT} and 0 at center
             return math.pow(( distance / self.max_displacement) / center_region, 0.8)
     
-    def classify(self, balance, volume, dist_from_center):
+    def classify(self, balance, volume, dist_from_center, thresh_center=None):
+        thresh_center = self.thresh_center if thresh_center is None else thresh_center
         if balance <= -1.0:
             return self.Classification.WIDE_LEFT
         elif balance >= 1.0:
@@ -200,7 +298,7 @@ class AudioGenerator:
                 else:
                     return self.Classification.TRACK
             else:
-                if abs(balance) < self.thresh_center and dist_from_center < 10:
+                if abs(balance) < thresh_center and dist_from_center < 10:
                     return self.Classification.BULLS
                 else:
                     return self.Classification.TRACK
@@ -215,6 +313,8 @@ class AudioGenerator:
             return tone.to_audio_segment(self.cycle_time_blip, volume=volume) + tone.to_audio_segment((self.cycle_time_max - self.cycle_time_blip) * dist_from_center, volume=-9999)
 
     def generate_sound(self, balance, volume, dist_from_center, classification):
+        # pydub is only needed for synth=False, so it isn't loaded at startup
+        from pydub.generators import Sine
         if classification is self.Classification.WIDE_LEFT:
             return self.generate_beeps(Sine(self.center_freq), balance, volume, dist_from_center, classification).pan(-1)
         elif classification is self.Classification.WIDE_RIGHT:
@@ -224,24 +324,121 @@ class AudioGenerator:
         elif classification is self.Classification.BULLS:
             return Sine(self.bulls_freq).to_audio_segment(self.cycle_time_min, volume=volume/2)
     
-    def process_circle(self, circle):
+    def cue_pattern(self, balance, volume, dist_from_center, classification):
+        """
+        The same cues as generate_sound, as a ToneSynth pattern
+        :returns -> ([(freq, ms, dB)], pan): segments & pan, pan None for unpanned
+        """
+        if classification is self.Classification.WIDE_LEFT:
+            return [(self.center_freq, self.cycle_time_min, volume)], -1
+        elif classification is self.Classification.WIDE_RIGHT:
+            return [(self.center_freq, self.cycle_time_min, volume)], 1
+        elif classification is self.Classification.TRACK:
+            rest = (self.cycle_time_max - self.cycle_time_blip) * math.pow(dist_from_center, 2)
+            return [(self.center_freq, self.cycle_time_blip, volume), (None, rest, 0)], balance
+        elif classification is self.Classification.BULLS:
+            return [(self.bulls_freq, self.cycle_time_min, volume / 2)], None
+
+    def render_sound(self, balance, volume, dist_from_center, classification):
+        """
+        Render one cycle of a cue straight to engine pcm
+        :returns -> bytes: 16 bit interleaved stereo
+        """
+        if self.synth is None:
+            return self.engine.to_pcm(self.generate_sound(balance, volume, dist_from_center, classification))
+        return self.synth.pcm(*self.cue_pattern(balance, volume, dist_from_center, classification))
+
+    def quantize(self, balance, volume, dist_from_center, classification):
+        """
+        Snap cue parameters onto the cache grid. Only TRACK cues are panned
+            and paced by position, the rest only depend on the volume.
+        :returns -> (balance, volume, dist_from_center, classification): rounded values
+        """
+        volume = round(volume / self.quant_volume) * self.quant_volume
+        if classification is self.Classification.TRACK:
+            balance = round(balance / self.quant_balance) * self.quant_balance
+            dist_from_center = round(dist_from_center / self.quant_pacing) * self.quant_pacing
+        else:
+            balance = 0
+            dist_from_center = 0
+        return balance, volume, dist_from_center, classification
+
+    def get_sound(self, balance, volume, dist_from_center, classification):
+        """
+        Get one ready-to-play cycle for a cue, rendering it only if its
+            quantized cell isn't cached yet
+        :returns -> bytes: pcm in the engine's format
+        """
+        key = self.quantize(balance, volume, dist_from_center, classification)
+        return self.cache.get(key, lambda: self.render_sound(*key))
+
+    def warm_up(self, stride=32):
+        """
+        Pre-render the cues for a grid of target positions so the first
+            frames on the range don't pay for rendering
+        :stride -> int: pixel spacing of the grid
+        :returns -> int: number of cues in the cache afterwards
+        """
+        for x in range(0, self.boundaries[0] + 1, stride):
+            for y in range(0, self.boundaries[1] + 1, stride):
+                self.get_sound(*self.process_circle([x, y]))
+        return len(self.cache)
+
+    def range_band(self, target_range):
+        """
+        :target_range -> int: lidar range in mm, -1 if unknown
+        :returns -> int: index of the range band, unknown ranges fall in band 0
+        """
+        if target_range < 0:
+            return 0
+        return min(int(target_range // self.band_size), self.band_count - 1)
+
+    def band_thresholds(self, band):
+        """
+        Widen WIDE_LEFT/WIDE_RIGHT w/ range. Up to range_near we use
+            thresh_balance as is, from there it shrinks linearly down to
+            thresh_balance_far at range_far, and thresh_center shrinks
+            along w/ it so the pan curve keeps its shape.
+        :band -> int: range band index
+        :returns -> (float, float): thresh_balance, thresh_center for that band
+        """
+        band_range = (band + 0.5) * self.band_size
+        amount = (band_range - self.range_near) / (self.range_far - self.range_near)
+        amount = min(max(amount, 0.0), 1.0)
+        thresh_balance = self.thresh_balance + (self.thresh_balance_far - self.thresh_balance) * amount
+        thresh_center = self.thresh_center * thresh_balance / self.thresh_balance
+        return thresh_balance, thresh_center
+
+    def process_circle(self, circle, target_range=-1):
+        """
+        Turn a circle into cue parameters w/ plain math. This is the
+            reference for CueTable, run() uses the table instead.
+        :circle -> [int, int]: x, y of the target
+        :target_range -> int: lidar range in mm, -1 if unknown
+        :returns -> (balance, volume, distance, classification)
+        """
+        thresh_balance, thresh_center = self.band_thresholds(self.range_band(target_range))
         _balance = ( circle[0] - ( self.boundaries[0] / 2 )) / ( self.boundaries[0] / 2) # -1.0 = Left, +1.0 = Right, 0.0 = Center
         _volume = abs(_balance) # 1.0 = Left, 1.0 = Right, 0.0 = Center
         if self.ONLY_VERT_PACING:
             _dist_from_center = abs( circle[1] - ( self.boundaries[1] / 2 ) )
         else:
             _dist_from_center = math.sqrt(math.pow(circle[0] - (self.boundaries[0] / 2 ), 2) + math.pow(circle[1] - ( self.boundaries[1] / 2 ), 2))
-        balance = self.get_balance(_balance)
-        volume = self.thresh_min_volume - ( ( 1 - math.sqrt( self.get_balance( _volume ) ) ) * self.thresh_min_volume)
+        balance = self.get_balance(_balance, thresh_balance, thresh_center)
+        volume = self.thresh_min_volume - ( ( 1 - math.sqrt( self.get_balance( _volume, thresh_balance, thresh_center ) ) ) * self.thresh_min_volume)
         distance = self.get_distance(_dist_from_center, balance)
-        classification = self.classify(balance, volume, _dist_from_center)
+        classification = self.classify(balance, volume, _dist_from_center, thresh_center)
         return balance, volume, distance, classification
 
     def get_range(self):
-        try:
-            return int(str(self.lidar.read(20)).split('\\n')[2])
-        except:
+        """
+        Latest valid lidar range. Never blocks, the reader thread does the
+            serial work.
+        :returns -> int: range in mm, or -1 if we have no lidar/no recent reading
+        """
+        if not self.lidar:
             return -1
+        return self.lidar.latest(max_age=self.range_max_age)
 
     def run(self, circle):
         """
@@ -257,34 +454,59 @@ class AudioGenerator:
             simple linear displacement from center accounting for x and y axis
         """
         # if not self.args["lidar"]:
+        if not self.ready.is_set() or self.error is not None:
+            self.wait_ready()
+        metrics = self.metrics
+        began = metrics.clock()
         target_range = self.get_range()
-        print("Current distance: " + str(target_range / 1000) + " meters")
-        if circle[0] is 0 and circle[1] is 0:
+        self.last_range = target_range
+        self.last_classification = None
+        log.debug("current distance: %s meters", target_range / 1000)
+        if circle[0] == 0 and circle[1] == 0:
+            metrics.count("audio.no_target")
             if self.error_cycles >= self.error_limit:
-                if self.error_cycles == 10:
-                    print("Error: no fresh circles w/in last " + str(self.error_limit) + " cycles. Killing all audio")
-                self.kill_process(self.prev_pid)
-                self.prev_pid = None
+                if self.error_cycles == self.error_limit:
+                    log.warning("no fresh circles w/in last %d cycles, killing all audio", self.error_limit)
+                    metrics.count("audio.silenced")
+                self.engine.silence()
                 self.prev_type = self.Classification.NONE
+                if self.policy is not None:
+                    self.policy.reset()
                 self.error_cycles += 1
             else:
                 self.error_cycles += 1
-                print("Error: no circle detected, error count is now " + str(self.error_cycles))
+                log.info("no circle detected, error count is now %d", self.error_cycles)
+            metrics.record("cue", began)
         else:
-            balance, volume, dist_from_center, classification = self.process_circle(circle)
-            if classification is not self.Classification.TRACK and classification is self.prev_type:
-                print("Circle found [" + str(circle[0]) + ", " + str(circle[1]) + "], but  matches previous type: " + str(classification) + ", so continuing last audio")
+            self.error_cycles = 0
+            if self.policy is not None:
+                cue = self.policy.decide(circle, target_range)
+                self.last_classification = self.policy.issued[3]
+            else:
+                cue = self.table.lookup(circle, target_range)
+                self.last_classification = cue[3]
+                if cue[3] is not self.Classification.TRACK and cue[3] is self.prev_type:
+                    cue = None
+            metrics.record("cue", began)
+            if cue is None:
+                log.debug("circle found %s, but it sounds the same as %s, so continuing last audio", circle, self.last_classification)
+                metrics.count("audio.repeats")
             else:
-                print("Circle found [" + str(circle[0]) + ", " + str(circle[1]) + "] - type: " + str(classification))
-                self.spawn_play(self.extend(self.generate_sound(balance, volume, dist_from_center, classification)), dist_from_center, classification)
+                balance, volume, dist_from_center, classification = cue
+                log.debug("circle found %s - type %s", circle, classification)
+                began = metrics.clock()
+                self.play(self.get_sound(balance, volume, dist_from_center, classification), balance, volume, dist_from_center, classification)
+                metrics.record("dispatch", began)
+                metrics.count("audio.updates")
                 self.prev_type = classification
-                self.error_cycles = 0
 
 if __name__ == "__main__":
     """
     Just testing. Bounces the circle around linearly, w/ random sleeps
         to simulate OpenCV lagging
     """
+    from Metrics import configure_logging
+    configure_logging("debug")
     au = AudioGenerator([640, 480])
     curCircle = [150, 70]
     curIter = 10
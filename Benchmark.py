@@ -0,0 +1,1118 @@
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import cv2
+import numpy as np
+import VideoProcessor as vp_module
+from VideoProcessor import VideoProcessor
+from AudioEngine import AudioEngine, NullSink
+from AudioGenerator import AudioGenerator
+from FrameSource import FrameSource
+from Session import SessionReader, ReplayLidar
+from ToneSynth import ToneSynth
+from CuePolicy import CuePolicy
+from Detector import DETECTORS
+from TargetTracker import TargetTracker
+from Metrics import Metrics
+
+"""
+Offline benchmarks for the detection and audio-cue paths. No camera, lidar
+    or speaker needed: VideoProcessor is built w/o a camera, AudioGenerator
+    w/o a lidar and w/ a NullSink engine, and frames are rendered
+    synthetically w/ a known target position.
+
+    python3 Benchmark.py suite --json out.json   # everything, see bench_suite
+    python3 Benchmark.py compare old.json new.json
+    python3 Benchmark.py replay       # record a session, replay it, diff outputs
+    python3 Benchmark.py tiles        # single process vs 1-4 --workers
+    python3 Benchmark.py synth        # NumPy cue synth vs pydub: speed, equivalence, clicks
+    python3 Benchmark.py policy       # cue updates w/ and w/o CuePolicy on a shaky aim
+    python3 Benchmark.py startup      # import time, time to first frame & first audible cue
+    python3 Benchmark.py detectors    # Hough vs contour backends, latency & accuracy per scenario
+    python3 Benchmark.py orient       # detecting on rotated frames vs rotating the circles
+    python3 Benchmark.py tracker      # two targets in view: pick flips & cue updates w/ and w/o tracking
+    python3 Benchmark.py duty         # --duty-cycle on a hold/move sequence: detections saved vs staleness
+    python3 Benchmark.py roi          # full frame vs --roi search
+    python3 Benchmark.py roi --pi     # same, pinned to one core like a busy pi
+    python3 Benchmark.py pyramid --dir logs/   # single scale vs --pyramid on recorded frames
+    python3 Benchmark.py alloc        # per-frame allocations & latency w/ and w/o the BufferPool
+
+Recorded frames are any images in a directory (e.g. what --save wrote to
+    logs/). If the directory has a labels.json mapping file names to the true
+    [x, y, r] of the target ([] for none), accuracy is measured against that;
+    otherwise the single-scale detection is used as the reference.
+
+--pi pins the process to a single core and turns off OpenCV's own threads,
+    which is about the budget the detection loop gets on the pi w/ audio
+    and capture running next to it.
+"""
+
+BOUNDARIES = [640, 480]
+
+
+def synthetic_frames(boundaries, count, radius=25, noise=8, seed=0, lighting=1.0, gradient=0.0, empty_every=0):
+    """
+    Render a bright green target moving around a noisy background
+    :boundaries -> [int, int]: x, y dimensions
+    :count -> int: number of frames
+    :radius -> int: target radius in px
+    :noise -> int: std dev of the gaussian background noise
+    :lighting -> float: brightness multiplier for the whole scene
+    :gradient -> float: extra brightness falloff from left to right, 0..1
+    :empty_every -> int: leave the target out of every nth frame, 0 never
+    :returns -> generator: (frame, [x, y, r]) w/ the true target position,
+                           [] for frames w/o a target
+    """
+    rng = np.random.default_rng(seed)
+    background = np.full((boundaries[1], boundaries[0], 3), 60, np.uint8)
+    light = lighting * (1.0 - gradient * np.linspace(0, 1, boundaries[0]))[np.newaxis, :, np.newaxis]
+    for i in range(count):
+        # slow lissajous wobble around the center, like an arm holding aim
+        x = boundaries[0] / 2 + boundaries[0] / 4 * math.sin(i / 23.0)
+        y = boundaries[1] / 2 + boundaries[1] / 5 * math.sin(i / 31.0 + 1)
+        frame = background.copy()
+        empty = empty_every and i % empty_every == empty_every - 1
+        if not empty:
+            cv2.circle(frame, (int(round(x)), int(round(y))), radius, (0, 200, 0), -1)
+        if noise or lighting != 1.0 or gradient:
+            frame = (frame * light + rng.normal(0, noise, frame.shape)).clip(0, 255).astype(np.uint8)
+        yield frame, [] if empty else [x, y, radius]
+
+
+def load_frames(directory):
+    """
+    Read recorded frames and their labels
+    :directory -> str: folder of .png/.jpg frames, optionally w/ labels.json
+    :returns -> [(frame, [x, y, r] or None)]: truth is None if unlabelled,
+                                              [] if labelled as no target
+    """
+    labels = {}
+    path = os.path.join(directory, "labels.json")
+    if os.path.isfile(path):
+        with open(path) as f:
+            labels = json.load(f)
+    frames = []
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith((".png", ".jpg", ".jpeg")):
+            continue
+        frame = cv2.imread(os.path.join(directory, name))
+        if frame is None:
+            continue
+        if frame.shape[1] != BOUNDARIES[0] or frame.shape[0] != BOUNDARIES[1]:
+            frame = cv2.resize(frame, (BOUNDARIES[0], BOUNDARIES[1]))
+        frames.append((frame, labels.get(name)))
+    return frames
+
+
+def make_processor(*flags):
+    """
+    VideoProcessor w/o a camera, configured w/ the given CLI flags
+    """
+    return VideoProcessor(BOUNDARIES, None, argv=["--greedy"] + list(flags), configure=False)
+
+
+def pi_budget():
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {min(os.sched_getaffinity(0))})
+    cv2.setNumThreads(1)
+
+
+def run_chain(vp, frames):
+    """
+    Push frames through process_chain
+    :returns -> ([float], [float]): per-frame seconds, per-frame position
+                                    error in px (nan for misses)
+    """
+    times = []
+    errors = []
+    for frame, truth in frames:
+        # process_chain may draw on the frame, keep the input pristine for the next run
+        frame = frame.copy()
+        began = time.perf_counter()
+        _, circle = vp.process_chain(frame)
+        times.append(time.perf_counter() - began)
+        if circle[0] == 0 and circle[1] == 0 or not truth:
+            errors.append(float("nan"))
+        else:
+            errors.append(math.hypot(float(circle[0]) - truth[0], float(circle[1]) - truth[1]))
+    return times, errors
+
+
+def report(name, times, errors):
+    errors = np.array(errors)
+    found = errors[~np.isnan(errors)]
+    fps = len(times) / sum(times)
+    print("%-12s %7.1f fps  %6.2f ms/frame  %5.1f%% found  %5.2f px mean error" % (
+        name, fps, 1000 * np.mean(times), 100 * len(found) / len(errors), np.mean(found) if len(found) else float("nan")))
+    return fps
+
+
+def bench_roi(args):
+    frames = list(synthetic_frames(BOUNDARIES, args.frames, noise=args.noise))
+    full = report("full frame", *run_chain(make_processor(), frames))
+    vp = make_processor("--roi")
+    roi = report("roi", *run_chain(vp, frames))
+    print("speedup x%.2f  %s" % (roi / full, vp.roi_tracker.stats()))
+
+
+def bench_pyramid(args):
+    if args.dir:
+        frames = load_frames(args.dir)
+        if any(truth is None for _, truth in frames):
+            # no labels, so single scale is the reference
+            reference = make_processor()
+            labelled = []
+            for frame, truth in frames:
+                _, circle = reference.process_chain(frame.copy())
+                labelled.append((frame, None if circle[0] == 0 and circle[1] == 0 else [float(c) for c in circle]))
+            frames = labelled
+    else:
+        frames = list(synthetic_frames(BOUNDARIES, args.frames, radius=args.radius, noise=args.noise))
+    base = report("single", *run_chain(make_processor("--target-radius", str(args.radius + 5)), frames))
+    for scale in ("2", "4", "auto"):
+        vp = make_processor("--pyramid", scale, "--target-radius", str(args.radius + 5))
+        fps = report("pyramid/" + str(vp.pyramid_scale) + (" (auto)" if scale == "auto" else ""), *run_chain(vp, frames))
+        print("  speedup x%.2f" % (fps / base))
+
+
+def frame_allocations(vp, frames, warmup=10):
+    """
+    Measure what process_chain allocates per frame once warmed up
+    :returns -> ([float], [int]): per-frame seconds, per-frame peak bytes
+                                  allocated (as seen by tracemalloc)
+    """
+    for frame, _ in frames[:warmup]:
+        vp.process_chain(frame)
+    times = []
+    peaks = []
+    tracemalloc.start()
+    try:
+        for frame, _ in frames[warmup:]:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            began = time.perf_counter()
+            vp.process_chain(frame)
+            times.append(time.perf_counter() - began)
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return times, peaks
+
+
+def bench_alloc(args):
+    """
+    Fails (exit code 1) if any steady state frame w/ the pool on allocates
+        more than --large bytes in one go
+    """
+    frames = list(synthetic_frames(BOUNDARIES, args.frames, noise=args.noise))
+    # a noisy grey background lights up the loose non-green ranges everywhere,
+    #   which only measures HoughCircles drowning in edges, so that mode is clean
+    clean = list(synthetic_frames(BOUNDARIES, args.frames, noise=0))
+    modes = [("single", []), ("roi", ["--roi"]), ("pyramid", ["--pyramid", "2"]), ("all colours", [])]
+    failed = False
+    for name, flags in modes:
+        for pooled in (False, True):
+            vp = make_processor(*flags)
+            vp.pool.enabled = pooled
+            if name == "all colours":
+                vp.set_color_ranges(vp_module.TARGET_RANGES)
+            times, peaks = frame_allocations(vp, clean if name == "all colours" else frames)
+            large = sum(1 for peak in peaks if peak > args.large)
+            print("%-12s %-8s %6.2f ms/frame  %8.1f KiB peak alloc/frame  %4d frames over %d B" % (
+                name, "pool" if pooled else "no pool", 1000 * np.mean(times), max(peaks) / 1024.0, large, args.large))
+            failed = failed or (pooled and large > 0)
+    if failed:
+        print("FAIL: large per-frame allocations w/ the pool on")
+        sys.exit(1)
+
+
+def make_generator():
+    """
+    AudioGenerator w/o a lidar or speaker
+    """
+    return AudioGenerator(BOUNDARIES, AudioEngine(NullSink()), lidar=False)
+
+
+def measure(fn, inputs, allocations=True):
+    """
+    Time fn over every input, optionally watching allocations
+    :fn -> callable: called once per input
+    :inputs -> [...]: arguments, one call each
+    :returns -> (dict, [...]): latency/alloc stats, fn's results
+    """
+    times = []
+    peaks = []
+    results = []
+    if allocations:
+        tracemalloc.start()
+    try:
+        for item in inputs:
+            if allocations:
+                base = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+            began = time.perf_counter()
+            results.append(fn(item))
+            times.append(time.perf_counter() - began)
+            if allocations:
+                peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        if allocations:
+            tracemalloc.stop()
+    times = np.array(times) * 1000
+    stats = {
+        "calls": len(times),
+        "mean_ms": float(np.mean(times)),
+        "p50_ms": float(np.percentile(times, 50)),
+        "p90_ms": float(np.percentile(times, 90)),
+        "p99_ms": float(np.percentile(times, 99)),
+        "max_ms": float(np.max(times)),
+        "per_sec": float(1000 * len(times) / np.sum(times)),
+    }
+    if allocations:
+        stats["alloc_peak_kib"] = float(max(peaks) / 1024.0)
+        stats["alloc_mean_kib"] = float(np.mean(peaks) / 1024.0)
+    return stats, results
+
+
+def score(circles, truths):
+    """
+    Detection accuracy against ground truth. A hit counts as correct when
+        it is within max(5, r/2) px of the true center.
+    :circles -> [[x,y,...]]: process_chain results, [0, 0] for none
+    :truths -> [[x, y, r] or []]: ground truth, [] for no target
+    :returns -> dict: accuracy stats
+    """
+    errors = []
+    correct = missed = false_positives = targets = 0
+    for circle, truth in zip(circles, truths):
+        found = not (circle[0] == 0 and circle[1] == 0)
+        if not truth:
+            false_positives += int(found)
+            continue
+        targets += 1
+        if not found:
+            missed += 1
+            continue
+        error = math.hypot(float(circle[0]) - truth[0], float(circle[1]) - truth[1])
+        errors.append(error)
+        correct += int(error <= max(5, truth[2] / 2))
+    return {
+        "targets": targets,
+        "recall": correct / targets if targets else 0.0,
+        "missed": missed,
+        "false_positives": false_positives,
+        "error_px_mean": float(np.mean(errors)) if errors else None,
+        "error_px_p90": float(np.percentile(errors, 90)) if errors else None,
+    }
+
+
+SCENARIOS = {
+    "baseline": {},
+    "small": {"radius": 12},
+    "large": {"radius": 38},
+    "noisy": {"noise": 16},
+    "dim": {"lighting": 0.6},
+    "bright-gradient": {"lighting": 1.3, "gradient": 0.4},
+}
+
+MODES = {
+    "single": [],
+    "roi": ["--roi"],
+    "pyramid": ["--pyramid", "auto"],
+    "contour": ["--detector", "contour"],
+}
+
+
+def bench_detection(args, results):
+    sets = {}
+    for name, scenario in SCENARIOS.items():
+        options = {"radius": 25, "noise": args.noise}
+        options.update(scenario)
+        sets[name] = (list(synthetic_frames(BOUNDARIES, args.frames, empty_every=10, **options)), options["radius"])
+    if args.dir:
+        recorded = load_frames(args.dir)
+        if all(truth is not None for _, truth in recorded):
+            sets["recorded"] = (recorded, 40)
+        else:
+            print("skipping accuracy for " + args.dir + ", it has no labels.json")
+            sets["recorded"] = ([(frame, []) for frame, _ in recorded], 40)
+
+    for set_name, (frames, radius) in sets.items():
+        for mode, flags in MODES.items():
+            vp = make_processor("--target-radius", str(max(40, radius + 5)), *flags)
+            for frame, _ in frames[:5]:
+                vp.process_chain(frame.copy())
+            if vp.roi_tracker is not None:
+                vp.roi_tracker.reset()
+            inputs = [frame.copy() for frame, _ in frames]
+            stats, outputs = measure(lambda frame: vp.process_chain(frame)[1], inputs)
+            if set_name != "recorded" or args.dir and all(truth for _, truth in frames):
+                stats.update(score(outputs, [truth for _, truth in frames]))
+            results["process_chain/" + mode + "/" + set_name] = stats
+
+    # the stages of the single scale chain, on the baseline set
+    vp = make_processor()
+    frames = [frame for frame, _ in sets["baseline"][0]]
+    results["stage/segment"] = measure(vp._process_segment, frames)[0]
+    masks = [vp._process_segment(frame).copy() for frame in frames]
+    results["stage/blur"] = measure(vp._proc_blur, masks)[0]
+    blurred = [vp._proc_blur(mask).copy() for mask in masks]
+    results["stage/hough"] = measure(vp._find_circles, blurred)[0]
+    results["stage/contour"] = measure(make_processor("--detector", "contour")._find_circles, blurred)[0]
+
+    rng = np.random.default_rng(1)
+    for count in (1, 4, 16):
+        candidates = [rng.uniform(0, BOUNDARIES[0], (1, count, 3)).astype(np.float32) for _ in range(args.frames)]
+        results["discard_worst/" + str(count)] = measure(vp.discard_worst, candidates)[0]
+        results["track/" + str(count)] = measure(TargetTracker(BOUNDARIES).update, candidates)[0]
+
+
+def bench_audio(args, results):
+    au = make_generator()
+    rng = np.random.default_rng(2)
+    circles = [[int(x), int(y)] for x, y in zip(rng.integers(0, BOUNDARIES[0], args.frames), rng.integers(0, BOUNDARIES[1], args.frames))]
+    results["audio/process_circle"] = measure(au.process_circle, circles)[0]
+    au.table.lookup(circles[0])
+    results["audio/table_lookup"] = measure(au.table.lookup, circles)[0]
+    cues = [au.process_circle(circle) for circle in circles[:args.sounds]]
+    results["audio/generate_sound"] = measure(lambda cue: au.generate_sound(*cue), cues)[0]
+    results["audio/render_sound"] = measure(lambda cue: au.render_sound(*cue), cues)[0]
+    results["audio/get_sound_cold"] = measure(lambda cue: au.get_sound(*cue), cues)[0]
+    results["audio/get_sound_warm"] = measure(lambda cue: au.get_sound(*cue), cues)[0]
+    results["audio/cache"] = au.cache.stats()
+
+
+def bench_suite(args):
+    """
+    Run every benchmark, print a table and optionally write it all to json:
+        process_chain/<mode>/<scenario>  latency, allocations, accuracy
+        stage/<segment|blur|hough|contour> per-stage latency
+        discard_worst/<n>, track/<n>     picking from n candidates, w/o and w/ tracking
+        audio/...                        cue computation & rendering
+    """
+    results = {}
+    bench_detection(args, results)
+    bench_audio(args, results)
+    print("%-36s %9s %9s %9s %10s %10s %7s" % ("", "p50 ms", "p99 ms", "per sec", "alloc KiB", "recall", "FP"))
+    for name, stats in results.items():
+        if "p50_ms" not in stats:
+            print("%-36s %s" % (name, stats))
+            continue
+        print("%-36s %9.3f %9.3f %9.0f %10.1f %10s %7s" % (
+            name, stats["p50_ms"], stats["p99_ms"], stats["per_sec"], stats.get("alloc_peak_kib", 0.0),
+            "%.3f" % stats["recall"] if "recall" in stats else "", stats.get("false_positives", "")))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"meta": metadata(args), "results": results}, f, indent=2)
+        print("wrote " + args.json)
+
+
+def metadata(args):
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                         cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "frames": args.frames,
+        "pi_budget": args.pi,
+    }
+
+
+def bench_compare(args):
+    """
+    Compare two suite json files. Latency (p50/p99) going up or recall
+        going down by more than --tolerance is flagged, exit code 1 if any.
+    """
+    with open(args.old) as f:
+        old = json.load(f)["results"]
+    with open(args.new) as f:
+        new = json.load(f)["results"]
+    regressions = 0
+    for name in sorted(set(old) & set(new)):
+        for metric, worse_if_higher in (("p50_ms", True), ("p99_ms", True), ("recall", False)):
+            if metric not in old[name] or metric not in new[name]:
+                continue
+            a, b = old[name][metric], new[name][metric]
+            if not a:
+                continue
+            change = (b - a) / a
+            flag = change > args.tolerance if worse_if_higher else change < -args.tolerance
+            regressions += int(flag)
+            if flag or args.verbose:
+                print("%s %-36s %-7s %9.3f -> %9.3f (%+.1f%%)" % ("!!" if flag else "  ", name, metric, a, b, 100 * change))
+    print(str(regressions) + " regressions")
+    if regressions:
+        sys.exit(1)
+
+
+class ListSource(FrameSource):
+    """
+    Frames from a list, w/ a made up lidar range per frame
+    """
+    def __init__(self, frames, lidar=None):
+        super().__init__(BOUNDARIES)
+        self.items = frames
+        self.lidar = lidar
+
+    def frames(self, reuse=False):
+        for i, frame in enumerate(self.items):
+            if self.lidar is not None:
+                self.lidar.current = 4000 + 50 * i
+            yield frame.copy()
+
+
+def replay_session(directory, record_to, speed=0.0, flags=()):
+    """
+    Run a recorded session through run_local, recording the outputs again
+    :returns -> (float, int): seconds it took, frames replayed
+    """
+    vp = VideoProcessor(BOUNDARIES, make_generator(),
+                        argv=["--greedy", "--audio", "--replay", directory, "--replay-speed", str(speed),
+                              "--record-session", record_to] + list(flags), configure=False)
+    vp.configure_replay()
+    began = time.perf_counter()
+    vp.run_local()
+    elapsed = time.perf_counter() - began
+    vp.session.close()
+    return elapsed, vp.session.count
+
+
+def bench_replay(args):
+    """
+    Record a session (synthetic unless --session is given), replay it at
+        full speed and check every circle & cue comes out the same, then
+        replay it in real time to check the pacing
+    """
+    scratch = tempfile.mkdtemp(prefix="bavi-session-")
+    try:
+        session = args.session
+        if session is None:
+            session = os.path.join(scratch, "recorded")
+            au = make_generator()
+            au.lidar = ReplayLidar()
+            vp = VideoProcessor(BOUNDARIES, au, argv=["--greedy", "--audio", "--record-session", session],
+                                configure=False)
+            frames = [frame for frame, _ in synthetic_frames(BOUNDARIES, args.frames, args.radius, args.noise, empty_every=15)]
+            vp.source = ListSource(frames, au.lidar)
+            vp.run_local()
+            vp.session.close()
+        recorded = SessionReader(session)
+        size = os.path.getsize(os.path.join(session, "frames.raw"))
+        print("session: %d frames, %.1f MB, %s" % (len(recorded), size / 1e6, session))
+
+        elapsed, count = replay_session(session, os.path.join(scratch, "fast"), 0.0)
+        print("max speed  %7.1f fps  %s" % (count / elapsed, recorded.compare(SessionReader(os.path.join(scratch, "fast")))))
+        elapsed, count = replay_session(session, os.path.join(scratch, "realtime"), 1.0)
+        duration = recorded.index["stamp"][-1] if len(recorded) else 0.0
+        print("real time  %7.1f fps  %.2f s for a %.2f s session  %s" % (
+            count / elapsed, elapsed, duration, recorded.compare(SessionReader(os.path.join(scratch, "realtime")))))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def bench_tiles(args):
+    """
+    Tiled detection over 1..--max-workers processes vs the single process
+        chain. Agreement is the share of frames where both pick the same
+        greedy circle (w/in 2 px).
+    """
+    frames = list(synthetic_frames(BOUNDARIES, args.frames, args.radius, args.noise, empty_every=10))
+    reference = make_processor()
+    times, errors = run_chain(reference, frames)
+    report("1 process", times, errors)
+    expected = [reference.process_chain(frame.copy())[1] for frame, _ in frames]
+    base = np.mean(times)
+    for workers in range(1, args.max_workers + 1):
+        vp = make_processor("--workers", str(workers), "--tiles", args.tiles)
+        try:
+            for frame, _ in frames[:5]:
+                vp.process_chain(frame.copy())
+            times, errors = run_chain(vp, frames)
+            same = 0
+            for (frame, _), want in zip(frames, expected):
+                got = vp.process_chain(frame.copy())[1]
+                same += int(abs(float(got[0]) - float(want[0])) <= 2 and abs(float(got[1]) - float(want[1])) <= 2)
+            report(str(workers) + " workers", times, errors)
+            print("    x%.2f vs 1 process, %.1f%% agree, %s" % (base / np.mean(times), 100.0 * same / len(frames), vp.tiled.stats()))
+        finally:
+            vp.tiled.close()
+
+
+def bench_detectors(args):
+    """
+    Every --detector backend side by side on every scenario: the detect
+        step alone on the same blurred masks, and the whole process_chain
+        w/ accuracy. Plus a scene w/ a second, non-round green blob, which
+        only the shape checks keep out.
+    """
+    scenarios = dict(SCENARIOS)
+    scenarios["distractor"] = {}
+    print("%-16s %-8s %9s %9s %9s %8s %4s %9s" % ("", "", "detect ms", "chain ms", "chain p99", "recall", "FP", "error px"))
+    for name, scenario in scenarios.items():
+        options = {"radius": 25, "noise": args.noise}
+        options.update(scenario)
+        frames = list(synthetic_frames(BOUNDARIES, args.frames, empty_every=10, **options))
+        if name == "distractor":
+            for frame, _ in frames:
+                cv2.rectangle(frame, (20, 20), (140, 45), (0, 200, 0), -1)
+        truths = [truth for _, truth in frames]
+        radius = max(40, options["radius"] + 5)
+        for detector in DETECTORS:
+            vp = make_processor("--target-radius", str(radius), "--detector", detector)
+            masks = [vp._process_mask(frame).copy() for frame, _ in frames]
+            detect = measure(vp._find_circles, masks, allocations=False)[0]
+            chain, outputs = measure(lambda frame: vp.process_chain(frame)[1], [frame.copy() for frame, _ in frames],
+                                     allocations=False)
+            accuracy = score(outputs, truths)
+            print("%-16s %-8s %9.3f %9.3f %9.3f %8.3f %4d %9s" % (
+                name, detector, detect["p50_ms"], chain["p50_ms"], chain["p99_ms"], accuracy["recall"],
+                accuracy["false_positives"], "%.2f" % accuracy["error_px_mean"] if accuracy["error_px_mean"] is not None else "-"))
+
+
+class SidewaysSource(ListSource):
+    """
+    ListSource that says its frames need PiCameraSource's 270 degree rotation
+    """
+    def __init__(self, frames):
+        super().__init__(frames)
+        self.transform = cv2.getRotationMatrix2D((BOUNDARIES[0] // 2, BOUNDARIES[1] // 2), 270, 1.0)
+
+
+def bench_orient(args):
+    """
+    The old pi front end (warpAffine every frame, detect on the rotated
+        frame) vs detecting on the frame as captured and moving the circles
+        through the rotation. Every frame must agree on whether there is a
+        target, and on where: w/in 0.5 px for contours, w/in an accumulator
+        cell (2 * dp px) for Hough, whose accumulator grid doesn't rotate w/
+        the frame. Error against the true position is printed for both.
+        A few targets sit near the sensor edges, where the rotation crops
+        them out of the output frame.
+    """
+    labelled = list(synthetic_frames(BOUNDARIES, args.frames, args.radius, args.noise, empty_every=10))
+    rng = np.random.default_rng(4)
+    for x in (30, 70, 110, 530, 570, 610):
+        frame = (np.full((BOUNDARIES[1], BOUNDARIES[0], 3), 60, np.uint8) +
+                 rng.normal(0, args.noise, (BOUNDARIES[1], BOUNDARIES[0], 3))).clip(0, 255).astype(np.uint8)
+        cv2.circle(frame, (x, 240), args.radius, (0, 200, 0), -1)
+        labelled.append((frame, [x, 240, args.radius]))
+    frames = [frame for frame, _ in labelled]
+    source = SidewaysSource(frames)
+    truths = []
+    for _, truth in labelled:
+        if truth:
+            x, y = source.transform[:, :2] @ np.array(truth[:2]) + source.transform[:, 2]
+            truth = [x, y, truth[2]] if 0 <= x < BOUNDARIES[0] and 0 <= y < BOUNDARIES[1] else []
+        truths.append(truth)
+    size = (BOUNDARIES[0], BOUNDARIES[1])
+    failed = False
+    for detector in DETECTORS:
+        # picked w/o the tracker, it would coast over the empty frames & blur the comparison
+        old = make_processor("--detector", detector, "--no-track")
+        new = make_processor("--detector", detector, "--no-track")
+        new.source = source
+        new.orient_outputs()
+
+        def rotate_first(frame):
+            return old.process_chain(cv2.warpAffine(frame, source.transform, size, dst=old.pool.get("rotated", size[1], size[0], 3)))[1]
+
+        def map_after(frame):
+            return new.process_chain(frame)[1]
+
+        rotate_first(frames[0].copy())
+        map_after(frames[0].copy())
+        before, expected = measure(rotate_first, [frame.copy() for frame in frames], allocations=False)
+        after, got = measure(map_after, [frame.copy() for frame in frames], allocations=False)
+        tolerance = 2 * old.hough_dp if detector == "hough" else 0.5
+        found_differs = circle_differs = 0
+        worst = 0.0
+        for want, have in zip(expected, got):
+            want_found = not (want[0] == 0 and want[1] == 0)
+            have_found = not (have[0] == 0 and have[1] == 0)
+            if want_found != have_found:
+                found_differs += 1
+            elif want_found:
+                error = math.hypot(float(want[0]) - float(have[0]), float(want[1]) - float(have[1]))
+                worst = max(worst, error)
+                circle_differs += int(error > tolerance)
+        print("%-8s rotate frame %6.3f ms   rotate circles %6.3f ms   x%.2f" % (
+            detector, before["p50_ms"], after["p50_ms"], before["mean_ms"] / after["mean_ms"]))
+        print("         %d frames: found differs %d, circle differs %d, max %.2f px apart, "
+              "error vs truth %.2f -> %.2f px" % (len(frames), found_differs, circle_differs, worst,
+                                                 score(expected, truths)["error_px_mean"], score(got, truths)["error_px_mean"]))
+        failed = failed or found_differs or circle_differs
+    if failed:
+        print("FAIL: rotating the circles doesn't match rotating the frames")
+        sys.exit(1)
+
+
+def two_targets(count, radius=25, noise=8, spread=80, jitter=3.0, seed=6):
+    """
+    Two targets either side of the center, both jittering, so which one is
+        closer to the center changes all the time. The left one drifts off
+        screen for a while in the middle.
+    :returns -> [(frame, [[x, y, r], ...])]: frames w/ every target's true position
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for i in range(count):
+        frame = np.full((BOUNDARIES[1], BOUNDARIES[0], 3), 60, np.uint8)
+        truth = []
+        for side in (-1, 1):
+            x = BOUNDARIES[0] / 2 + side * spread + rng.normal(0, jitter)
+            y = BOUNDARIES[1] / 2 + rng.normal(0, jitter)
+            if side < 0 and count // 2 <= i < count // 2 + count // 10:
+                continue
+            cv2.circle(frame, (int(round(x)), int(round(y))), radius, (0, 200, 0), -1)
+            truth.append([x, y, radius])
+        frame = (frame + rng.normal(0, noise, frame.shape)).clip(0, 255).astype(np.uint8)
+        frames.append((frame, truth))
+    return frames
+
+
+def bench_tracker(args):
+    """
+    discard_worst vs TargetTracker w/ two targets in view: how often the
+        greedy pick jumps between them, what that does to the cue updates
+        (through a CuePolicy, frames 1/30 s apart) and what picking costs
+        per frame. Then the same detections w/ some of them dropped at
+        random, like Hough missing a small target now & then
+    """
+    frames = two_targets(args.frames, args.radius, args.noise)
+    print("%-10s %6s %8s %8s %10s %10s" % ("", "flips", "found", "updates", "pick us", "chain ms"))
+    for name, flags in (("nearest", ["--no-track"]), ("tracked", [])):
+        vp = make_processor(*flags)
+        policy = CuePolicy(make_generator())
+        picks = []
+        chain = 0.0
+        for i, (frame, _) in enumerate(frames):
+            began = time.perf_counter()
+            _, circle = vp.process_chain(frame.copy())
+            chain += time.perf_counter() - began
+            if circle[0] == 0 and circle[1] == 0:
+                picks.append(None)
+                policy.reset()
+                continue
+            policy.decide([int(round(circle[0])), int(round(circle[1]))], now=i / 30.0)
+            picks.append(int(circle[0] > BOUNDARIES[0] / 2))
+        seen = [p for p in picks if p is not None]
+        flips = sum(a != b for a, b in zip(seen, seen[1:]))
+        candidates = [vp._find_circles(vp._process_mask(frame)) for frame, _ in frames]
+        if vp.tracker is not None:
+            vp.tracker.reset()
+        cost = measure(vp.pick, candidates, allocations=False)[0]
+        print("%-10s %6d %8d %8d %10.1f %10.3f" % (name, flips, len(seen), policy.updates, 1000 * cost["mean_ms"],
+                                                  1000 * chain / len(frames)))
+        if vp.tracker is not None:
+            print("           %s" % vp.tracker.stats())
+
+    print("%-10s %6s %6s %8s %8s" % ("", "missed", "flips", "found", "switches"))
+    for miss in (0.1, 0.25):
+        rng = np.random.default_rng(8)
+        dropped = []
+        for circles in candidates:
+            if circles is not None:
+                circles = circles[:, rng.random(circles.shape[1]) >= miss]
+                if not circles.shape[1]:
+                    circles = None
+            dropped.append(circles)
+        for name, flags in (("nearest", ["--no-track"]), ("tracked", [])):
+            vp = make_processor(*flags)
+            picks = [vp.pick(circles) for circles in dropped]
+            seen = [int(p[0] > BOUNDARIES[0] / 2) for p in picks if p is not None]
+            flips = sum(a != b for a, b in zip(seen, seen[1:]))
+            switches = vp.tracker.switches if vp.tracker is not None else flips
+            print("%-10s %5.0f%% %6d %8d %8d" % (name, 100 * miss, flips, len(seen), switches))
+
+
+def hold_and_move(count, radius=25, noise=8, segment=45, seed=7):
+    """
+    A target held still for `segment` frames, then moved to a new spot over
+        the next `segment`, and so on
+    :returns -> [(frame, [x, y, r], bool)]: frame, truth, whether the target is moving
+    """
+    rng = np.random.default_rng(seed)
+    background = np.full((BOUNDARIES[1], BOUNDARIES[0], 3), 60, np.uint8)
+    spots = [(BOUNDARIES[0] * rng.uniform(0.25, 0.75), BOUNDARIES[1] * rng.uniform(0.25, 0.75))
+             for _ in range(count // segment + 2)]
+    frames = []
+    for i in range(count):
+        leg, step = divmod(i, segment)
+        (x0, y0), (x1, y1) = spots[leg // 2], spots[leg // 2 + 1]
+        amount = 0.0 if leg % 2 == 0 else (step + 1) / segment
+        x, y = x0 + (x1 - x0) * amount, y0 + (y1 - y0) * amount
+        frame = background.copy()
+        cv2.circle(frame, (int(round(x)), int(round(y))), radius, (0, 200, 0), -1)
+        frame = (frame + rng.normal(0, noise, frame.shape)).clip(0, 255).astype(np.uint8)
+        frames.append((frame, [x, y, radius], leg % 2 == 1))
+    return frames
+
+
+def bench_duty(args):
+    """
+    Detecting every frame vs --duty-cycle on a target that's held still and
+        moved in turns, at 30 fps: how many frames get detected on, the time
+        spent per frame, how old the detection the cue gets is, how many
+        frames it takes to notice the target started moving, and how far the
+        reused circle is from where the target really is
+    """
+    frames = hold_and_move(args.frames, args.radius, args.noise)
+    fps = 30.0
+    print("%-18s %7s %9s %11s %11s %6s %11s %11s" % ("", "detect", "ms/frame", "age mean ms", "age max ms",
+                                                      "onset", "err hold px", "err move px"))
+    runs = [("every frame", [])]
+    for min_rate in (2, 5, 10):
+        runs.append(("duty, min %d/s" % min_rate, ["--duty-cycle", "--min-rate", str(min_rate)]))
+    for name, flags in runs:
+        vp = make_processor(*flags)
+        ages = []
+        errors = {True: [], False: []}
+        onsets = []
+        started = None
+        detected_at = 0.0
+        spent = 0.0
+        for i, (frame, truth, moving) in enumerate(frames):
+            now = i / fps
+            before = vp.duty.detected if vp.duty is not None else i
+            began = time.perf_counter()
+            _, circle = vp.detect(frame.copy(), now)
+            spent += time.perf_counter() - began
+            if moving and not frames[i - 1][2]:
+                started = i
+            if vp.duty is None or vp.duty.detected > before:
+                detected_at = now
+                if started is not None:
+                    # frames from the first moved frame to the first detection after it
+                    onsets.append(i - started)
+                    started = None
+            ages.append(now - detected_at)
+            if not (circle[0] == 0 and circle[1] == 0):
+                errors[moving].append(math.hypot(float(circle[0]) - truth[0], float(circle[1]) - truth[1]))
+        detections = vp.duty.detected if vp.duty is not None else len(frames)
+        print("%-18s %6.1f%% %9.3f %11.1f %11.1f %6.1f %11.2f %11.2f" % (
+            name, 100.0 * detections / len(frames), 1000 * spent / len(frames), 1000 * np.mean(ages),
+            1000 * max(ages), np.mean(onsets), np.mean(errors[False]), np.mean(errors[True])))
+
+
+def cue_grid(au, count, seed=3):
+    """
+    :returns -> [(balance, volume, distance, classification)]: quantized cues
+                for random target positions, all 4 classifications included
+    """
+    rng = np.random.default_rng(seed)
+    cues = set()
+    for x, y in zip(rng.integers(0, BOUNDARIES[0], count * 4), rng.integers(0, BOUNDARIES[1], count * 4)):
+        cues.add(au.quantize(*au.process_circle([int(x), int(y)])))
+    cues.add(au.quantize(*au.process_circle([BOUNDARIES[0] // 2, BOUNDARIES[1] // 2])))
+    return sorted(cues, key=str)[:count]
+
+
+def swap_clicks(au, cues, swaps=200):
+    """
+    Play random cue switches through the engine and measure the worst jump
+        between two consecutive samples, relative to the steepest a clean
+        tone at full scale gets (2 pi f / rate * 32767)
+    """
+    rng = np.random.default_rng(4)
+    sink = au.engine.sink
+    au.engine.silence()
+    sink.pull(2)
+    worst = 0.0
+    for _ in range(swaps):
+        previous = np.frombuffer(sink.pull(1), np.int16).reshape(-1, 2)[-1:].astype(np.int32)
+        cue = cues[rng.integers(len(cues))]
+        au.engine.update(au.render_sound(*cue), *cue)
+        # swap lands at a random point of the old cue
+        data = np.frombuffer(sink.pull(1 + rng.integers(3)), np.int16).reshape(-1, 2).astype(np.int32)
+        jumps = np.abs(np.diff(np.concatenate([previous, data]), axis=0))
+        worst = max(worst, float(jumps.max()))
+    return worst / (2 * math.pi * au.bulls_freq / au.engine.sample_rate * 32767)
+
+
+def seam_dip(au, classification, loops=3, window=441):
+    """
+    Loop one cycle of a continuous cue the way the engine does and compare
+        the loudness right on each seam w/ the rest of the loop
+    :window -> int: frames per RMS window, 10 ms is a few periods of the tone
+    :returns -> float: quietest seam window over the median window, 1.0 for no dip
+    """
+    pcm = np.frombuffer(au.render_sound(0.0, 0.0, 0.0, classification), np.int16).reshape(-1, 2)
+    cycle = len(pcm)
+    mono = np.tile(pcm, (loops, 1)).astype(np.float64).max(axis=1)
+    rms = lambda start: math.sqrt(np.mean(mono[start:start + window] ** 2))
+    median = np.median([rms(start) for start in range(0, len(mono) - window, window)])
+    return min(rms(seam - window // 2) for seam in range(cycle, len(mono), cycle)) / median
+
+
+def bench_synth(args):
+    """
+    Render the cue grid w/ pydub and w/ ToneSynth, check the pydub-compatible
+        synth settings reproduce pydub and that the continuous cues loop
+        w/o a dip at the seam (exits 1 if not), then compare clicks on cue
+        switches
+    """
+    au = make_generator()
+    cues = cue_grid(au, args.sounds)
+    print("%d cues: %s" % (len(cues), sorted(set(cue[3].name for cue in cues))))
+    legacy = lambda cue: au.engine.to_pcm(au.generate_sound(*cue))
+    compat = ToneSynth(au.engine.sample_rate, pan_law="pydub", phase_frames=0, fade=0)
+    stats, old = measure(legacy, cues)
+    print("pydub         p50 %7.3f ms  p99 %7.3f ms  alloc %8.1f KiB" % (stats["p50_ms"], stats["p99_ms"], stats["alloc_peak_kib"]))
+    stats, same = measure(lambda cue: compat.pcm(*au.cue_pattern(*cue)), cues)
+    print("synth/pydub   p50 %7.3f ms  p99 %7.3f ms  alloc %8.1f KiB" % (stats["p50_ms"], stats["p99_ms"], stats["alloc_peak_kib"]))
+    stats, _ = measure(lambda cue: au.synth.pcm(*au.cue_pattern(*cue)), cues)
+    print("synth         p50 %7.3f ms  p99 %7.3f ms  alloc %8.1f KiB" % (stats["p50_ms"], stats["p99_ms"], stats["alloc_peak_kib"]))
+
+    lengths = sum(len(a) != len(b) for a, b in zip(old, same))
+    worst = max(int(np.abs(np.frombuffer(a, np.int16).astype(np.int32) - np.frombuffer(b, np.int16)).max())
+                for a, b in zip(old, same) if len(a) == len(b) and len(a))
+    print("equivalence: %d/%d lengths differ, max sample diff %d LSB" % (lengths, len(cues), worst))
+    failed = lengths > 0 or worst > 1
+    for classification in (au.Classification.WIDE_LEFT, au.Classification.WIDE_RIGHT, au.Classification.BULLS):
+        dip = seam_dip(au, classification)
+        print("loop seam: %-10s quietest seam window x%.2f of the median" % (classification.name, dip))
+        failed = failed or dip < 0.9
+
+    old_synth, old_crossfade, old_phase = au.synth, au.engine.crossfade_frames, au.engine.phase_frames
+    au.synth, au.engine.crossfade_frames, au.engine.phase_frames = None, 0, 0
+    before = swap_clicks(au, cues)
+    au.synth, au.engine.crossfade_frames, au.engine.phase_frames = old_synth, old_crossfade, old_phase
+    after = swap_clicks(au, cues)
+    print("worst step on cue switches: pydub, hard cut x%.1f   synth, crossfade x%.1f  (x1 = a clean full scale tone)" % (before, after))
+    if failed:
+        print("FAIL: the pydub-compatible synth doesn't reproduce pydub, or a loop seam dips")
+        sys.exit(1)
+
+
+def shaky_aim(count, fps=30.0, jitter=2.0, seed=5):
+    """
+    A target drifting across the frame & settling on the center, w/ hand
+        tremor on top, as detection would report it
+    :returns -> [(t, [x, y])]
+    """
+    rng = np.random.default_rng(seed)
+    aim = []
+    for i in range(count):
+        settle = max(0.0, 1.0 - i / (0.6 * count))
+        x = BOUNDARIES[0] / 2 + settle * BOUNDARIES[0] * 0.45 * math.sin(i / 40.0) + rng.normal(0, jitter)
+        y = BOUNDARIES[1] / 2 + settle * BOUNDARIES[1] * 0.3 * math.sin(i / 57.0) + rng.normal(0, jitter)
+        aim.append((i / fps, [int(round(x)), int(round(y))]))
+    return aim
+
+
+def bench_policy(args):
+    """
+    Count the cue updates the old rule (every TRACK frame, plus every
+        classification change) sends vs CuePolicy, and how far the cue
+        playing drifts from the cue of the raw detection
+    """
+    au = make_generator()
+    aim = shaky_aim(args.frames * 10)
+    duration = aim[-1][0]
+
+    updates = flips = 0
+    last = None
+    for _, circle in aim:
+        cue = au.table.lookup(circle)
+        if cue[3] is au.Classification.TRACK or cue[3] is not last:
+            updates += 1
+        flips += int(last is not None and cue[3] is not last)
+        last = cue[3]
+    print("%-10s %6d updates  %5.1f/s  %5d classification changes" % ("old", updates, updates / duration, flips))
+
+    policy = CuePolicy(au)
+    flips = 0
+    last = None
+    drift = []
+    began = time.perf_counter()
+    for t, circle in aim:
+        policy.decide(circle, now=t)
+        playing = policy.issued
+        flips += int(last is not None and playing[3] is not last)
+        last = playing[3]
+        truth = au.table.lookup(circle)
+        drift.append(abs(playing[0] - truth[0]))
+    per_call = (time.perf_counter() - began) / len(aim)
+    print("%-10s %6d updates  %5.1f/s  %5d classification changes  %.1f us/decide" % (
+        "policy", policy.updates, policy.updates / duration, flips, per_call * 1e6))
+    print("suppressed: %s" % {k: v for k, v in policy.stats().items() if k != "updates"})
+    print("balance drift vs raw detection: mean %.3f  p90 %.3f" % (np.mean(drift), np.percentile(drift, 90)))
+
+
+# modules a plain `import VideoProcessor` shouldn't load, they're behind flags
+LAZY_MODULES = ("pydub", "pyaudio", "picamera", "http.server", "multiprocessing.shared_memory",
+                "PreviewServer", "TiledDetector")
+
+IMPORT_PROBE = """
+import sys, time
+began = time.perf_counter()
+import VideoProcessor
+print(time.perf_counter() - began)
+print(" ".join(m for m in %r if m in sys.modules))
+"""
+
+
+class SlowSink(NullSink):
+    """
+    NullSink that takes `delay` sec to open, like a real audio device
+    """
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+
+    def start(self, engine):
+        time.sleep(self.delay)
+        super().start(engine)
+
+
+class SlowGenerator(AudioGenerator):
+    """
+    AudioGenerator w/ a SlowSink engine & a lidar that takes lidar_delay sec to open
+    """
+    lidar_delay = 0.0
+
+    def open_lidar(self):
+        time.sleep(self.lidar_delay)
+        self.lidar = ReplayLidar()
+
+
+class SlowProcessor(VideoProcessor):
+    """
+    VideoProcessor whose camera takes camera_delay sec to come up and then
+        plays synthetic frames, and whose --audio generator is a SlowGenerator
+    """
+    camera_delay = 0.0
+    audio_delay = 0.0
+    frames_ = []
+
+    def configure_camera(self):
+        began = self.metrics.clock()
+        time.sleep(self.camera_delay)
+        self.source = ListSource(self.frames_)
+        self.metrics.record("startup.camera", began)
+
+    def start_audio(self, lidar=None):
+        self.audio_generator = SlowGenerator(BOUNDARIES, AudioEngine(SlowSink(self.audio_delay)), lidar=lidar,
+                                             metrics=self.metrics, defer=not self.args["serial_init"])
+
+
+def first_outputs(flags):
+    """
+    Start a SlowProcessor and run until the first frame is processed and the
+        first cue is audible (a non-silent engine buffer)
+    :returns -> (float, float): sec from construction to each
+    """
+    began = time.perf_counter()
+    vp = SlowProcessor(BOUNDARIES, argv=["--greedy", "--audio"] + ([] if vp_module.PI_CAMERA else ["--dev"]) + flags,
+                       metrics=Metrics(), configure=True)
+    frame_at = cue_at = None
+    try:
+        for frame in vp.frames(reuse=True):
+            frame, circles = vp.process_chain(frame)
+            if frame_at is None:
+                frame_at = time.perf_counter() - began
+            if circles[0] == 0 and circles[1] == 0:
+                continue
+            vp.cue_audio(circles)
+            if np.frombuffer(vp.audio_generator.engine.sink.pull(), np.int16).any():
+                cue_at = time.perf_counter() - began
+                break
+    finally:
+        vp.audio_generator.engine.stop()
+        vp.source.close()
+    return frame_at, cue_at
+
+
+def bench_startup(args):
+    """
+    Cold start. Import time of VideoProcessor in a fresh interpreter (and
+        which optional modules came along), then time to first processed
+        frame & first audible cue w/ the camera, audio device and lidar
+        simulated by delays, initialized serially vs in parallel
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for _ in range(args.repeat):
+        out = subprocess.check_output([sys.executable, "-W", "ignore", "-c", IMPORT_PROBE % (LAZY_MODULES,)],
+                                      cwd=here).decode().splitlines()
+        times.append(float(out[0]))
+    loaded = out[1].split() if len(out) > 1 else []
+    print("import VideoProcessor  median %.1f ms  min %.1f ms  optional modules loaded: %s" % (
+        1000 * np.median(times), 1000 * min(times), " ".join(loaded) or "none"))
+
+    SlowProcessor.camera_delay = args.camera_delay
+    SlowProcessor.audio_delay = args.audio_delay
+    SlowGenerator.lidar_delay = args.lidar_delay
+    SlowProcessor.frames_ = [frame for frame, _ in synthetic_frames(BOUNDARIES, 30, args.radius, args.noise)]
+    print("simulated init: camera %.2f s, audio %.2f s, lidar %.2f s" % (
+        args.camera_delay, args.audio_delay, args.lidar_delay))
+    for name, flags in (("serial", ["--serial-init"]), ("parallel", [])):
+        runs = [first_outputs(flags) for _ in range(args.repeat)]
+        print("%-9s first frame  %7.1f ms   first audible cue  %7.1f ms" % (
+            name, 1000 * np.median([r[0] for r in runs]), 1000 * np.median([r[1] for r in runs])))
+
+
+def parse_arguments():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--frames", type=int, default=300, help="number of synthetic frames")
+    common.add_argument("--noise", type=int, default=8, help="background noise std dev")
+    common.add_argument("--radius", type=int, default=25, help="synthetic target radius")
+    common.add_argument("--dir", default=None, help="directory of recorded frames to use instead of synthetic ones")
+    common.add_argument("--pi", action="store_true", help="pin to one core, no OpenCV threads")
+    common.add_argument("--large", type=int, default=64 * 1024, help="bytes that count as a large allocation")
+    common.add_argument("--sounds", type=int, default=20, help="cues rendered for the audio benchmarks")
+    common.add_argument("--json", default=None, help="write suite results to this file")
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="bench", required=True)
+    sub.add_parser("suite", parents=[common], help="every benchmark, optionally saved as json").set_defaults(fn=bench_suite)
+    compare = sub.add_parser("compare", help="diff two suite json files")
+    compare.add_argument("old")
+    compare.add_argument("new")
+    compare.add_argument("--tolerance", type=float, default=0.1, help="relative change that counts as a regression")
+    compare.add_argument("--verbose", action="store_true", help="show unchanged metrics too")
+    compare.set_defaults(fn=bench_compare, pi=False)
+    replay = sub.add_parser("replay", parents=[common], help="record & replay a session, check outputs match")
+    replay.add_argument("--session", default=None, help="replay this recorded session instead of a synthetic one")
+    replay.set_defaults(fn=bench_replay)
+    tiles = sub.add_parser("tiles", parents=[common], help="single process vs tiled --workers detection")
+    tiles.add_argument("--max-workers", type=int, default=4, help="largest pool to try")
+    tiles.add_argument("--tiles", default="2x2", help="tile grid, rows x cols")
+    tiles.set_defaults(fn=bench_tiles)
+    sub.add_parser("synth", parents=[common], help="NumPy cue synth vs pydub").set_defaults(fn=bench_synth)
+    sub.add_parser("policy", parents=[common], help="cue updates w/ and w/o CuePolicy").set_defaults(fn=bench_policy)
+    startup = sub.add_parser("startup", parents=[common], help="import time, time to first frame & first audible cue")
+    startup.add_argument("--repeat", type=int, default=5, help="runs per measurement, the median is reported")
+    startup.add_argument("--camera-delay", type=float, default=0.5, help="simulated camera init, sec")
+    startup.add_argument("--audio-delay", type=float, default=0.3, help="simulated audio device init, sec")
+    startup.add_argument("--lidar-delay", type=float, default=0.2, help="simulated lidar init, sec")
+    startup.set_defaults(fn=bench_startup)
+    sub.add_parser("detectors", parents=[common], help="Hough vs contour detection backends").set_defaults(fn=bench_detectors)
+    sub.add_parser("orient", parents=[common], help="rotated frames vs rotated circles, equivalence & cost").set_defaults(fn=bench_orient)
+    sub.add_parser("tracker", parents=[common], help="greedy pick w/ and w/o target tracking").set_defaults(fn=bench_tracker)
+    sub.add_parser("duty", parents=[common], help="detecting every frame vs --duty-cycle").set_defaults(fn=bench_duty)
+    sub.add_parser("roi", parents=[common], help="full frame vs predictive roi search").set_defaults(fn=bench_roi)
+    sub.add_parser("pyramid", parents=[common], help="single scale vs coarse-to-fine search").set_defaults(fn=bench_pyramid)
+    sub.add_parser("alloc", parents=[common], help="per-frame allocations w/ and w/o the buffer pool").set_defaults(fn=bench_alloc)
+    return ap.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.pi:
+        pi_budget()
+    args.fn(args)
@@ -0,0 +1,55 @@
+import numpy as np
+
+"""
+Preallocated image buffers for the per-frame pipeline.
+
+Every stage of process_chain used to hand back a brand new array, which on
+    the pi means a few MB of allocation churn per frame. Stages now ask the
+    pool for a named buffer and have OpenCV write into it through dst=, so
+    once the first frame has gone through, a frame allocates nothing big.
+
+Buffers are sized from boundaries. Smaller requests (roi windows, pyramid
+    levels, refinement patches) get a top-left view of the same memory, so a
+    window that changes size every frame doesn't allocate either.
+    A buffer is only valid until the next request for the same name.
+"""
+
+
+class BufferPool:
+    """
+    :boundaries -> [int, int]: x, y dimensions of a full frame
+    :enabled -> bool: False hands out fresh arrays every time, for comparisons
+    :allocations -> int: buffers allocated so far
+    """
+    def __init__(self, boundaries, enabled=True):
+        self.boundaries = boundaries
+        self.enabled = enabled
+        self.buffers = {}
+        self.allocations = 0
+
+    def get(self, name, height, width, channels=1, dtype=np.uint8):
+        """
+        :name -> str: what the buffer is for, one buffer per name
+        :returns -> np.array: height x width (x channels) view to write into
+        """
+        shape = (height, width) if channels == 1 else (height, width, channels)
+        if not self.enabled:
+            return np.empty(shape, dtype)
+        key = (name, channels, dtype)
+        full = self.buffers.get(key)
+        if full is None or full.shape[0] < height or full.shape[1] < width:
+            size = (max(height, self.boundaries[1]), max(width, self.boundaries[0]))
+            full = np.empty(size if channels == 1 else size + (channels,), dtype)
+            self.buffers[key] = full
+            self.allocations += 1
+        return full[:height, :width]
+
+    def like(self, name, image):
+        """
+        Buffer w/ the same shape & dtype as image
+        """
+        channels = image.shape[2] if image.ndim == 3 else 1
+        return self.get(name, image.shape[0], image.shape[1], channels, image.dtype)
+
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self.buffers.values())
@@ -0,0 +1,133 @@
+import time
+from Metrics import Metrics
+
+"""
+When to hand the audio engine a new cue.
+
+AudioGenerator.run used to re-render and swap the cue on every TRACK frame,
+    even when the target had moved a single pixel, and the classification
+    flickered whenever the target sat on a boundary. CuePolicy sits between
+    the detection and the engine:
+
+    smoothing   - circle coordinates go through an EMA, reset when the target
+                  jumps further than `jump` px or went missing
+    hysteresis  - a new classification is only taken once it holds w/ the
+                  circle nudged `hysteresis` px in every direction, so the
+                  target has to be properly across a boundary
+    min deltas  - w/in the same classification, an update only goes out if
+                  balance, pacing or volume moved at least min_* since the
+                  last cue we issued, and the quantized (= audible) cue changed
+    max rate    - same-classification updates are spaced at least
+                  1 / max_rate sec apart. Classification changes aren't held
+                  back, the hysteresis already debounces them
+
+Every suppressed update is counted by reason.
+"""
+
+
+class CuePolicy:
+    """
+    :generator -> AudioGenerator: owner of the cue table & quantization grid
+    :smoothing -> float: weight of the newest circle in the EMA, 1.0 for none
+    :jump -> float: px the target can move in one frame before we stop smoothing
+    :hysteresis -> int: px margin a new classification has to hold over
+    :min_balance/min_pacing/min_volume -> float: smallest change worth an update
+    :max_rate -> float: updates per second w/in one classification, 0 for no cap
+    :issued -> (balance, volume, pacing, classification): last cue let through
+    :suppressed -> {str: int}: suppressed updates by reason
+    """
+    reasons = ("hysteresis", "delta", "same", "rate")
+
+    def __init__(self, generator, smoothing=0.5, jump=80, hysteresis=4, min_balance=0.05,
+                 min_pacing=0.04, min_volume=0.5, max_rate=10.0, metrics=None):
+        self.generator = generator
+        self.smoothing = smoothing
+        self.jump = jump
+        self.hysteresis = hysteresis
+        self.min_balance = min_balance
+        self.min_pacing = min_pacing
+        self.min_volume = min_volume
+        self.max_rate = max_rate
+        self.metrics = metrics if metrics is not None else Metrics.metrics
+        self.suppressed = {reason: 0 for reason in self.reasons}
+        self.updates = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the target, e.g. after it was lost. The next cue always goes out.
+        """
+        self.position = None
+        self.issued = None
+        self.issued_key = None
+        self.issued_at = None
+
+    def smooth(self, circle):
+        """
+        :circle -> [x, y]: detected target
+        :returns -> [x, y]: smoothed target
+        """
+        if self.position is None or abs(circle[0] - self.position[0]) + abs(circle[1] - self.position[1]) > self.jump:
+            self.position = [float(circle[0]), float(circle[1])]
+        else:
+            a = self.smoothing
+            self.position[0] += a * (circle[0] - self.position[0])
+            self.position[1] += a * (circle[1] - self.position[1])
+        return [int(round(self.position[0])), int(round(self.position[1]))]
+
+    def holds(self, classification, circle, target_range):
+        """
+        Whether the cue classification is the same all around circle
+        """
+        h = self.hysteresis
+        lookup = self.generator.table.lookup
+        for dx, dy in ((-h, 0), (h, 0), (0, -h), (0, h)):
+            if lookup([circle[0] + dx, circle[1] + dy], target_range)[3] is not classification:
+                return False
+        return True
+
+    def decide(self, circle, target_range=-1, now=None):
+        """
+        Smooth the circle, work out its cue and decide whether to send it
+        :circle -> [x, y]: detected target
+        :target_range -> int: lidar range in mm, -1 if unknown
+        :now -> float: time.monotonic(), for testing
+        :returns -> (balance, volume, pacing, classification), or None to
+                    keep playing what's playing
+        """
+        now = time.monotonic() if now is None else now
+        circle = self.smooth(circle)
+        cue = self.generator.table.lookup(circle, target_range)
+        balance, volume, pacing, classification = cue
+        if self.issued is None:
+            return self.issue(cue, now)
+        last_balance, last_volume, last_pacing, last_classification = self.issued
+        if classification is not last_classification:
+            if self.hysteresis and not self.holds(classification, circle, target_range):
+                return self.suppress("hysteresis")
+            return self.issue(cue, now)
+        if abs(balance - last_balance) < self.min_balance and abs(pacing - last_pacing) < self.min_pacing \
+                and abs(volume - last_volume) < self.min_volume:
+            return self.suppress("delta")
+        if self.generator.quantize(*cue) == self.issued_key:
+            return self.suppress("same")
+        if self.max_rate and now - self.issued_at < 1.0 / self.max_rate:
+            return self.suppress("rate")
+        return self.issue(cue, now)
+
+    def issue(self, cue, now):
+        self.issued = cue
+        self.issued_key = self.generator.quantize(*cue)
+        self.issued_at = now
+        self.updates += 1
+        return cue
+
+    def suppress(self, reason):
+        self.suppressed[reason] += 1
+        self.metrics.count("cue.suppressed." + reason)
+        return None
+
+    def stats(self):
+        stats = {"updates": self.updates}
+        stats.update(self.suppressed)
+        return stats
@@ -0,0 +1,151 @@
+import numpy as np
+
+"""
+Precomputed cue lookup tables for AudioGenerator.
+
+AudioGenerator.process_circle() does a handful of pow/sqrt calls per frame,
+    and w/ the thresholds depending on the lidar range there is even more
+    math to do. None of it depends on anything but the pixel position and the
+    range band, so CueTable evaluates it once per band over the whole pixel
+    grid w/ NumPy. Turning a circle into a cue is then one indexed read.
+
+The table has an entry for every pixel, not for a coarser grid of cells:
+    snapping to the nearest cell moved targets across the WIDE/TRACK/BULLS
+    edges, so the cue came out different from process_circle's. A band is
+    ~1.2 MB at 640x480 and takes ~20 ms to build.
+
+Bands are built lazily the first time they are hit, and all of them are
+    thrown away when any threshold on the generator changes.
+"""
+
+
+class CueTable:
+    """
+    :generator -> AudioGenerator: owner of the thresholds & scalar reference
+    :bands -> {int: np.array}: built tables, [x, y] -> (balance, volume, distance, classification code)
+    :builds -> int: number of band tables computed so far
+    """
+    def __init__(self, generator):
+        self.generator = generator
+        self.bands = {}
+        self.builds = 0
+        self.signature = None
+        self.classifications = [generator.Classification.WIDE_LEFT,
+                                generator.Classification.WIDE_RIGHT,
+                                generator.Classification.TRACK,
+                                generator.Classification.BULLS]
+
+    def current_signature(self):
+        g = self.generator
+        return (g.thresh_balance, g.thresh_center, g.thresh_min_volume, g.thresh_balance_far,
+                g.range_near, g.range_far, g.band_size, g.band_count, g.ONLY_VERT_PACING,
+                tuple(g.boundaries))
+
+    def grid(self):
+        """
+        :returns -> (np.array, np.array): x & y coordinates of every pixel, edges included
+        """
+        xs = np.arange(0, self.generator.boundaries[0] + 1, dtype=np.float64)
+        ys = np.arange(0, self.generator.boundaries[1] + 1, dtype=np.float64)
+        return np.meshgrid(xs, ys, indexing='ij')
+
+    def get_balance(self, balance, thresh_balance, thresh_center):
+        # vectorized AudioGenerator.get_balance
+        scale = (thresh_balance / (thresh_balance - thresh_center)) * (1 / thresh_balance)
+        out = np.zeros_like(balance)
+        left = (balance < -thresh_center) & (balance >= -thresh_balance)
+        right = (balance > thresh_center) & (balance <= thresh_balance)
+        out[left] = -np.sqrt(-(balance[left] + thresh_center) * scale)
+        out[right] = np.sqrt((balance[right] - thresh_center) * scale)
+        out[balance > thresh_balance] = 1.0
+        out[balance < -thresh_balance] = -1.0
+        return out
+
+    def build(self, band):
+        """
+        Evaluate AudioGenerator.process_circle over the whole pixel grid
+        :band -> int: range band to build
+        :returns -> np.array: float32 table indexed [x, y, field]
+        """
+        g = self.generator
+        thresh_balance, thresh_center = g.band_thresholds(band)
+        x, y = self.grid()
+        half_w = g.boundaries[0] / 2
+        half_h = g.boundaries[1] / 2
+
+        _balance = (x - half_w) / half_w
+        if g.ONLY_VERT_PACING:
+            _dist_from_center = np.abs(y - half_h)
+            distance = np.power(_dist_from_center / g.boundaries[1] / .4, 0.8)
+        else:
+            _dist_from_center = np.sqrt((x - half_w) ** 2 + (y - half_h) ** 2)
+            distance = np.power((_dist_from_center / g.max_displacement) / 0.375, 0.8)
+        balance = self.get_balance(_balance, thresh_balance, thresh_center)
+        volume = g.thresh_min_volume - ((1 - np.sqrt(self.get_balance(np.abs(_balance), thresh_balance, thresh_center))) * g.thresh_min_volume)
+
+        # codes index into self.classifications
+        classification = np.full(x.shape, 2)
+        if g.ONLY_VERT_PACING:
+            classification[(np.abs(balance) < thresh_center) & (_dist_from_center < 10)] = 3
+        else:
+            classification[_dist_from_center <= 10] = 3
+        classification[balance <= -1.0] = 0
+        classification[balance >= 1.0] = 1
+
+        self.builds += 1
+        return np.stack([balance, volume, distance, classification], axis=-1).astype(np.float32)
+
+    def get_band(self, band):
+        signature = self.current_signature()
+        if signature != self.signature:
+            self.bands.clear()
+            self.signature = signature
+        table = self.bands.get(band)
+        if table is None:
+            table = self.build(band)
+            self.bands[band] = table
+        return table
+
+    def lookup(self, circle, target_range=-1):
+        """
+        Same result as AudioGenerator.process_circle for a pixel position
+        :circle -> [int, int]: x, y of the target, rounded to the nearest pixel
+        :target_range -> int: lidar range in mm, -1 if unknown
+        :returns -> (balance, volume, distance, classification)
+        """
+        table = self.get_band(self.generator.range_band(target_range))
+        i = min(max(int(circle[0] + 0.5), 0), table.shape[0] - 1)
+        j = min(max(int(circle[1] + 0.5), 0), table.shape[1] - 1)
+        balance, volume, distance, classification = table[i, j].tolist()
+        return balance, volume, distance, self.classifications[int(classification)]
+
+    def compare(self, band):
+        """
+        Check a band against the scalar code at every pixel, through lookup()
+            like run() does
+        :returns -> (float, int): largest numeric difference, classification mismatches
+        """
+        g = self.generator
+        target_range = int((band + 0.5) * g.band_size)
+        worst = 0.0
+        mismatches = 0
+        for x in range(g.boundaries[0] + 1):
+            for y in range(g.boundaries[1] + 1):
+                b, v, d, c = g.process_circle([x, y], target_range)
+                balance, volume, distance, classification = self.lookup([x, y], target_range)
+                worst = max(worst, abs(b - balance), abs(v - volume), abs(d - distance))
+                if c is not classification:
+                    mismatches += 1
+        return worst, mismatches
+
+
+if __name__ == "__main__":
+    """
+    Just testing. Checks every band against AudioGenerator.process_circle
+    """
+    from AudioEngine import AudioEngine, NullSink
+    from AudioGenerator import AudioGenerator
+    au = AudioGenerator([640, 480], AudioEngine(NullSink()), lidar=False)
+    for band in range(au.band_count):
+        worst, mismatches = au.table.compare(band)
+        print("band " + str(band) + ": max error " + str(worst) + ", " + str(mismatches) + " classification mismatches")
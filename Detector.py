@@ -0,0 +1,120 @@
+import math
+import cv2
+import numpy as np
+
+"""
+Circle finding backends. VideoProcessor._find_circles hands the blurred
+    colour mask to one of these (picked w/ --detector):
+    HoughDetector   - cv2.HoughCircles w/ the (tunable) settings on the
+                      VideoProcessor, what we always used
+    ContourDetector - external contours of the thresholded mask, each one
+                      checked for size & roundness, centered on its moments.
+                      The mask is a handful of blobs for a single bright
+                      target, so this is a lot cheaper than filling a Hough
+                      accumulator, but it can't pull a circle out of a blob
+                      that's merged w/ something else of the same colour
+
+Every backend returns circles the way HoughCircles does, np.array
+    [[[x, y, r], ...]] float32 in mask coordinates or None, so discard_worst,
+    the roi/pyramid/tiled searches and the session recording don't care
+    which one ran.
+"""
+
+
+class Detector:
+    """
+    :processor -> VideoProcessor: where the settings (target radius, Hough
+                                  params), the buffer pool and metrics live
+    :timer -> str: Metrics timer each detect() is recorded in
+    """
+    name = None
+    timer = None
+
+    def __init__(self, processor):
+        self.processor = processor
+
+    def detect(self, mask, scale=1):
+        """
+        :mask -> image object: blurred mask (or a window of one)
+        :scale -> int: how much mask was shrunk, distances & radii shrink w/ it
+        :returns -> np.array: [[[x,y,r], ...]] in mask coordinates, or None
+        """
+        raise NotImplementedError
+
+    def max_radius(self, scale=1):
+        """
+        :returns -> int: largest radius to look for, w/ a px of slack on the
+                         shrunk pyramid levels where the radius got rounded
+        """
+        if scale == 1:
+            return self.processor.args["target_radius"]
+        return int(math.ceil(self.processor.args["target_radius"] / scale)) + 1
+
+    def gray(self, frame):
+        return frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+
+class HoughDetector(Detector):
+    name = "hough"
+    timer = "hough"
+
+    def detect(self, mask, scale=1):
+        vp = self.processor
+        began = vp.metrics.clock()
+        circles = cv2.HoughCircles(self.gray(mask), cv2.HOUGH_GRADIENT, vp.hough_dp,
+              minDist=vp.min_dist / scale,
+              param1=vp.hough_param1,#80,
+              param2=max(vp.hough_param2 / scale, vp.min_hough_param2),#80,
+              minRadius=0,
+              maxRadius=self.max_radius(scale))
+        vp.metrics.record(self.timer, began)
+        return circles
+
+
+class ContourDetector(Detector):
+    """
+    :threshold -> int: mask value a pixel counts as target from (the blur
+                       softened the 0/255 mask, and knocked out lone pixels)
+    :min_area -> float: smallest blob in px^2 at full size
+    :min_circularity -> float: 4 pi area / perimeter^2, 1.0 for a perfect
+                               circle, pixelated circles come out ~0.85
+    :min_fill -> float: blob area over the area of its enclosing circle
+    :max_blobs -> int: largest blobs returned
+    """
+    name = "contour"
+    timer = "contour"
+    threshold = 127
+    min_area = 30.0
+    min_circularity = 0.6
+    min_fill = 0.5
+    max_blobs = 8
+
+    def detect(self, mask, scale=1):
+        vp = self.processor
+        began = vp.metrics.clock()
+        mask = self.gray(mask)
+        binary = cv2.threshold(mask, self.threshold, 255, cv2.THRESH_BINARY, dst=vp.pool.like("binary", mask))[1]
+        contours = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
+        max_radius = self.max_radius(scale)
+        min_area = self.min_area / (scale * scale)
+        blobs = []
+        for contour in contours:
+            area = cv2.contourArea(contour)
+            if area < min_area:
+                continue
+            _, radius = cv2.minEnclosingCircle(contour)
+            if radius > max_radius or area < self.min_fill * math.pi * radius * radius:
+                continue
+            perimeter = cv2.arcLength(contour, True)
+            if 4 * math.pi * area < self.min_circularity * perimeter * perimeter:
+                continue
+            moments = cv2.moments(contour)
+            blobs.append((area, moments["m10"] / moments["m00"], moments["m01"] / moments["m00"], radius))
+        vp.metrics.record(self.timer, began)
+        if not blobs:
+            return None
+        blobs.sort(key=lambda blob: -blob[0])
+        return np.array([[blob[1:] for blob in blobs[:self.max_blobs]]], dtype=np.float32)
+
+
+DETECTORS = {detector.name: detector for detector in (HoughDetector, ContourDetector)}
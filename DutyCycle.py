@@ -0,0 +1,116 @@
+import time
+import cv2
+from Metrics import Metrics
+
+"""
+Adaptive detection rate for the run loops (--duty-cycle).
+
+While the shooter holds steady the frames barely change, and running
+    filter -> blur -> HoughCircles on each of them only heats up the pi.
+    DutyCycle looks at every frame first w/ a cheap motion score: the frame
+    shrunk by `scale` (INTER_AREA, so it's averaged and sensor noise mostly
+    cancels out), to gray, absdiff against the last frame we detected on,
+    and the number of cells that changed by more than `threshold`.
+
+    motion      - `cells` or more cells changed: detect, and keep detecting
+                  every frame for `hold` sec after the last motion
+    still       - reuse the last detection, but still detect at least
+                  min_rate times a second in case we missed something
+    max_rate    - never detect more often than this, 0 for every frame
+
+Skipped frames and how old the reused detection was (duty.age, what the
+    cue lags behind the camera by) go into Metrics.
+"""
+
+
+class DutyCycle:
+    """
+    :boundaries -> [int, int]: x, y dimensions of the frames
+    :min_rate -> float: detections per second while nothing moves
+    :max_rate -> float: max detections per second, 0 for no cap
+    :threshold -> int: gray level change of a cell that counts as motion
+    :cells -> int: changed cells that make a frame move
+    :scale -> int: downscale factor for the motion score
+    :hold -> float: sec to keep detecting every frame after motion
+    :score -> int: changed cells in the last frame looked at
+    :detected/skipped -> int: frames detected on / reusing the last detection
+    """
+    def __init__(self, boundaries, min_rate=5.0, max_rate=0.0, threshold=12, cells=2, scale=8, hold=0.5,
+                 metrics=None):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.threshold = threshold
+        self.cells = cells
+        self.hold = hold
+        self.metrics = metrics if metrics is not None else Metrics.metrics
+        self.size = (max(1, boundaries[0] // scale), max(1, boundaries[1] // scale))
+        self.small = None
+        self.gray = None
+        self.reference = None
+        self.diff = None
+        self.detected_at = None
+        self.moved_at = None
+        self.score = 0
+        self.detected = 0
+        self.skipped = 0
+
+    def reset(self):
+        self.reference = None
+        self.detected_at = None
+        self.moved_at = None
+
+    def motion(self, frame):
+        """
+        :returns -> int: cells that changed since the last detected frame, -1 if there's none
+        """
+        self.small = cv2.resize(frame, self.size, dst=self.small, interpolation=cv2.INTER_AREA)
+        self.gray = cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        if self.reference is None:
+            return -1
+        self.diff = cv2.absdiff(self.gray, self.reference, dst=self.diff)
+        cv2.threshold(self.diff, self.threshold, 255, cv2.THRESH_BINARY, dst=self.diff)
+        return cv2.countNonZero(self.diff)
+
+    def should_detect(self, frame, now=None):
+        """
+        Look at a frame and decide whether it's worth a detection. If it is,
+            the frame becomes the reference motion is measured against.
+        :frame -> image object: frame as captured
+        :now -> float: time.monotonic(), for testing
+        :returns -> bool: True to detect, False to reuse the last detection
+        """
+        now = time.monotonic() if now is None else now
+        began = self.metrics.clock()
+        self.score = self.motion(frame)
+        since = None if self.detected_at is None else now - self.detected_at
+        if self.score < 0:
+            detect = True
+        elif self.max_rate and since < 1.0 / self.max_rate:
+            detect = False
+        elif self.score >= self.cells:
+            self.moved_at = now
+            detect = True
+        elif self.moved_at is not None and now - self.moved_at < self.hold:
+            detect = True
+        else:
+            detect = self.min_rate > 0 and since >= 1.0 / self.min_rate
+        self.metrics.record("motion", began)
+        if detect:
+            # the gray buffer becomes the reference, the old reference gets written next
+            self.reference, self.gray = self.gray, self.reference
+            self.detected_at = now
+            self.detected += 1
+            self.metrics.count("duty.detected")
+        else:
+            self.skipped += 1
+            self.metrics.count("duty.skipped")
+            self.metrics.record("duty.age", self.metrics.clock() - (now - self.detected_at))
+        return detect
+
+    def stats(self):
+        frames = self.detected + self.skipped
+        return {
+            "detected": self.detected,
+            "skipped": self.skipped,
+            "duty": round(self.detected / frames, 3) if frames else 0.0,
+        }
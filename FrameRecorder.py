@@ -0,0 +1,198 @@
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+import cv2
+import numpy as np
+
+"""
+Background frame recorder for --save.
+
+save_frame used to cv2.imwrite a PNG right inside the capture loop. Now
+    the loop only hands frames to FrameRecorder.submit(), which rate-limits
+    them, copies the ones it keeps into a bounded queue and returns. A writer
+    thread drains the queue into one of:
+        png/jpg - one image file per frame (jpg at a set quality is far cheaper)
+        raw     - frames appended to a preallocated memory-mapped file, w/ a
+                  json sidecar holding shape, count and timestamps
+        video   - an MJPG .avi via cv2.VideoWriter
+When the queue is full the drop policy decides what gives: the new frame
+    ("newest"), the oldest queued frame ("oldest"), or the caller waits
+    ("block", only for offline use).
+"""
+
+
+class ImageWriter:
+    def __init__(self, directory, extension, quality=85):
+        self.directory = directory
+        self.extension = extension
+        if extension == "jpg":
+            self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        else:
+            self.params = [cv2.IMWRITE_PNG_COMPRESSION, 1]
+
+    def write(self, frame, stamp, index):
+        name = datetime.datetime.fromtimestamp(stamp).strftime("%Y-%m-%d_%H:%M:%S.%f")[:-3]
+        cv2.imwrite(os.path.join(self.directory, name + "_" + str(index) + "." + self.extension), frame, self.params)
+
+    def close(self):
+        pass
+
+
+class MemmapWriter:
+    """
+    Appends frames to frames.raw, preallocated for max_frames frames.
+    Frames past max_frames are counted as dropped.
+    """
+    def __init__(self, directory, shape, max_frames):
+        self.path = os.path.join(directory, "frames.raw")
+        self.shape = tuple(shape)
+        self.frames = np.memmap(self.path, dtype=np.uint8, mode="w+", shape=(max_frames,) + self.shape)
+        self.stamps = []
+
+    def write(self, frame, stamp, index):
+        count = len(self.stamps)
+        if count >= self.frames.shape[0]:
+            raise IndexError("memmap full")
+        self.frames[count] = frame
+        self.stamps.append(stamp)
+
+    def close(self):
+        self.frames.flush()
+        with open(self.path + ".json", "w") as f:
+            json.dump({"shape": list(self.shape), "dtype": "uint8", "count": len(self.stamps),
+                       "stamps": self.stamps}, f)
+        del self.frames
+
+
+class VideoWriter:
+    def __init__(self, directory, boundaries, fps):
+        name = datetime.datetime.now().strftime("%Y-%m-%d_%H:%M:%S") + ".avi"
+        self.writer = cv2.VideoWriter(os.path.join(directory, name), cv2.VideoWriter_fourcc(*"MJPG"),
+                                      fps, (boundaries[0], boundaries[1]))
+
+    def write(self, frame, stamp, index):
+        self.writer.write(frame)
+
+    def close(self):
+        self.writer.release()
+
+
+class FrameRecorder:
+    """
+    :directory -> str: where recordings go, created if missing
+    :boundaries -> [int, int]: x, y dimensions of the frames
+    :fmt -> str: png, jpg, raw or video
+    :fps -> float: max frames per second kept, 0 keeps every frame
+    :queue_size -> int: frames waiting to be written before we drop
+    :drop -> str: newest, oldest or block
+    :quality -> int: jpg quality
+    :max_frames -> int: size of the raw memmap
+    :transform -> np.array: 2x3 affine matrix kept frames are rotated by on
+                            the way in, None to keep them as they are (see FrameSource)
+    counters: submitted, skipped (rate limit), dropped (queue full), written, errors
+    """
+    formats = ("png", "jpg", "raw", "video")
+    policies = ("newest", "oldest", "block")
+
+    def __init__(self, directory, boundaries, fmt="jpg", fps=1.0, queue_size=8, drop="newest",
+                 quality=85, max_frames=150):
+        if fmt not in self.formats:
+            raise ValueError("unknown recording format " + str(fmt))
+        if drop not in self.policies:
+            raise ValueError("unknown drop policy " + str(drop))
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.boundaries = boundaries
+        self.fmt = fmt
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.drop = drop
+        if fmt == "raw":
+            self.writer = MemmapWriter(directory, (boundaries[1], boundaries[0], 3), max_frames)
+        elif fmt == "video":
+            self.writer = VideoWriter(directory, boundaries, fps if fps > 0 else 30.0)
+        else:
+            self.writer = ImageWriter(directory, fmt, quality)
+        self.queue = queue.Queue(queue_size)
+        self.transform = None
+        self.submitted = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.written = 0
+        self.errors = 0
+        self._last = None
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def submit(self, frame):
+        """
+        Offer a frame for recording. Cheap and (unless drop is "block")
+            never waits on the disk.
+        :frame -> image object: frame to record, copied (or rotated) if kept
+        :returns -> bool: whether the frame was queued
+        """
+        self.submitted += 1
+        now = time.time()
+        if self._last is not None and now - self._last < self.interval:
+            self.skipped += 1
+            return False
+        self._last = now
+        if self.transform is None:
+            frame = frame.copy()
+        else:
+            frame = cv2.warpAffine(frame, self.transform, (self.boundaries[0], self.boundaries[1]))
+        item = (frame, now, self.submitted)
+        if self.drop == "block":
+            self.queue.put(item)
+            return True
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+        if self.drop == "oldest":
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(item)
+                return True
+            except queue.Full:
+                pass
+        self.dropped += 1
+        return False
+
+    def _loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self.writer.write(*item)
+                self.written += 1
+            except IndexError:
+                self.dropped += 1
+            except Exception:
+                self.errors += 1
+
+    def close(self):
+        """
+        Write out whatever is still queued and finish the file(s)
+        """
+        self.queue.put(None)
+        self._thread.join()
+        self.writer.close()
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "skipped": self.skipped,
+            "dropped": self.dropped,
+            "written": self.written,
+            "errors": self.errors,
+            "queued": self.queue.qsize(),
+        }
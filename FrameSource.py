@@ -0,0 +1,200 @@
+import importlib.util
+import time
+import cv2
+import numpy as np
+from Metrics import Metrics
+from Session import SessionReader, ReplayLidar
+
+"""
+Where frames come from. VideoProcessor.frames() iterates one of these:
+    WebcamSource   - cv2.VideoCapture, for --dev
+    PiCameraSource - the pi camera module, rotated 270 degrees
+    ReplaySource   - a recorded session (see Session.py), for --replay
+
+Every source yields BGR frames at boundaries size. w/ reuse=True frames are
+    written into the same pool buffer each time, which is only safe when a
+    frame is done w/ before the next one is read.
+
+Frames come out the way the sensor delivers them, the camera module is
+    mounted sideways, but we never rotate the frames we detect on. A source
+    whose frames aren't in output orientation sets .transform, the 2x3
+    affine matrix from frame to output coordinates, and VideoProcessor
+    moves the detected circles through it instead (map_circles), dropping
+    the ones that end up outside the output frame. Only frames somebody
+    looks at (preview, --save, --render, session recordings) get rotated.
+
+picamera is only imported once a PiCameraSource is made, PI_CAMERA just
+    checks it's installed, so --dev and --replay don't pay for the import.
+"""
+
+PI_CAMERA = importlib.util.find_spec("picamera") is not None
+
+
+def map_circles(circles, transform, boundaries):
+    """
+    Move circles from frame to output coordinates
+    :circles -> np.array: [[[x,y,r], ...]] like HoughCircles
+    :transform -> np.array: 2x3 affine matrix, frame -> output
+    :boundaries -> [int, int]: x, y dimensions of the output frame
+    :returns -> np.array: [[[x,y,r], ...]] w/ the circles whose center lands
+                          inside the output frame, or None if there are none
+    """
+    circles = circles[0]
+    centers = circles[:, :2] @ transform[:, :2].T + transform[:, 2]
+    inside = (centers[:, 0] >= 0) & (centers[:, 0] < boundaries[0]) & (centers[:, 1] >= 0) & (centers[:, 1] < boundaries[1])
+    if not inside.any():
+        return None
+    mapped = circles[inside].copy()
+    mapped[:, :2] = centers[inside]
+    return mapped[np.newaxis]
+
+
+class FrameSource:
+    """
+    :boundaries -> [int, int]: x, y dimensions frames come out at
+    :pool -> BufferPool: where reused frames are written, None to never reuse
+    :metrics -> Metrics: capture & rotate timers
+    :transform -> np.array: 2x3 frame -> output matrix, None if frames already
+                            are in output orientation
+    """
+    transform = None
+
+    def __init__(self, boundaries, pool=None, metrics=None):
+        self.boundaries = boundaries
+        self.pool = pool
+        self.metrics = metrics if metrics is not None else Metrics.metrics
+
+    def buffer(self, reuse):
+        if not reuse or self.pool is None:
+            return None
+        return self.pool.get("frame", self.boundaries[1], self.boundaries[0], 3)
+
+    def frames(self, reuse=False):
+        raise NotImplementedError
+
+    def orient(self, frame):
+        """
+        :returns -> image object: frame in output orientation, for showing it.
+                                  Not for the detection loop
+        """
+        if self.transform is None:
+            return frame
+        began = self.metrics.clock()
+        frame = cv2.warpAffine(frame, self.transform, (self.boundaries[0], self.boundaries[1]))
+        self.metrics.record("rotate", began)
+        return frame
+
+    def close(self):
+        pass
+
+
+class WebcamSource(FrameSource):
+    def __init__(self, boundaries, pool=None, metrics=None, device=0):
+        super().__init__(boundaries, pool, metrics)
+        self.capture = cv2.VideoCapture(device)
+        self.capture.set(3, boundaries[0])
+        self.capture.set(4, boundaries[1])
+
+    def frames(self, reuse=False):
+        raw = None
+        size = (self.boundaries[0], self.boundaries[1])
+        metrics = self.metrics
+        while self.capture.isOpened():
+            began = metrics.clock()
+            ret, raw = self.capture.read(raw if reuse else None)
+            metrics.record("capture", began)
+            if ret:
+                if raw.shape[1] == size[0] and raw.shape[0] == size[1]:
+                    # the camera took our resolution, w/ reuse raw is read into again next time
+                    yield raw
+                    continue
+                began = metrics.clock()
+                frame = cv2.resize(raw, size, dst=self.buffer(reuse))
+                metrics.record("rotate", began)
+                yield frame
+            else:
+                metrics.count("capture.failed")
+
+    def close(self):
+        self.capture.release()
+
+
+class PiCameraSource(FrameSource):
+    """
+    The camera module, mounted rotated 270 degrees. Frames are the sensor's
+        bgr (converted by the GPU, not us) and never rotated, .transform
+        rotates the detections instead.
+    """
+    def __init__(self, boundaries, pool=None, metrics=None, framerate=32):
+        super().__init__(boundaries, pool, metrics)
+        from picamera.array import PiRGBArray
+        from picamera import PiCamera
+        self.camera = PiCamera()
+        self.camera.resolution = (boundaries[0], boundaries[1])
+        self.camera.framerate = framerate
+        self.raw_capture = PiRGBArray(self.camera, size=(boundaries[0], boundaries[1]))
+        # same as imutils.rotate(image, 270)
+        self.transform = cv2.getRotationMatrix2D((boundaries[0] // 2, boundaries[1] // 2), 270, 1.0)
+        time.sleep(0.1)
+
+    def frames(self, reuse=False):
+        metrics = self.metrics
+        # capture is the time spent waiting on the camera, not in our own loop
+        began = metrics.clock()
+        for frame in self.camera.capture_continuous(self.raw_capture, format="bgr", use_video_port=True):
+            metrics.record("capture", began)
+            # frame.array is a fresh array each capture, so the buffer can be reset right away
+            self.raw_capture.truncate(0)
+            yield frame.array
+            began = metrics.clock()
+
+    def close(self):
+        self.camera.close()
+
+
+class ReplaySource(FrameSource):
+    """
+    Plays a recorded session back
+    :directory -> str: session directory
+    :speed -> float: 1.0 keeps the recorded timing, 2.0 twice as fast,
+                     0 as fast as we can
+    :loop -> bool: start over at the end instead of stopping
+    :lidar -> ReplayLidar: hand this to AudioGenerator so get_range() gives
+                           the range each frame was recorded w/
+    :position -> int: index of the frame last yielded
+    """
+    def __init__(self, directory, boundaries, pool=None, metrics=None, speed=0.0, loop=False):
+        super().__init__(boundaries, pool, metrics)
+        self.session = SessionReader(directory)
+        if list(self.session.boundaries) != list(boundaries):
+            raise ValueError("session was recorded at " + str(self.session.boundaries) +
+                             ", not " + str(boundaries))
+        self.speed = speed
+        self.loop = loop
+        self.lidar = ReplayLidar()
+        self.position = -1
+
+    def frames(self, reuse=False):
+        metrics = self.metrics
+        stamps = self.session.index["stamp"]
+        ranges = self.session.index["range"]
+        while True:
+            started = time.monotonic()
+            for i in range(len(self.session)):
+                if self.speed > 0:
+                    wait = started + stamps[i] / self.speed - time.monotonic()
+                    if wait > 0:
+                        time.sleep(wait)
+                began = metrics.clock()
+                out = self.buffer(reuse)
+                if out is None:
+                    frame = self.session.frames[i].copy()
+                else:
+                    out[...] = self.session.frames[i]
+                    frame = out
+                metrics.record("capture", began)
+                self.lidar.current = int(ranges[i])
+                self.position = i
+                yield frame
+            if not self.loop:
+                break
@@ -0,0 +1,233 @@
+import threading
+import time
+
+"""
+Background reader for the TeraRanger Evo lidar.
+
+The Evo streams readings as text lines (one distance in mm per line, after
+    we put it in text mode w/ 0x00 0x11 0x01 0x45). Reading that stream on
+    the vision thread meant a blocking serial read every frame, so instead
+    LidarReader owns a thread that parses the stream incrementally and keeps
+    a ring buffer of the last VALID ranges. Callers get the latest value, a
+    median or an EMA straight out of memory, without ever blocking.
+
+Where the bytes come from is pluggable: SerialSource for the real device,
+    MemorySource for feeding canned data when testing w/o the lidar.
+"""
+
+EVO_TEXT_MODE = b'\x00\x11\x01\x45'
+
+
+class SerialSource:
+    """
+    Byte source backed by the lidar's serial port
+    :port -> serial.Serial: opened serial port
+    """
+    def __init__(self, port):
+        self.port = port
+
+    @classmethod
+    def open(cls, device='/dev/ttyACM0', baudrate=115200, timeout=0.1):
+        import serial
+        port = serial.Serial(device, baudrate, timeout=timeout)
+        port.write(EVO_TEXT_MODE)
+        return cls(port)
+
+    def read(self, size):
+        return self.port.read(size)
+
+    @property
+    def closed(self):
+        return not self.port.is_open
+
+    def close(self):
+        self.port.close()
+
+
+class MemorySource:
+    """
+    Byte source that hands out data fed to it from memory, like a fake
+        serial port. read() waits up to timeout for data, then returns b''
+        the same way a serial read times out.
+    """
+    def __init__(self, data=b'', timeout=0.05):
+        self.buffer = bytearray(data)
+        self.timeout = timeout
+        self.closed = False
+        self._ready = threading.Condition()
+
+    def feed(self, data):
+        with self._ready:
+            self.buffer += data
+            self._ready.notify_all()
+
+    def read(self, size):
+        with self._ready:
+            if not self.buffer and not self.closed:
+                self._ready.wait(self.timeout)
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            return data
+
+    def close(self):
+        with self._ready:
+            self.closed = True
+            self._ready.notify_all()
+
+
+class EvoParser:
+    """
+    Incremental parser for the Evo text stream. Bytes can be fed in chunks
+        of any size, partial lines are kept until their newline shows up.
+    Lines look like "1234\\r\\n" (some firmwares prefix a "T\\t"). Anything
+        that isn't a whole number of mm inside [min_range, max_range] is
+        dropped, which takes care of the -1 the Evo sends for bad reads.
+    :min_range -> int: smallest valid reading in mm
+    :max_range -> int: largest valid reading in mm
+    :max_line -> int: give up on a line that gets longer than this
+    """
+    def __init__(self, min_range=100, max_range=60000, max_line=32):
+        self.min_range = min_range
+        self.max_range = max_range
+        self.max_line = max_line
+        self.pending = bytearray()
+        self.dropped = 0
+
+    def feed(self, data):
+        """
+        :data -> bytes: next chunk of the stream
+        :returns -> [int]: valid ranges completed by this chunk, in mm
+        """
+        self.pending += data
+        ranges = []
+        while True:
+            end = self.pending.find(b'\n')
+            if end < 0:
+                break
+            line = bytes(self.pending[:end])
+            del self.pending[:end + 1]
+            value = self.parse_line(line)
+            if value is None:
+                self.dropped += 1
+            else:
+                ranges.append(value)
+        if len(self.pending) > self.max_line:
+            self.pending.clear()
+            self.dropped += 1
+        return ranges
+
+    def parse_line(self, line):
+        line = line.strip()
+        if line.startswith(b'T'):
+            line = line[1:].strip()
+        try:
+            value = int(line)
+        except ValueError:
+            return None
+        if value < self.min_range or value > self.max_range:
+            return None
+        return value
+
+
+class LidarReader:
+    """
+    Reads the lidar on its own thread into a ring buffer of valid ranges
+
+    :source -> SerialSource: where the bytes come from. The thread ends once
+                             it's closed & drained
+    :parser -> EvoParser: turns bytes into ranges
+    :capacity -> int: number of ranges kept for median()
+    :alpha -> float: weight of the newest reading in ema()
+    :chunk -> int: max bytes per read
+    """
+    def __init__(self, source, parser=None, capacity=16, alpha=0.3, chunk=64):
+        self.source = source
+        self.parser = parser if parser is not None else EvoParser()
+        self.capacity = capacity
+        self.alpha = alpha
+        self.chunk = chunk
+        self.ranges = [0] * capacity
+        self.stamps = [0.0] * capacity
+        self.count = 0
+        self.index = 0
+        self.average = None
+        self.reads = 0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self):
+        while self._running:
+            try:
+                data = self.source.read(self.chunk)
+            except:
+                if self.source.closed:
+                    break
+                self.timeouts += 1
+                time.sleep(0.1)
+                continue
+            self.reads += 1
+            if not data:
+                if self.source.closed:
+                    # drained & nothing more coming, reading on would just spin
+                    break
+                self.timeouts += 1
+                continue
+            for value in self.parser.feed(data):
+                self.push(value)
+
+    def push(self, value, stamp=None):
+        """
+        Add a valid range to the ring buffer
+        :value -> int: range in mm
+        :stamp -> float: time.monotonic() of the reading, defaults to now
+        """
+        stamp = time.monotonic() if stamp is None else stamp
+        with self._lock:
+            self.ranges[self.index] = value
+            self.stamps[self.index] = stamp
+            self.index = (self.index + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+            if self.average is None:
+                self.average = float(value)
+            else:
+                self.average += self.alpha * (value - self.average)
+
+    def latest(self, max_age=None):
+        """
+        :max_age -> float: ignore the reading if it's older than this (sec)
+        :returns -> int: most recent valid range in mm, -1 if there is none
+        """
+        with self._lock:
+            if self.count == 0:
+                return -1
+            last = (self.index - 1) % self.capacity
+            if max_age is not None and time.monotonic() - self.stamps[last] > max_age:
+                return -1
+            return self.ranges[last]
+
+    def median(self):
+        with self._lock:
+            if self.count == 0:
+                return -1
+            values = sorted(self.ranges[:self.count])
+        return values[len(values) // 2]
+
+    def ema(self):
+        with self._lock:
+            if self.average is None:
+                return -1
+            return int(round(self.average))
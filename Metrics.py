@@ -0,0 +1,289 @@
+import bisect
+import json
+import logging
+import os
+import signal
+import threading
+import time
+
+"""
+Hot-path timers, counters and rate-limited logging.
+
+Stages time themselves w/ two perf_counter calls:
+
+    began = metrics.clock()
+    ...
+    metrics.record("hough", began)
+
+and every name gets a Histogram w/ fixed, log-spaced bins that are
+    allocated up front, so recording is a bisect and an increment, never
+    an allocation or any I/O. Nothing is printed per frame; the numbers are
+    dumped on demand (SIGUSR1), periodically to a json file, or at exit.
+
+One Metrics instance is shared by the whole process (Metrics.metrics),
+    the way the logging module has one root logger. Pass your own to the
+    classes that take a metrics= argument to keep things separate.
+
+Logging goes through the logging module. RateLimitFilter lets the first
+    message of a kind through and drops repeats of it for `interval`
+    seconds, so a per-frame warning can't flood a serial console.
+"""
+
+log = logging.getLogger(__name__)
+
+
+class Histogram:
+    """
+    Latency histogram w/ preallocated, log-spaced bins
+    :lowest -> float: upper bound of the first bin (sec)
+    :highest -> float: upper bound of the last bin, slower goes in the overflow bin
+    :steps -> int: bins per doubling, 4 is roughly 19% wide bins
+    """
+    def __init__(self, lowest=1e-6, highest=10.0, steps=4):
+        self.bounds = []
+        bound = lowest
+        i = 0
+        while bound < highest:
+            bound = lowest * 2 ** (i / steps)
+            self.bounds.append(bound)
+            i += 1
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """
+        :q -> float: 0..100
+        :returns -> float: upper bound of the bin the q'th percentile falls in (sec)
+        """
+        if not self.count:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def stats(self):
+        return {
+            "count": self.count,
+            "mean_ms": 1000 * self.total / self.count if self.count else 0.0,
+            "p50_ms": 1000 * self.percentile(50),
+            "p90_ms": 1000 * self.percentile(90),
+            "p99_ms": 1000 * self.percentile(99),
+            "max_ms": 1000 * self.max,
+        }
+
+
+class Metrics:
+    """
+    Named timers, counters and gauges
+    :enabled -> bool: False makes record/count no-ops
+    :timers -> {str: Histogram}: one per stage, more are added on first record
+    :counters -> {str: int}
+    :gauges -> {str: callable}: read when a snapshot is taken, e.g. another
+                                object's own counters
+    """
+    metrics = None
+
+    # the hot-path stages, so they show up in a fixed order
+    stages = (
+        "capture", "rotate", "filter", "blur", "hough", "cue", "dispatch",
+    )
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.timers = {name: Histogram() for name in self.stages}
+        self.counters = {}
+        self.gauges = {}
+        self.started = time.monotonic()
+        self._reporter = None
+        self._lock = threading.Lock()
+
+    clock = staticmethod(time.perf_counter)
+
+    def record(self, name, began):
+        """
+        :name -> str: timer to record into, created on first use
+        :began -> float: clock() when the timed work started
+        """
+        if not self.enabled:
+            return
+        elapsed = time.perf_counter() - began
+        timer = self.timers.get(name)
+        if timer is None:
+            with self._lock:
+                timer = self.timers.setdefault(name, Histogram())
+        timer.add(elapsed)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, fn):
+        """
+        :fn -> callable: () -> number, read at snapshot time
+        """
+        self.gauges[name] = fn
+
+    def reset(self):
+        for timer in list(self.timers.values()):
+            timer.reset()
+        self.counters.clear()
+        self.started = time.monotonic()
+
+    def snapshot(self):
+        gauges = {}
+        for name, fn in list(self.gauges.items()):
+            try:
+                gauges[name] = fn()
+            except Exception:
+                gauges[name] = None
+        return {
+            "uptime": time.monotonic() - self.started,
+            "timers": {name: timer.stats() for name, timer in list(self.timers.items()) if timer.count},
+            "counters": dict(self.counters),
+            "gauges": gauges,
+        }
+
+    def summary(self):
+        snapshot = self.snapshot()
+        lines = ["metrics after %.1f s" % snapshot["uptime"]]
+        for name, s in snapshot["timers"].items():
+            lines.append("%-10s %8d  mean %7.3f  p50 %7.3f  p90 %7.3f  p99 %7.3f  max %8.3f ms" % (
+                name, s["count"], s["mean_ms"], s["p50_ms"], s["p90_ms"], s["p99_ms"], s["max_ms"]))
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append("%-24s %d" % (name, value))
+        for name, value in sorted(snapshot["gauges"].items()):
+            lines.append("%-24s %s" % (name, value))
+        return "\n".join(lines)
+
+    def dump(self, path):
+        """
+        Write a snapshot as json. Goes through a temp file so a reader never
+            sees half a file.
+        """
+        temp = path + ".tmp"
+        with open(temp, "w") as f:
+            json.dump(self.snapshot(), f, indent=1)
+        os.replace(temp, path)
+
+    def start_reporter(self, path, interval=10.0):
+        """
+        Dump to path every interval seconds on a daemon thread
+        """
+        if self._reporter is not None:
+            return
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.dump(path)
+                except OSError as e:
+                    log.warning("could not write metrics to %s: %s", path, e)
+        self._reporter = threading.Thread(target=loop, name="metrics", daemon=True)
+        self._reporter.start()
+
+    def install_signal(self, path=None, signum=None):
+        """
+        Log the summary (and dump to path, if given) when the process gets
+            signum, SIGUSR1 by default: kill -USR1 <pid>
+        """
+        signum = signum if signum is not None else getattr(signal, "SIGUSR1", None)
+        if signum is None:
+            return
+        def handler(received, frame):
+            log.info("%s", self.summary())
+            if path:
+                self.dump(path)
+        try:
+            signal.signal(signum, handler)
+        except ValueError:
+            # not the main thread
+            pass
+
+
+Metrics.metrics = Metrics()
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let one record per (logger, message template) through every interval
+        seconds. The next one that gets through says how many were dropped.
+    :interval -> float: seconds between repeats of the same message
+    :metrics -> Metrics: counts suppressed records as log.suppressed
+    """
+    def __init__(self, interval=1.0, metrics=None):
+        super().__init__()
+        self.interval = interval
+        self.metrics = metrics
+        self.last = {}
+        self.suppressed = {}
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = record.created
+        last = self.last.get(key)
+        if last is not None and now - last < self.interval:
+            self.suppressed[key] = self.suppressed.get(key, 0) + 1
+            if self.metrics is not None:
+                self.metrics.count("log.suppressed")
+            return False
+        self.last[key] = now
+        dropped = self.suppressed.pop(key, 0)
+        if dropped:
+            record.msg = "%s (%d similar suppressed)" % (record.getMessage(), dropped)
+            record.args = None
+        return True
+
+
+def configure_logging(level="warning", interval=1.0, metrics=None):
+    """
+    Levelled, rate-limited logging to stderr
+    :level -> str: debug, info, warning or error
+    :interval -> float: min seconds between repeats of one message, 0 for no limit
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-7s %(name)s: %(message)s"))
+    if interval > 0:
+        handler.addFilter(RateLimitFilter(interval, metrics if metrics is not None else Metrics.metrics))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(getattr(logging, level.upper()))
+    return handler
+
+
+if __name__ == "__main__":
+    """
+    Just testing. Overhead of a record() and what the rate limit lets through
+    """
+    metrics = Metrics()
+    n = 200000
+    began = time.perf_counter()
+    for _ in range(n):
+        metrics.record("hough", metrics.clock())
+    per_call = (time.perf_counter() - began) / n
+    print("record(): %.2f us per call" % (per_call * 1e6))
+    configure_logging("debug", 0.5, metrics)
+    for i in range(30):
+        log.warning("no circle, %d frames in a row", i)
+        time.sleep(0.05)
+    print(metrics.summary())
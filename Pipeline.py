@@ -0,0 +1,224 @@
+import threading
+import time
+
+"""
+Staged capture -> detect -> audio -> output pipeline.
+
+Each stage runs on its own thread and hands its result to the next stage
+    through a LatestSlot: a queue w/ room for exactly one item where a new
+    item replaces the old one instead of waiting behind it. A slow stage
+    therefore never backs frames up behind it, it just skips to the newest
+    one when it is ready again, and the skipped frames are counted as drops.
+
+Every item carries the time its frame was captured, so stages can report
+    how old the data they work on is (capture -> cue latency for audio).
+"""
+
+
+class LatestSlot:
+    """
+    Single-slot, latest-wins queue
+    :name -> str: for stats
+    :puts -> int: items put in
+    :dropped -> int: items overwritten before anyone took them
+    """
+    def __init__(self, name):
+        self.name = name
+        self.item = None
+        self.full = False
+        self.closed = False
+        self.puts = 0
+        self.dropped = 0
+        self._ready = threading.Condition()
+
+    def put(self, item):
+        with self._ready:
+            if self.full:
+                self.dropped += 1
+            self.item = item
+            self.full = True
+            self.puts += 1
+            self._ready.notify()
+
+    def get(self, timeout=None):
+        """
+        Wait for the newest item
+        :timeout -> float: give up after this many seconds
+        :returns -> item, or None on timeout or once the slot is closed and empty
+        """
+        with self._ready:
+            if not self.full and not self.closed:
+                self._ready.wait(timeout)
+            if not self.full:
+                return None
+            item = self.item
+            self.item = None
+            self.full = False
+            return item
+
+    def depth(self):
+        return 1 if self.full else 0
+
+    def close(self):
+        with self._ready:
+            self.closed = True
+            self._ready.notify_all()
+
+    def stats(self):
+        return {"depth": self.depth(), "puts": self.puts, "dropped": self.dropped}
+
+
+class Stage:
+    """
+    One pipeline worker. Pulls from inbox (or calls fn w/ no input if it
+        has none, like the capture stage), and puts fn's result into every
+        outbox. fn returning None means nothing to pass on; a source stage
+        raising StopIteration ends the pipeline.
+
+    :name -> str: for stats
+    :fn -> callable: item -> item, or () -> item for a source
+    :inbox -> LatestSlot: where items come from, None for a source
+    :outboxes -> [LatestSlot]: where results go
+    """
+    def __init__(self, name, fn, inbox=None, outboxes=()):
+        self.name = name
+        self.fn = fn
+        self.inbox = inbox
+        self.outboxes = list(outboxes)
+        self.processed = 0
+        self.busy = 0.0
+        self.age_total = 0.0
+        self.age_max = 0.0
+        self.started = None
+        self.error = None
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self.started = time.monotonic()
+        self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _loop(self):
+        try:
+            while self._running:
+                if self.inbox is None:
+                    item = None
+                else:
+                    item = self.inbox.get(0.1)
+                    if item is None:
+                        if self.inbox.closed:
+                            break
+                        continue
+                began = time.monotonic()
+                try:
+                    result = self.fn() if self.inbox is None else self.fn(item)
+                except StopIteration:
+                    break
+                done = time.monotonic()
+                self.busy += done - began
+                self.processed += 1
+                if item is not None:
+                    age = done - item.captured
+                    self.age_total += age
+                    self.age_max = max(self.age_max, age)
+                if result is not None:
+                    for outbox in self.outboxes:
+                        outbox.put(result)
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            for outbox in self.outboxes:
+                outbox.close()
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        return {
+            "processed": self.processed,
+            "fps": self.processed / elapsed if elapsed > 0 else 0.0,
+            "busy": self.busy / elapsed if elapsed > 0 else 0.0,
+            "age_mean_ms": 1000 * self.age_total / self.processed if self.processed else 0.0,
+            "age_max_ms": 1000 * self.age_max,
+        }
+
+
+class Packet:
+    """
+    What travels between stages
+    :captured -> float: time.monotonic() when the frame was read
+    :frame -> image object: the (possibly processed) frame
+    :circles -> [...]: detection result, None until the detect stage ran
+    :index -> int: frame index in a session recording, -1 if not recording
+    """
+    __slots__ = ('captured', 'frame', 'circles', 'index')
+
+    def __init__(self, captured, frame, circles=None, index=-1):
+        self.captured = captured
+        self.frame = frame
+        self.circles = circles
+        self.index = index
+
+
+class Pipeline:
+    """
+    A set of stages and the slots between them
+    """
+    def __init__(self):
+        self.stages = []
+        self.slots = []
+
+    def slot(self, name):
+        slot = LatestSlot(name)
+        self.slots.append(slot)
+        return slot
+
+    def stage(self, name, fn, inbox=None, outboxes=()):
+        stage = Stage(name, fn, inbox, outboxes)
+        self.stages.append(stage)
+        return stage
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self):
+        for stage in self.stages:
+            stage.stop()
+        for slot in self.slots:
+            slot.close()
+        for stage in self.stages:
+            stage.join(1.0)
+
+    def running(self):
+        return any(stage.alive() for stage in self.stages)
+
+    def stats(self):
+        return {
+            "stages": {stage.name: stage.stats() for stage in self.stages},
+            "slots": {slot.name: slot.stats() for slot in self.slots},
+        }
+
+    def summary(self):
+        lines = []
+        for stage in self.stages:
+            s = stage.stats()
+            lines.append("%-8s %6d frames %6.1f fps %5.0f%% busy  age %6.1f ms avg %6.1f ms max" % (
+                stage.name, s["processed"], s["fps"], 100 * s["busy"], s["age_mean_ms"], s["age_max_ms"]))
+            if stage.error is not None:
+                lines.append("%-8s died: %r" % (stage.name, stage.error))
+        for slot in self.slots:
+            s = slot.stats()
+            lines.append("%-8s depth %d  %6d in %6d dropped" % (slot.name, s["depth"], s["puts"], s["dropped"]))
+        return "\n".join(lines)
@@ -0,0 +1,209 @@
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2
+import numpy as np
+from Pipeline import LatestSlot
+
+"""
+Detection preview over HTTP, off the hot path.
+
+--render draws w/ cv2.imshow/waitKey right in the capture loop, which costs
+    every frame and needs a display on the pi. PreviewServer instead takes
+    at most `fps` frames a second from the loop (offer() is a clock check
+    for the rest, and does nothing at all while nobody is watching), hands
+    them to an encoder thread through a LatestSlot, and serves the newest
+    JPEG as an MJPEG stream:
+
+    http://<pi>:8080/            - page w/ the stream
+    http://<pi>:8080/stream.mjpg - multipart/x-mixed-replace stream
+    http://<pi>:8080/frame.jpg   - the newest frame
+
+Circles are drawn by the encoder thread, so the loop doesn't pay for that either.
+
+It only listens on localhost unless asked otherwise (--preview-host 0.0.0.0),
+    the stream is the live camera and anyone on the network could watch it.
+    From another machine w/o that, tunnel it: ssh -L 8080:localhost:8080 pi
+"""
+
+log = logging.getLogger(__name__)
+
+PAGE = b"""<html><head><title>BAVI preview</title></head>
+<body style="margin:0;background:#000"><img src="/stream.mjpg" style="width:100%"></body></html>"""
+
+
+class PreviewServer:
+    """
+    :port -> int: HTTP port, 0 picks a free one (see .port)
+    :fps -> float: max preview frames per second
+    :scale -> int: downscale factor for the preview
+    :quality -> int: JPEG quality
+    :host -> str: interface to listen on, 0.0.0.0 for every one
+    :transform -> np.array: 2x3 affine matrix kept frames are rotated by,
+                            None to leave them (see FrameSource)
+    :offered/taken/encoded -> int: frames offered, kept for encoding, encoded
+    """
+    def __init__(self, port=8080, fps=5.0, scale=1, quality=70, host="127.0.0.1"):
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.scale = scale
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        self.slot = LatestSlot("preview")
+        self.jpeg = None
+        self.transform = None
+        self.serial = 0
+        self.clients = 0
+        self.offered = 0
+        self.taken = 0
+        self.encoded = 0
+        self._last = None
+        self._ready = threading.Condition()
+        self._running = True
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._threads = [threading.Thread(target=self.server.serve_forever, name="preview-http", daemon=True),
+                         threading.Thread(target=self._encode_loop, name="preview-encode", daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        log.info("preview on http://%s:%d/", host, self.port)
+
+    def offer(self, frame, circles=None):
+        """
+        Called from the capture loop for every frame. Keeps one every
+            1 / fps sec, and only while someone is watching.
+        :frame -> image object: frame to preview, copied if kept
+        :circles -> [x,y,r] or HoughCircles array: drawn on the preview, None for none
+        :returns -> bool: whether the frame was kept
+        """
+        self.offered += 1
+        if not self.clients:
+            return False
+        now = time.monotonic()
+        if self._last is not None and now - self._last < self.interval:
+            return False
+        self._last = now
+        if self.transform is not None:
+            # rotate & downscale in one go
+            frame = cv2.warpAffine(frame, self.transform / self.scale,
+                                   (frame.shape[1] // self.scale, frame.shape[0] // self.scale), flags=cv2.INTER_NEAREST)
+        elif self.scale > 1:
+            frame = cv2.resize(frame, (frame.shape[1] // self.scale, frame.shape[0] // self.scale),
+                               interpolation=cv2.INTER_NEAREST)
+        else:
+            frame = frame.copy()
+        if circles is not None:
+            circles = np.array(circles, dtype=np.float32).copy()
+        self.taken += 1
+        self.slot.put((frame, circles))
+        return True
+
+    def draw(self, frame, circles):
+        if circles is None or circles.size < 3:
+            return
+        for x, y, r in circles.reshape(-1, circles.shape[-1])[:, :3] / self.scale:
+            if x == 0 and y == 0:
+                continue
+            cv2.circle(frame, (int(x), int(y)), max(int(r), 1), (0, 255, 0), 2)
+            cv2.circle(frame, (int(x), int(y)), 2, (0, 0, 255), 3)
+
+    def _encode_loop(self):
+        while self._running:
+            item = self.slot.get(0.5)
+            if item is None:
+                continue
+            frame, circles = item
+            self.draw(frame, circles)
+            ok, jpeg = cv2.imencode(".jpg", frame, self.params)
+            if not ok:
+                continue
+            with self._ready:
+                self.jpeg = jpeg.tobytes()
+                self.serial += 1
+                self.encoded += 1
+                self._ready.notify_all()
+
+    def watch(self, change):
+        with self._ready:
+            self.clients += change
+
+    def wait(self, serial, timeout=2.0):
+        """
+        :serial -> int: last frame the caller has
+        :returns -> (int, bytes): a newer frame, or the same one on timeout
+        """
+        with self._ready:
+            if self.serial == serial and self._running:
+                self._ready.wait(timeout)
+            return self.serial, self.jpeg
+
+    def _handler(self):
+        preview = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                log.debug("%s " + format, self.address_string(), *args)
+
+            def do_GET(self):
+                if self.path == "/":
+                    self.reply("text/html", PAGE)
+                elif self.path == "/frame.jpg":
+                    preview.watch(1)
+                    try:
+                        serial, jpeg = preview.wait(preview.serial, 2.0)
+                    finally:
+                        preview.watch(-1)
+                    if jpeg is None:
+                        self.send_error(503, "no frame yet")
+                    else:
+                        self.reply("image/jpeg", jpeg)
+                elif self.path == "/stream.mjpg":
+                    self.stream()
+                else:
+                    self.send_error(404)
+
+            def reply(self, kind, body):
+                self.send_response(200)
+                self.send_header("Content-Type", kind)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def stream(self):
+                self.send_response(200)
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+                self.end_headers()
+                preview.watch(1)
+                serial = 0
+                try:
+                    while preview._running:
+                        fresh, jpeg = preview.wait(serial)
+                        if fresh == serial or jpeg is None:
+                            continue
+                        serial = fresh
+                        self.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: " +
+                                         str(len(jpeg)).encode() + b"\r\n\r\n" + jpeg + b"\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    preview.watch(-1)
+
+        return Handler
+
+    def close(self):
+        self._running = False
+        self.slot.close()
+        with self._ready:
+            self._ready.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        return {
+            "clients": self.clients,
+            "offered": self.offered,
+            "taken": self.taken,
+            "encoded": self.encoded,
+            "dropped": self.slot.dropped,
+        }
@@ -0,0 +1,108 @@
+import cv2
+import numpy as np
+
+"""
+Predictive region-of-interest for the circle search.
+
+The target only moves a little between frames, so instead of running the
+    whole filter -> blur -> HoughCircles chain over 640x480 every time, a
+    constant-velocity Kalman filter on the greedy circle predicts where the
+    target will be next, and VideoProcessor only searches a padded window
+    around that prediction. After max_misses frames w/o a hit inside the
+    window we drop the track and go back to searching the full frame.
+"""
+
+
+class RoiTracker:
+    """
+    :boundaries -> [int, int]: x, y dimensions of the frame
+    :pad -> int: extra pixels around the predicted circle to search
+    :max_misses -> int: frames w/o a detection before falling back to full frame
+    :min_size -> int: smallest window side, HoughCircles needs some context
+    :hits/misses/full_searches/roi_searches -> int: counters
+    """
+    def __init__(self, boundaries, pad=60, max_misses=3, min_size=160):
+        self.boundaries = boundaries
+        self.pad = pad
+        self.max_misses = max_misses
+        self.min_size = min_size
+        self.kalman = cv2.KalmanFilter(4, 2)
+        self.kalman.transitionMatrix = np.array([[1, 0, 1, 0],
+                                                 [0, 1, 0, 1],
+                                                 [0, 0, 1, 0],
+                                                 [0, 0, 0, 1]], np.float32)
+        self.kalman.measurementMatrix = np.array([[1, 0, 0, 0],
+                                                  [0, 1, 0, 0]], np.float32)
+        self.kalman.processNoiseCov = np.eye(4, dtype=np.float32) * 0.03
+        self.kalman.measurementNoiseCov = np.eye(2, dtype=np.float32) * 1.0
+        self.locked = False
+        self.radius = 0
+        self.lost = 0
+        self.window = None
+        self.hits = 0
+        self.misses = 0
+        self.full_searches = 0
+        self.roi_searches = 0
+
+    def reset(self):
+        self.locked = False
+        self.lost = 0
+        self.window = None
+
+    def predict(self):
+        """
+        Advance the filter one frame and work out where to search
+        :returns -> (x0, y0, x1, y1): window to search, or None for the full frame
+        """
+        if not self.locked:
+            self.window = None
+            self.full_searches += 1
+            return None
+        state = self.kalman.predict()
+        x, y = float(state[0, 0]), float(state[1, 0])
+        # search further ahead the faster we're moving and the longer we've missed
+        reach = self.radius + self.pad * (1 + self.lost) + abs(float(state[2, 0])) + abs(float(state[3, 0]))
+        half = max(reach, self.min_size / 2)
+        x0 = int(max(0, x - half))
+        y0 = int(max(0, y - half))
+        x1 = int(min(self.boundaries[0], x + half))
+        y1 = int(min(self.boundaries[1], y + half))
+        if x1 - x0 < self.min_size or y1 - y0 < self.min_size:
+            # prediction ran off the frame, not worth a window
+            self.reset()
+            self.full_searches += 1
+            return None
+        self.window = (x0, y0, x1, y1)
+        self.roi_searches += 1
+        return self.window
+
+    def update(self, circle):
+        """
+        Feed the result of the search back in
+        :circle -> [x, y, r] in frame coordinates, or None if nothing was found
+        """
+        if circle is None:
+            self.misses += 1
+            if self.locked:
+                self.lost += 1
+                if self.lost >= self.max_misses:
+                    self.reset()
+            return
+        self.hits += 1
+        measurement = np.array([[circle[0]], [circle[1]]], np.float32)
+        if not self.locked:
+            self.kalman.statePost = np.array([[circle[0]], [circle[1]], [0], [0]], np.float32)
+            self.kalman.errorCovPost = np.eye(4, dtype=np.float32)
+            self.locked = True
+        else:
+            self.kalman.correct(measurement)
+        self.radius = float(circle[2]) if len(circle) > 2 else self.radius
+        self.lost = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "roi_searches": self.roi_searches,
+            "full_searches": self.full_searches,
+        }
@@ -0,0 +1,200 @@
+import json
+import os
+import time
+import cv2
+import numpy as np
+
+"""
+Recorded range sessions, for replaying real footage w/o the hardware.
+
+A session is a directory:
+    frames.raw   - every frame back to back, uint8 h x w x 3, read as a memmap
+    index.npy    - one row per frame, see INDEX: capture time, the lidar range
+                   get_range() gave, the greedy circle and the cue classification
+    session.json - header: version, frame shape, frame count, boundaries,
+                   classification names and the flags the session ran w/
+
+frames.raw is preallocated for max_frames when recording starts and cut down
+    to the frames actually written when it's closed, so a recording costs one
+    memcpy per frame and the file is exactly count * frame size.
+"""
+
+VERSION = 1
+
+INDEX = np.dtype([
+    ("stamp", "<f8"),           # seconds since the first frame
+    ("range", "<i4"),           # mm, -1 if there was no reading
+    ("found", "u1"),            # 1 if a circle was detected
+    ("x", "<f4"),
+    ("y", "<f4"),
+    ("r", "<f4"),
+    ("classification", "i1"),   # index into session.json's classifications, -1 for no cue
+])
+
+
+class SessionWriter:
+    """
+    :directory -> str: session directory, created if missing
+    :boundaries -> [int, int]: x, y dimensions of the frames
+    :max_frames -> int: frames preallocated, later frames are counted as dropped
+    :classifications -> [str]: names the classification codes index into
+    :meta -> {}: anything else to keep in the header, e.g. the CLI flags
+    :transform -> np.array: 2x3 affine matrix frames are rotated by as they're
+                            stored, so sessions are always in output orientation
+    """
+    transform = None
+
+    def __init__(self, directory, boundaries, max_frames=3000, classifications=(), meta=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.boundaries = boundaries
+        self.shape = (boundaries[1], boundaries[0], 3)
+        self.classifications = list(classifications)
+        self.meta = meta or {}
+        self.frames = np.memmap(os.path.join(directory, "frames.raw"), dtype=np.uint8, mode="w+",
+                                shape=(max_frames,) + self.shape)
+        self.index = np.zeros(max_frames, INDEX)
+        self.index["range"] = -1
+        self.index["classification"] = -1
+        self.count = 0
+        self.dropped = 0
+        self.started = None
+
+    def record(self, frame, stamp=None):
+        """
+        Store a frame as the session saw it, before anything is drawn on it
+        :frame -> image object: h x w x 3 uint8
+        :stamp -> float: time.monotonic() of the capture, defaults to now
+        :returns -> int: the frame's index for annotate(), or -1 if we're full
+        """
+        if self.count >= self.frames.shape[0]:
+            self.dropped += 1
+            return -1
+        stamp = time.monotonic() if stamp is None else stamp
+        if self.started is None:
+            self.started = stamp
+        i = self.count
+        if self.transform is None:
+            self.frames[i] = frame
+        else:
+            cv2.warpAffine(frame, self.transform, (self.boundaries[0], self.boundaries[1]), dst=self.frames[i])
+        self.index["stamp"][i] = stamp - self.started
+        self.count += 1
+        return i
+
+    def annotate(self, i, circle=None, target_range=None, classification=None):
+        """
+        Attach what came out of a frame
+        :i -> int: index from record()
+        :circle -> [x,y,r]: greedy circle, [0,0] or None for nothing found
+        :target_range -> int: what get_range() returned
+        :classification -> str: name of the cue played, None for none
+        """
+        if i < 0:
+            return
+        row = self.index[i]
+        if circle is not None:
+            found = not (circle[0] == 0 and circle[1] == 0)
+            row["found"] = found
+            if found:
+                row["x"], row["y"] = circle[0], circle[1]
+                row["r"] = circle[2] if len(circle) > 2 else 0
+        if target_range is not None:
+            row["range"] = target_range
+        if classification is not None:
+            if classification not in self.classifications:
+                self.classifications.append(classification)
+            row["classification"] = self.classifications.index(classification)
+        self.index[i] = row
+
+    def close(self):
+        self.frames.flush()
+        frame_bytes = int(np.prod(self.shape))
+        del self.frames
+        # give back the preallocated frames we never used
+        os.truncate(os.path.join(self.directory, "frames.raw"), self.count * frame_bytes)
+        np.save(os.path.join(self.directory, "index.npy"), self.index[:self.count])
+        with open(os.path.join(self.directory, "session.json"), "w") as f:
+            json.dump({
+                "version": VERSION,
+                "boundaries": list(self.boundaries),
+                "shape": list(self.shape),
+                "count": self.count,
+                "dropped": self.dropped,
+                "classifications": self.classifications,
+                "meta": self.meta,
+            }, f, indent=1)
+
+
+class SessionReader:
+    """
+    Read-only view of a recorded session. Frames come straight out of the
+        memmap, so opening even a long session is instant.
+    :directory -> str: session directory
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "session.json")) as f:
+            self.header = json.load(f)
+        if self.header["version"] != VERSION:
+            raise ValueError("unsupported session version " + str(self.header["version"]))
+        self.boundaries = self.header["boundaries"]
+        self.classifications = self.header["classifications"]
+        self.count = self.header["count"]
+        self.index = np.load(os.path.join(directory, "index.npy"))
+        shape = (self.count,) + tuple(self.header["shape"])
+        self.frames = np.memmap(os.path.join(directory, "frames.raw"), dtype=np.uint8, mode="r", shape=shape) \
+            if self.count else np.zeros(shape, np.uint8)
+
+    def __len__(self):
+        return self.count
+
+    def circle(self, i):
+        """
+        :returns -> [x,y,r]: recorded circle, or [0, 0] for none
+        """
+        row = self.index[i]
+        if not row["found"]:
+            return [0, 0]
+        return [float(row["x"]), float(row["y"]), float(row["r"])]
+
+    def classification(self, i):
+        code = int(self.index["classification"][i])
+        return None if code < 0 else self.classifications[code]
+
+    def compare(self, other, tolerance=0.5):
+        """
+        Frame by frame diff against another session (or a replay of this one)
+        :tolerance -> float: px two circles may differ by and still match
+        :returns -> {}: frames compared and how many circles/cues differ
+        """
+        count = min(len(self), len(other))
+        a, b = self.index[:count], other.index[:count]
+        found = a["found"] != b["found"]
+        moved = (a["found"] == 1) & (b["found"] == 1) & \
+            ((np.abs(a["x"] - b["x"]) > tolerance) | (np.abs(a["y"] - b["y"]) > tolerance))
+        names_a = [self.classification(i) for i in range(count)]
+        names_b = [other.classification(i) for i in range(count)]
+        return {
+            "frames": count,
+            "found_differs": int(found.sum()),
+            "circle_differs": int(moved.sum()),
+            "classification_differs": sum(x != y for x, y in zip(names_a, names_b)),
+        }
+
+
+class ReplayLidar:
+    """
+    Stands in for LidarReader during a replay: latest() is whatever range
+        the frame being replayed was recorded w/
+    """
+    def __init__(self):
+        self.current = -1
+        self.reads = 0
+        self.timeouts = 0
+
+    def latest(self, max_age=None):
+        return self.current
+
+    def stop(self):
+        pass
@@ -0,0 +1,192 @@
+import numpy as np
+
+"""
+Multi-target tracking for the greedy pick.
+
+discard_worst took whichever circle was closest to the center in each frame
+    on its own, so w/ two targets in view the pick could flip between them
+    from one frame to the next, and every flip retriggered the audio.
+    TargetTracker keeps a track per target across frames, each w/ a
+    persistent id, and the cue stays on one track for as long as it keeps
+    being seen.
+
+Everything is kept in fixed size arrays, one row per track slot, and a
+    frame is a few whole-array operations:
+    predict - every live track moves on by its velocity
+    assign  - a tracks x detections distance matrix; pairs that are each
+              other's nearest (and w/in gate px) are matched. A couple of
+              rounds of that settle any leftovers, there's no loop over
+              tracks or detections
+    update  - matched tracks take the detection & a smoothed velocity,
+              unmatched ones coast and die after max_misses frames, and
+              unmatched detections start new tracks in free slots
+    choose  - the driving track is kept while it's seen, and once it's
+              confirmed (confirm hits) for as long as it's alive, so a
+              missed detection or two doesn't hand the cue to the other
+              target: while it coasts the cue follows its prediction. Once
+              it's dropped the seen track that's confirmed, then oldest,
+              then closest to the center (discard_worst's rule) takes over
+"""
+
+
+class TargetTracker:
+    """
+    :boundaries -> [int, int]: x, y dimensions of the frame
+    :gate -> float: max px between a track's prediction and its detection
+    :max_misses -> int: frames a track coasts w/o a detection before it's dropped
+    :confirm -> int: hits before a track counts as a real target
+    :capacity -> int: track slots, the stalest track is replaced when they're full
+    :smoothing -> float: weight of the newest motion in the velocity estimate
+    :driver -> int: id of the track the cue follows, -1 for none
+    :switches -> int: times the driving track changed
+    """
+    rounds = 3
+
+    def __init__(self, boundaries, gate=80.0, max_misses=5, confirm=3, capacity=16, smoothing=0.5):
+        self.boundaries = boundaries
+        self.gate = gate
+        self.max_misses = max_misses
+        self.confirm = confirm
+        self.capacity = capacity
+        self.smoothing = smoothing
+        self.center = np.array([boundaries[0] / 2, boundaries[1] / 2], np.float32)
+        self.position = np.zeros((capacity, 2), np.float32)
+        self.velocity = np.zeros((capacity, 2), np.float32)
+        self.radius = np.zeros(capacity, np.float32)
+        self.ids = np.full(capacity, -1, np.int64)
+        self.hits = np.zeros(capacity, np.int32)
+        self.misses = np.zeros(capacity, np.int32)
+        self.seen = np.zeros(capacity, bool)
+        self.next_id = 0
+        self.driver = -1
+        self.switches = 0
+        self.created = 0
+
+    def reset(self):
+        self.ids[:] = -1
+        self.seen[:] = False
+        self.driver = -1
+
+    def alive(self):
+        return self.ids >= 0
+
+    def assign(self, detections):
+        """
+        Match detections to live tracks by mutual nearest neighbour
+        :detections -> np.array: n x 2 centers
+        :returns -> (np.array, np.array): matched track slots & detection indices
+        """
+        alive = self.alive()
+        distance = np.hypot(*(self.position[:, np.newaxis, :] - detections[np.newaxis, :, :]).transpose(2, 0, 1))
+        distance[~alive] = np.inf
+        distance[distance > self.gate] = np.inf
+        tracks = []
+        found = []
+        rows = np.arange(self.capacity)
+        for _ in range(self.rounds):
+            if not np.isfinite(distance).any():
+                break
+            nearest = np.argmin(distance, axis=1)
+            back = np.argmin(distance, axis=0)
+            mutual = (back[nearest] == rows) & np.isfinite(distance[rows, nearest])
+            if not mutual.any():
+                break
+            t = rows[mutual]
+            d = nearest[mutual]
+            tracks.append(t)
+            found.append(d)
+            distance[t, :] = np.inf
+            distance[:, d] = np.inf
+        if not tracks:
+            return np.empty(0, np.intp), np.empty(0, np.intp)
+        return np.concatenate(tracks), np.concatenate(found)
+
+    def update(self, circles):
+        """
+        Advance every track by one frame
+        :circles -> np.array: [[[x,y,r], ...]] like HoughCircles, or None for no detections
+        :returns -> np.array: [x, y, r] of the driving target this frame
+                              (predicted if it went unseen), or None if
+                              there's no driver and nothing was seen
+        """
+        alive = self.alive()
+        self.position[alive] += self.velocity[alive]
+        self.seen[:] = False
+        if circles is not None:
+            detections = np.asarray(circles, np.float32).reshape(-1, circles.shape[-1])[:, :3]
+            tracks, found = self.assign(detections[:, :2])
+            if len(tracks):
+                motion = detections[found, :2] - (self.position[tracks] - self.velocity[tracks])
+                self.velocity[tracks] += self.smoothing * (motion - self.velocity[tracks])
+                self.position[tracks] = detections[found, :2]
+                self.radius[tracks] = detections[found, 2]
+                self.hits[tracks] += 1
+                self.misses[tracks] = 0
+                self.seen[tracks] = True
+            fresh = np.ones(len(detections), bool)
+            fresh[found] = False
+            self.spawn(detections[fresh])
+        missed = self.alive() & ~self.seen
+        self.misses[missed] += 1
+        self.ids[missed & (self.misses > self.max_misses)] = -1
+        return self.choose()
+
+    def spawn(self, detections):
+        """
+        Start a track for each detection, in free slots or over the stalest tracks
+        """
+        count = min(len(detections), self.capacity)
+        if not count:
+            return
+        detections = detections[:count]
+        free = np.flatnonzero(~self.alive())
+        if len(free) < count:
+            # stalest first, never the tracks seen this frame
+            stale = np.flatnonzero(self.alive() & ~self.seen)
+            stale = stale[np.argsort(-self.misses[stale], kind="stable")]
+            free = np.concatenate([free, stale])
+        slots = free[:count]
+        count = len(slots)
+        self.position[slots] = detections[:count, :2]
+        self.velocity[slots] = 0
+        self.radius[slots] = detections[:count, 2]
+        self.ids[slots] = self.next_id + np.arange(count)
+        self.next_id += count
+        self.created += count
+        self.hits[slots] = 1
+        self.misses[slots] = 0
+        self.seen[slots] = True
+
+    def choose(self):
+        # a one-off detection doesn't get to hold the cue while it coasts
+        held = self.seen | (self.hits >= self.confirm)
+        current = np.flatnonzero(self.alive() & held & (self.ids == self.driver))
+        if self.driver >= 0 and len(current):
+            slot = current[0]
+        else:
+            seen = np.flatnonzero(self.seen)
+            if not len(seen):
+                return None
+            offset = np.hypot(*(self.position[seen] - self.center).T)
+            # lexsort's last key is the primary one
+            slot = seen[np.lexsort((offset, -self.hits[seen], self.hits[seen] < self.confirm))[0]]
+            if self.driver >= 0:
+                self.switches += 1
+            self.driver = int(self.ids[slot])
+        return np.array([self.position[slot, 0], self.position[slot, 1], self.radius[slot]], np.float32)
+
+    def tracks(self):
+        """
+        :returns -> [(id, x, y, r, hits, misses)]: every live track
+        """
+        alive = np.flatnonzero(self.alive())
+        return [(int(self.ids[i]), float(self.position[i, 0]), float(self.position[i, 1]), float(self.radius[i]),
+                 int(self.hits[i]), int(self.misses[i])) for i in alive]
+
+    def stats(self):
+        return {
+            "tracks": int(self.alive().sum()),
+            "created": self.created,
+            "switches": self.switches,
+            "driver": self.driver,
+        }
@@ -0,0 +1,167 @@
+import logging
+import multiprocessing
+import queue
+import numpy as np
+from multiprocessing import shared_memory
+
+"""
+Circle detection spread over several processes.
+
+The frame is cut into a grid of tiles that overlap by more than the largest
+    target radius, so every circle is whole in at least one tile. A pool of
+    worker processes, started once, each run the usual segment -> blur ->
+    HoughCircles chain on whichever tile they're handed.
+
+Frames never get pickled: the parent copies each frame into a
+    multiprocessing.shared_memory block that the workers have mapped as a
+    numpy array, and the task queue only carries (frame number, tile number).
+    Workers send back a handful of circles each.
+
+Seams: a circle near a seam is found by every tile it's inside of. Each tile
+    only keeps the circles whose center falls in its own core (the part of
+    the tile that isn't overlap, the cores partition the frame), and circles
+    from neighbouring tiles that still end up closer than min_dist are
+    merged, since HoughCircles wouldn't have returned both either.
+"""
+
+log = logging.getLogger(__name__)
+
+
+def tile_grid(boundaries, rows, cols, overlap):
+    """
+    :returns -> [((x0, y0, x1, y1), (cx0, cy0, cx1, cy1))]: tile w/ overlap, and its core
+    """
+    tiles = []
+    for row in range(rows):
+        for col in range(cols):
+            cx0 = boundaries[0] * col // cols
+            cx1 = boundaries[0] * (col + 1) // cols
+            cy0 = boundaries[1] * row // rows
+            cy1 = boundaries[1] * (row + 1) // rows
+            # even offsets keep the tiles on the same dp=2 Hough accumulator grid as the full frame
+            tile = (max(0, (cx0 - overlap) // 2 * 2), max(0, (cy0 - overlap) // 2 * 2),
+                    min(boundaries[0], cx1 + overlap), min(boundaries[1], cy1 + overlap))
+            tiles.append((tile, (cx0, cy0, cx1, cy1)))
+    return tiles
+
+
+def _worker(name, boundaries, tiles, argv, ranges, tasks, results):
+    # imported here, VideoProcessor imports us
+    from VideoProcessor import VideoProcessor
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        frame = np.ndarray((boundaries[1], boundaries[0], 3), np.uint8, buffer=shm.buf)
+        vp = VideoProcessor(boundaries, argv=argv, configure=False)
+        vp.set_color_ranges(ranges)
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            seq, t = task
+            (x0, y0, x1, y1), (cx0, cy0, cx1, cy1) = tiles[t]
+            circles = vp._find_circles(vp._process_mask(frame[y0:y1, x0:x1]))
+            if circles is not None:
+                circles = circles[0] + np.array([x0, y0, 0], dtype=circles.dtype)
+                keep = (circles[:, 0] >= cx0) & (circles[:, 0] < cx1) & (circles[:, 1] >= cy0) & (circles[:, 1] < cy1)
+                circles = circles[keep] if keep.any() else None
+            results.put((seq, t, circles))
+    finally:
+        del frame
+        shm.close()
+
+
+class TiledDetector:
+    """
+    :boundaries -> [int, int]: x, y dimensions of the frames
+    :workers -> int: processes in the pool
+    :rows/cols -> int: tile grid
+    :overlap -> int: px each tile reaches past its core, at least maxRadius
+    :argv -> [str]: VideoProcessor flags the workers detect w/ (target radius etc.)
+    :ranges -> [(lower, upper)]: HSV colour ranges, see VideoProcessor.set_color_ranges
+    :min_dist -> float: circles closer than this after merging are one circle
+    :timeout -> float: seconds to wait for a tile before giving up on the frame
+    """
+    def __init__(self, boundaries, workers=4, rows=2, cols=2, overlap=48, argv=(), ranges=(),
+                 min_dist=120, timeout=2.0):
+        self.boundaries = boundaries
+        self.tiles = tile_grid(boundaries, rows, cols, overlap)
+        self.min_dist = min_dist
+        self.timeout = timeout
+        self.seq = 0
+        self.frames = 0
+        self.timeouts = 0
+        self.seam_merges = 0
+        shape = (boundaries[1], boundaries[0], 3)
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)))
+        self.frame = np.ndarray(shape, np.uint8, buffer=self.shm.buf)
+        context = multiprocessing.get_context()
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        ranges = [(np.asarray(lower).tolist(), np.asarray(upper).tolist()) for lower, upper in ranges]
+        self.workers = [context.Process(target=_worker, name="tile-" + str(i), daemon=True,
+                                        args=(self.shm.name, boundaries, self.tiles, list(argv), ranges,
+                                              self.tasks, self.results))
+                        for i in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def detect(self, frame):
+        """
+        :frame -> image object: full BGR frame
+        :returns -> np.array: [[[x,y,r], ...]] like HoughCircles, or None
+        """
+        self.seq += 1
+        self.frames += 1
+        np.copyto(self.frame, frame)
+        for t in range(len(self.tiles)):
+            self.tasks.put((self.seq, t))
+        found = []
+        pending = len(self.tiles)
+        while pending:
+            try:
+                seq, t, circles = self.results.get(timeout=self.timeout)
+            except queue.Empty:
+                self.timeouts += 1
+                log.warning("tile workers timed out on frame %d", self.seq)
+                break
+            if seq != self.seq:
+                # left over from a frame we gave up on
+                continue
+            pending -= 1
+            if circles is not None:
+                found.extend(circles.tolist())
+        return self.merge(found)
+
+    def merge(self, circles):
+        """
+        Drop circles w/in min_dist of one already kept
+        """
+        if not circles:
+            return None
+        kept = []
+        for circle in circles:
+            if any((circle[0] - k[0]) ** 2 + (circle[1] - k[1]) ** 2 < self.min_dist ** 2 for k in kept):
+                self.seam_merges += 1
+                continue
+            kept.append(circle)
+        return np.array([kept], dtype=np.float32)
+
+    def close(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join(1.0)
+            if worker.is_alive():
+                worker.terminate()
+        del self.frame
+        self.shm.close()
+        self.shm.unlink()
+
+    def stats(self):
+        return {
+            "workers": len(self.workers),
+            "tiles": len(self.tiles),
+            "frames": self.frames,
+            "timeouts": self.timeouts,
+            "seam_merges": self.seam_merges,
+        }
@@ -0,0 +1,129 @@
+import math
+import numpy as np
+
+"""
+NumPy tone synthesizer for the audio cues.
+
+pydub's Sine builds every sample in a Python generator, and .pan() and
+    segment + copy the audio a couple more times, so a 1 s TRACK cue took
+    tens of ms to render. ToneSynth renders a whole cue as int16 stereo in
+    one vectorized pass: one envelope array, one sin(), one multiply per
+    channel.
+
+A cue is a pattern, a list of (freq, duration ms, gain dB) segments where a
+    freq of None is silence, plus a pan position. On top of what pydub did:
+    equal-power  - pan w/ cos/sin gains, so loudness doesn't dip or bump
+                   between center and hard left/right
+    phase clock  - every tone's phase is taken from its sample index in the
+                   cue, and loop lengths are rounded up to whole multiples of
+                   phase_frames (2205 = 50 ms, a whole number of periods of
+                   both 440 and 880 Hz). Looping a cue, or switching to another
+                   cue at the same offset mod phase_frames, is then phase
+                   continuous (AudioEngine does the switching)
+    fades        - fade ms raised cosine ramps on the tone edges that meet
+                   silence, so blips start and stop w/o a click. A pattern
+                   w/o any silence (WIDE, BULLS) is one continuous tone over
+                   the whole loop, padding included, and isn't ramped at all,
+                   the phase clock already makes its loop seam seamless
+
+pan_law="pydub", phase_frames=0, fade=0 reproduces the old pydub output to
+    w/in 1 LSB, which is what the equivalence check in Benchmark.py uses.
+"""
+
+
+class ToneSynth:
+    """
+    :sample_rate -> int: output rate, same as AudioEngine's
+    :pan_law -> str: "equal_power", or "pydub" for pydub's dB-linear pan
+    :phase_frames -> int: loop lengths are padded to a multiple of this, 0 for exact lengths
+    :fade -> float: ms of ramp at each tone edge
+    """
+    pan_laws = ("equal_power", "pydub")
+
+    def __init__(self, sample_rate=44100, pan_law="equal_power", phase_frames=2205, fade=3.0):
+        if pan_law not in self.pan_laws:
+            raise ValueError("unknown pan law " + str(pan_law))
+        self.sample_rate = sample_rate
+        self.pan_law = pan_law
+        self.phase_frames = phase_frames
+        self.fade = fade
+
+    def pan_gains(self, pan):
+        """
+        :pan -> float: -1.0 hard left .. 1.0 hard right, None for unpanned
+        :returns -> (float, float): left & right amplitude factors
+        """
+        if pan is None:
+            return 1.0, 1.0
+        if self.pan_law == "pydub":
+            # pydub.effects.pan: +3 dB on the near side at full pan, the far
+            #   side drops so the two sum to 2x
+            boost = 10 ** (abs(pan) * 20 * math.log10(2.0) / 20)
+            near = boost ** 0.5
+            far = 2.0 - boost
+            return (near, far) if pan < 0 else (far, near)
+        # scaled by sqrt 2 so center is unity and hard pan matches pydub's +3 dB
+        angle = (pan + 1) * math.pi / 4
+        return math.sqrt(2) * math.cos(angle), math.sqrt(2) * math.sin(angle)
+
+    def frame_count(self, pattern):
+        """
+        :returns -> int: frames a pattern renders to, padded to phase_frames
+        """
+        frames = sum(int(self.sample_rate * (duration / 1000.0)) for _, duration, _ in pattern)
+        if self.phase_frames and frames:
+            frames = -(-frames // self.phase_frames) * self.phase_frames
+        return frames
+
+    def render(self, pattern, pan=None):
+        """
+        :pattern -> [(freq, ms, dB)]: segments, freq None for silence.
+                                      All tones in one pattern share a freq
+        :pan -> float: pan position, None to leave both channels at full gain
+        :returns -> np.array: frames x 2 int16
+        """
+        total = self.frame_count(pattern)
+        envelope = np.zeros(total, np.float64)
+        counts = [int(self.sample_rate * (duration / 1000.0)) for _, duration, _ in pattern]
+        if total and all(tone is not None for (tone, _, _), count in zip(pattern, counts) if count):
+            # nothing silent in there, the tone carries on through the padding
+            counts[-1] += total - sum(counts)
+        freq = None
+        tones = []
+        start = 0
+        for (tone, _, gain), count in zip(pattern, counts):
+            if tone is not None and count:
+                freq = tone
+                envelope[start:start + count] = 10 ** (gain / 20.0)
+                tones.append((start, count))
+            start += count
+        ramp = int(self.sample_rate * self.fade / 1000.0)
+        for start, count in tones:
+            edge = min(ramp, count // 2)
+            if not edge:
+                continue
+            shape = 0.5 - 0.5 * np.cos(np.linspace(0, math.pi, edge, endpoint=False))
+            segment = envelope[start:start + count]
+            # only edges next to silence, the buffer loops so the first frame follows the last
+            if envelope[start - 1] == 0:
+                segment[:edge] *= shape
+            if envelope[(start + count) % total] == 0:
+                segment[count - edge:] *= shape[::-1]
+        out = np.zeros((total, 2), np.int16)
+        if freq is None:
+            return out
+        mono = np.sin(np.arange(total) * (2 * math.pi * freq / self.sample_rate))
+        mono *= envelope
+        mono *= 32767
+        # pydub truncates each sample to an int, and again after panning
+        np.trunc(mono, out=mono)
+        left, right = self.pan_gains(pan)
+        out[:, 0] = np.clip(np.trunc(mono * left), -32768, 32767)
+        out[:, 1] = np.clip(np.trunc(mono * right), -32768, 32767)
+        return out
+
+    def pcm(self, pattern, pan=None):
+        """
+        :returns -> bytes: interleaved int16 stereo, ready for AudioEngine
+        """
+        return self.render(pattern, pan).tobytes()
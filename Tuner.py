@@ -0,0 +1,217 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import random
+import time
+import cv2
+import numpy as np
+from VideoProcessor import VideoProcessor, GREEN_RANGES
+from Benchmark import BOUNDARIES, load_frames, synthetic_frames
+
+"""
+Parameter sweep for the detection settings.
+
+    python3 Tuner.py --dir labelled/ --out tuned.json
+    python3 VideoProcessor.py --greedy --audio --config tuned.json
+
+Searches the HSV range, blur size and HoughCircles settings (dp, minDist,
+    param1, param2) over a folder of labelled frames (see Benchmark.load_frames,
+    or --synthetic for rendered ones), scores every configuration on
+    precision, recall and latency of the greedy circle, and writes the best
+    one as a --config file.
+
+Work that doesn't depend on a setting isn't redone for it:
+    - HSV conversion of every frame happens once, before the sweep
+    - configurations are grouped by (colour range, blur), and each group is
+      one task for the process pool: segment & blur every frame once, then
+      run every Hough setting of the group on the cached masks
+"""
+
+SPACE = {
+    "dp": [1.5, 2.0],
+    "min_dist": [60, 120],
+    "param1": [10, 20, 40, 80],
+    "param2": [20, 30, 40, 60],
+    "blur_size": [3, 5, 7],
+    # offsets applied to every colour range: widen hue by, shift the S/V floor by
+    "hue": [0, 10],
+    "floor": [-30, 0, 30],
+}
+
+_frames = None
+_truths = None
+_target_radius = None
+
+
+def color_ranges(base, hue, floor):
+    """
+    :base -> [([h,s,v], [h,s,v])]: ranges to start from
+    :returns -> [[lower, upper]]: ranges w/ hue widened & the S/V floor moved
+    """
+    ranges = []
+    for lower, upper in base:
+        lower = [max(0, lower[0] - hue), min(255, max(0, lower[1] + floor)), min(255, max(0, lower[2] + floor))]
+        upper = [min(179, upper[0] + hue), upper[1], upper[2]]
+        ranges.append([lower, upper])
+    return ranges
+
+
+def configurations(search, samples, seed=0):
+    """
+    :search -> str: "grid" for every combination, "random" for samples of them
+    :returns -> [{}]: one dict per configuration, keys as in SPACE
+    """
+    keys = list(SPACE)
+    grid = [dict(zip(keys, values)) for values in itertools.product(*(SPACE[key] for key in keys))]
+    if search == "random" and samples < len(grid):
+        grid = random.Random(seed).sample(grid, samples)
+    return grid
+
+
+def _init(frames, truths, target_radius):
+    # runs once per pool worker, so the frames are only sent over once
+    global _frames, _truths, _target_radius
+    _frames = frames
+    _truths = truths
+    _target_radius = target_radius
+
+
+def _evaluate_group(task):
+    """
+    Score every Hough setting for one (colour range, blur) group
+    :task -> ([[lower, upper]], int, [{}]): ranges, blur size, configurations
+    :returns -> [{}]: one result per configuration
+    """
+    ranges, blur_size, group = task
+    vp = VideoProcessor(BOUNDARIES, argv=["--greedy", "--target-radius", str(_target_radius)], configure=False)
+    vp.set_color_ranges(ranges)
+    vp.blur_size = blur_size
+    masks = []
+    began = time.perf_counter()
+    for hsv in _frames:
+        masks.append(vp._proc_blur(vp._segment_hsv(hsv)).copy())
+    mask_ms = 1000 * (time.perf_counter() - began) / len(_frames)
+
+    results = []
+    for config in group:
+        vp.hough_dp = config["dp"]
+        vp.min_dist = config["min_dist"]
+        vp.hough_param1 = config["param1"]
+        vp.hough_param2 = config["param2"]
+        correct = detections = targets = 0
+        began = time.perf_counter()
+        found = [vp._find_circles(mask) for mask in masks]
+        hough_ms = 1000 * (time.perf_counter() - began) / len(masks)
+        for circles, truth in zip(found, _truths):
+            targets += int(bool(truth))
+            if circles is None:
+                continue
+            detections += 1
+            best = vp.discard_worst(circles)
+            if truth and np.hypot(best[0] - truth[0], best[1] - truth[1]) <= max(5, truth[2] / 2):
+                correct += 1
+        precision = correct / detections if detections else 0.0
+        recall = correct / targets if targets else 0.0
+        result = dict(config)
+        result.update({
+            "color_ranges": ranges,
+            "precision": precision,
+            "recall": recall,
+            "f1": 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+            "ms": mask_ms + hough_ms,
+        })
+        results.append(result)
+    return results
+
+
+def sweep(frames, truths, configs, base_ranges, target_radius, workers):
+    """
+    :frames -> [image object]: BGR frames
+    :truths -> [[x, y, r] or []]: labels, [] for no target
+    :returns -> [{}]: results, best first
+    """
+    hsv = [cv2.cvtColor(frame, cv2.COLOR_BGR2HSV) for frame in frames]
+    groups = {}
+    for config in configs:
+        groups.setdefault((config["hue"], config["floor"], config["blur_size"]), []).append(config)
+    tasks = [(color_ranges(base_ranges, hue, floor), blur_size, group)
+             for (hue, floor, blur_size), group in groups.items()]
+    if workers > 1:
+        with multiprocessing.Pool(workers, _init, (hsv, truths, target_radius)) as pool:
+            results = [r for rs in pool.imap_unordered(_evaluate_group, tasks) for r in rs]
+    else:
+        _init(hsv, truths, target_radius)
+        results = [r for task in tasks for r in _evaluate_group(task)]
+    results.sort(key=lambda r: (-r["f1"], r["ms"]))
+    return results
+
+
+def to_config(result, target_radius):
+    """
+    :returns -> {}: a result as a VideoProcessor --config
+    """
+    return {
+        "target_radius": target_radius,
+        "color_ranges": result["color_ranges"],
+        "blur_size": result["blur_size"],
+        "hough": {
+            "dp": result["dp"],
+            "min_dist": result["min_dist"],
+            "param1": result["param1"],
+            "param2": result["param2"],
+        },
+        "score": {key: result[key] for key in ("precision", "recall", "f1", "ms")},
+    }
+
+
+def parse_arguments(argv=None):
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dir", default=None, help="labelled frames, see Benchmark.load_frames")
+    ap.add_argument("--synthetic", type=int, default=60, help="frames to render when there's no --dir")
+    ap.add_argument("--search", default="random", choices=["grid", "random"], help="every combination or a sample")
+    ap.add_argument("--samples", type=int, default=120, help="configurations for --search random")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--workers", type=int, default=multiprocessing.cpu_count(), help="processes to sweep w/")
+    ap.add_argument("--target-radius", type=int, default=40, help="largest expected target radius in px")
+    ap.add_argument("--base", default=None, help="--config file to take the starting colour ranges from")
+    ap.add_argument("--out", default="tuned.json", help="where the best configuration goes")
+    ap.add_argument("--results", default=None, help="write every configuration's score here as json")
+    ap.add_argument("--top", type=int, default=10, help="configurations to print")
+    return vars(ap.parse_args(argv))
+
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args["dir"]:
+        labelled = [(frame, truth) for frame, truth in load_frames(args["dir"]) if truth is not None]
+        if not labelled:
+            raise SystemExit("no labelled frames in " + args["dir"] + " (needs a labels.json)")
+    else:
+        # a spread of lighting, so the ranges don't get tuned to one scene
+        labelled = []
+        for i, lighting in enumerate((0.6, 1.0, 1.3)):
+            labelled += list(synthetic_frames(BOUNDARIES, args["synthetic"] // 3, radius=25, noise=10,
+                                              seed=i, lighting=lighting, gradient=0.3 * i, empty_every=8))
+    base = GREEN_RANGES
+    if args["base"]:
+        with open(args["base"]) as f:
+            base = json.load(f)["color_ranges"]
+    configs = configurations(args["search"], args["samples"], args["seed"])
+    print("%d frames, %d configurations, %d workers" % (len(labelled), len(configs), args["workers"]))
+    began = time.perf_counter()
+    results = sweep([frame for frame, _ in labelled], [truth for _, truth in labelled], configs, base,
+                    args["target_radius"], args["workers"])
+    print("swept in %.1f s" % (time.perf_counter() - began))
+    print("%5s %4s %6s %6s %4s %4s %5s  %9s %6s %6s %7s" % (
+        "dp", "dist", "p1", "p2", "blur", "hue", "floor", "precision", "recall", "f1", "ms"))
+    for r in results[:args["top"]]:
+        print("%5.1f %4d %6d %6d %4d %4d %5d  %9.3f %6.3f %6.3f %7.2f" % (
+            r["dp"], r["min_dist"], r["param1"], r["param2"], r["blur_size"], r["hue"], r["floor"],
+            r["precision"], r["recall"], r["f1"], r["ms"]))
+    with open(args["out"], "w") as f:
+        json.dump(to_config(results[0], args["target_radius"]), f, indent=2)
+    print("wrote " + args["out"])
+    if args["results"]:
+        with open(args["results"], "w") as f:
+            json.dump(results, f, indent=1)
@@ -4,21 +4,41 @@ import argparse
 import os
 import numpy as np
 import math
-from PIL import Image
 import time
-import imutils
+import logging
+import json
+import threading
 from AudioGenerator import AudioGenerator
-import datetime
-import pyaudio
+from Pipeline import Pipeline, Packet
+from RoiTracker import RoiTracker
+from TargetTracker import TargetTracker
+from DutyCycle import DutyCycle
+from BufferPool import BufferPool
+from FrameRecorder import FrameRecorder
+from Metrics import Metrics, configure_logging
+from FrameSource import WebcamSource, PiCameraSource, ReplaySource, PI_CAMERA, map_circles
+from Session import SessionWriter
+from Detector import DETECTORS
+# TiledDetector (multiprocessing) and PreviewServer (http.server) are only
+#   imported when --workers/--preview ask for them
+
+log = logging.getLogger(__name__)
 
 GREEN_ONLY = True
 
-try:
-    from picamera.array import PiRGBArray
-    from picamera import PiCamera
-    PI_CAMERA = True
-except:
-    PI_CAMERA = False
+# Target colours as [lower, upper] HSV bounds (OpenCV hue is 0..179).
+#   VideoProcessor.color_ranges is one of these lists, or anything else
+#   in the same shape. At most 8 ranges, see VideoProcessor.set_color_ranges.
+GREEN_RANGES = [
+    ([40, 100, 105], [90, 255, 255]),   # bright green
+]
+TARGET_RANGES = [
+    ([0, 140, 120], [15, 255, 255]),    # red
+    ([170, 140, 120], [179, 255, 255]), # red, wrapping around the hue circle
+    ([90, 40, 50], [140, 255, 255]),    # blue
+    ([18, 80, 80], [35, 240, 200]),     # yellow
+    ([50, 40, 50], [80, 180, 180]),     # green
+]
 
 class VideoProcessor:
     """
@@ -27,10 +47,29 @@ class VideoProcessor:
 
     To run on a local machine, just include the --dev flag
 
-    The greedy mechanism discards every circle aside from the one closest to the
-    center of the image. While not great in design, it seems to work well
-    enough for our purposes.
+    To record a session: add --record-session DIR. To play it back w/o any
+        hardware: python3 VideoProcessor.py --greedy --audio --replay DIR
+
+    Startup: the camera, the audio device and the lidar all come up at the
+        same time on their own threads, while the detection chain warms up
+        on a blank frame. The first frame waits for the camera, the first
+        cue for the audio. --serial-init brings them up one after another.
+
+    The greedy mechanism keeps one circle per frame for the audio. TargetTracker
+    follows every circle across frames and sticks w/ the one it picked, so
+    w/ two targets in view the cue doesn't flip between them. --no-track
+    goes back to plain discard_worst: whichever circle is closest to the
+    center of the image, every frame on its own.
     
+    :source -> FrameSource: where frames come from, see FrameSource.py
+    :transform -> np.array: the source's frame -> output matrix. Detection runs
+                            on frames as captured, circles are moved through
+                            this. None when frames are already upright
+    :preview -> PreviewServer: --preview MJPEG stream, or None
+    :session -> SessionWriter: --record-session recording, or None
+    :audio_generator -> AudioGenerator: made here w/ --audio if we weren't handed one
+
+
 ############################### DEV CONFIGURATION ##############################
     :capture -> cv2.VideoCapture: video capture object
 
@@ -38,183 +77,613 @@ class VideoProcessor:
 ############################### PI CONFIGURATION ###############################
     :camera -> PiCamera: Pi Camera Module capture object
     :raw_capture -> PiRGBArray: processed capture images
+
+
+############################## DETECTION SETTINGS ##############################
+    :min_coarse_radius -> int: smallest target radius (px) --pyramid auto will shrink to
+    :refine_margin -> int: px around a coarse candidate searched at full size
+    :max_candidates -> int: coarse candidates refined per frame
+    :min_dist -> int: HoughCircles minDist at full size
+    :hough_dp/hough_param1/hough_param2 -> float: the other HoughCircles settings,
+                         param2 shrinks w/ the pyramid scale down to min_hough_param2
+    :blur_size -> int: GaussianBlur kernel size on the mask
+    All of these (and the colour ranges & target radius) can come from a
+        --config file, see Tuner.py for how to make one
+    :detector -> Detector: --detector backend _find_circles hands masks to, see Detector.py
+    :tracker -> TargetTracker: picks the greedy circle, None w/ --no-track
+    :duty -> DutyCycle: --duty-cycle motion gate in front of process_chain, or None
+    :tile_margin -> int: px --workers tiles overlap by on top of --target-radius
+    :tiled -> TiledDetector: --workers process pool, or None
+
+
+#################################### METRICS ###################################
+    :metrics -> Metrics: per-stage timers (capture, rotate, filter, blur, hough/contour)
+                         and detection counters, see Metrics.py
     """
-    def __init__(self, boundaries, audiogenerator=None):
+    min_coarse_radius = 10
+    refine_margin = 16
+    max_candidates = 4
+    min_dist = 120
+    hough_dp = 2.0
+    hough_param1 = 20
+    hough_param2 = 40
+    min_hough_param2 = 10
+    blur_size = 5
+    tile_margin = 8
+
+    def __init__(self, boundaries, audiogenerator=None, argv=None, configure=True, metrics=None):
         """
         Initialize our class, configure CLI arguments, make sure that 
             there isn't an environment collision
         :boundaries -> [int, int]: x,y dimensions
         :audiogenerator -> AudioGenerator: our audio generator implementation
+        :argv -> [str]: CLI arguments, defaults to sys.argv
+        :configure -> bool: set up the camera (and w/ --audio the audio
+                            generator). Pass False to only use the image
+                            operations, e.g. for benchmarks
+        :metrics -> Metrics: where to record, defaults to the shared one
         """
-        global PI_CAMERA
-        self.args = self.parse_arguments()
+        self.args = self.parse_arguments(argv)
         self.boundaries = boundaries
         self.audio_generator = audiogenerator
+        self.metrics = metrics if metrics is not None else Metrics.metrics
+        self.pool = BufferPool(boundaries)
+        self.detector = DETECTORS[self.args["detector"]](self)
+        self.set_color_ranges(GREEN_RANGES if GREEN_ONLY else TARGET_RANGES)
+        if self.args["config"]:
+            self.load_config(self.args["config"])
+        self.recorder = None
+        if self.args["save"]:
+            self.recorder = FrameRecorder(self.args["save_dir"], boundaries,
+                                          fmt=self.args["save_format"],
+                                          fps=self.args["save_fps"],
+                                          queue_size=self.args["save_queue"],
+                                          drop=self.args["save_drop"],
+                                          quality=self.args["save_quality"],
+                                          max_frames=self.args["save_max"])
+        self.tracker = None
+        if not self.args["no_track"]:
+            self.tracker = TargetTracker(boundaries)
+        self.duty = None
+        self.last_detection = None
+        if self.args["duty_cycle"]:
+            self.duty = DutyCycle(boundaries, self.args["min_rate"], self.args["max_rate"],
+                                  self.args["motion_threshold"], self.args["motion_cells"], metrics=self.metrics)
+        self.roi_tracker = None
+        self.pyramid_scale = self.get_pyramid_scale()
+        if self.args["roi"]:
+            self.roi_tracker = RoiTracker(boundaries, max_misses=self.args["roi_misses"])
+        self.tiled = None
+        if self.args["workers"] > 0:
+            self.tiled = self.start_tiled()
+        self.source = None
+        self.transform = None
+        self.inverse = None
+        self.session = None
+        self.preview = None
+        self._camera_init = None
+        self._camera_error = None
+        if self.args["record_session"]:
+            self.session = SessionWriter(self.args["record_session"], boundaries, self.args["record_max"],
+                                         [c.name for c in AudioGenerator.Classification], meta=self.args)
+        if not configure:
+            return
+        configure_logging(self.args["log_level"], self.args["log_interval"], self.metrics)
+        self.metrics.install_signal(self.args["metrics_file"])
+        if self.args["metrics_file"] and self.args["metrics_interval"] > 0:
+            self.metrics.start_reporter(self.args["metrics_file"], self.args["metrics_interval"])
+        if self.args["preview"] is not None:
+            from PreviewServer import PreviewServer
+            self.preview = PreviewServer(self.args["preview"], self.args["preview_fps"],
+                                         self.args["preview_scale"], self.args["preview_quality"],
+                                         self.args["preview_host"])
+        if self.args["replay"]:
+            self.configure_replay()
+            return
         if self.args["dev"] is PI_CAMERA:
             print("It looks like you are trying to run conflicting environments")
             print("If you are on your test machine, add the --dev flag")
             print("If you are on the pi, remove the --dev flag")
             print("If it still fails on the pi, ensure the picamera packages are configured")
             exit(1)
-        if self.args["dev"]:
-            self.configure_webcam()
-        else:
-            self.configure_picam()
+        self.start_audio()
+        self.start_camera()
+        self.warm_up()
 
 ##################################################################################
 ###################################### SETUP #####################################
 ##################################################################################
     
     def configure_webcam(self):
-        self.capture = cv2.VideoCapture(0)
-        self.capture.set(3, self.boundaries[0])
-        self.capture.set(4, self.boundaries[1])
+        self.source = WebcamSource(self.boundaries, self.pool, self.metrics)
+        self.capture = self.source.capture
+        self.orient_outputs()
     
     def configure_picam(self):
-        self.camera = PiCamera()
-        self.camera.resolution = (self.boundaries[0], self.boundaries[1])
-        self.camera.framerate = 32
-        self.raw_capture = PiRGBArray(self.camera, size=(self.boundaries[0], self.boundaries[1]))
-        time.sleep(0.1)
+        self.source = PiCameraSource(self.boundaries, self.pool, self.metrics)
+        self.camera = self.source.camera
+        self.raw_capture = self.source.raw_capture
+        self.orient_outputs()
+
+    def orient_outputs(self):
+        """
+        Take the source's orientation: circles get mapped by it, and
+            everything that shows or stores frames rotates them by it
+        """
+        self.transform = self.source.transform
+        self.inverse = None if self.transform is None else cv2.invertAffineTransform(self.transform)
+        for output in (self.preview, self.recorder, self.session):
+            if output is not None:
+                output.transform = self.transform
+
+    def configure_camera(self):
+        began = self.metrics.clock()
+        if self.args["dev"]:
+            self.configure_webcam()
+        else:
+            self.configure_picam()
+        self.metrics.record("startup.camera", began)
+
+    def _configure_camera(self):
+        try:
+            self.configure_camera()
+        except Exception as e:
+            self._camera_error = e
+
+    def start_camera(self):
+        """
+        Bring the camera up on its own thread, frames() waits for it.
+            w/ --serial-init it's done before returning.
+        """
+        if self.args["serial_init"]:
+            self.configure_camera()
+            return
+        self._camera_init = threading.Thread(target=self._configure_camera, name="camera-init", daemon=True)
+        self._camera_init.start()
+
+    def wait_camera(self):
+        """
+        Block until start_camera is done, raising whatever it failed w/
+        """
+        if self._camera_init is None:
+            return
+        self._camera_init.join()
+        self._camera_init = None
+        if self._camera_error is not None:
+            raise self._camera_error
+
+    def start_audio(self, lidar=None):
+        """
+        Make the --audio generator, unless we were handed one. Its audio
+            device & lidar come up on a thread of their own (see
+            AudioGenerator.start_hardware), w/ --serial-init before returning.
+        :lidar -> range source to use instead of looking for the Evo
+        """
+        if self.audio_generator is not None or not self.args["audio"]:
+            return
+        self.audio_generator = AudioGenerator(self.boundaries, lidar=lidar, metrics=self.metrics,
+                                              defer=not self.args["serial_init"])
+
+    def warm_up(self):
+        """
+        Search a blank frame once, so the first real frame doesn't pay for
+            allocating the pool buffers and OpenCV's first calls
+        """
+        began = self.metrics.clock()
+        self._search_frame(np.zeros((self.boundaries[1], self.boundaries[0], 3), np.uint8))
+        self.metrics.record("startup.warm", began)
+
+    def configure_replay(self):
+        # recorded ranges stand in for the lidar, so the cues come out the same too
+        self.source = ReplaySource(self.args["replay"], self.boundaries, self.pool, self.metrics,
+                                   speed=self.args["replay_speed"], loop=self.args["replay_loop"])
+        self.orient_outputs()
+        if self.audio_generator is not None:
+            self.audio_generator.lidar = self.source.lidar
+        else:
+            self.start_audio(self.source.lidar)
     
-    def parse_arguments(self):
+    def start_tiled(self):
+        """
+        Start the --workers pool. Tiles overlap by more than the largest
+            target radius so any circle is whole in some tile.
+        """
+        from TiledDetector import TiledDetector
+        rows, cols = (int(n) for n in self.args["tiles"].lower().split("x"))
+        overlap = self.args["target_radius"] + 1 + self.tile_margin
+        argv = ["--target-radius", str(self.args["target_radius"]), "--detector", self.args["detector"]]
+        if self.args["config"]:
+            argv += ["--config", self.args["config"]]
+        return TiledDetector(self.boundaries, self.args["workers"], rows, cols, overlap, argv=argv,
+                             ranges=self.color_ranges, min_dist=self.min_dist)
+
+    def config(self):
+        """
+        :returns -> {}: the detection settings, in --config file form
+        """
+        return {
+            "target_radius": self.args["target_radius"],
+            "color_ranges": [[lower.tolist(), upper.tolist()] for lower, upper in self.color_ranges],
+            "blur_size": self.blur_size,
+            "hough": {
+                "dp": self.hough_dp,
+                "min_dist": self.min_dist,
+                "param1": self.hough_param1,
+                "param2": self.hough_param2,
+            },
+        }
+
+    def apply_config(self, config):
+        """
+        Override the detection settings. Anything missing keeps its default,
+            a target_radius in the config wins over --target-radius.
+        :config -> {}: same shape as config()
+        """
+        if "target_radius" in config:
+            self.args["target_radius"] = int(config["target_radius"])
+            self.pyramid_scale = self.get_pyramid_scale()
+        if "color_ranges" in config:
+            self.set_color_ranges(config["color_ranges"])
+        self.blur_size = int(config.get("blur_size", self.blur_size))
+        hough = config.get("hough", {})
+        self.hough_dp = float(hough.get("dp", self.hough_dp))
+        self.min_dist = float(hough.get("min_dist", self.min_dist))
+        self.hough_param1 = float(hough.get("param1", self.hough_param1))
+        self.hough_param2 = float(hough.get("param2", self.hough_param2))
+
+    def load_config(self, path):
+        with open(path) as f:
+            self.apply_config(json.load(f))
+        log.info("detection settings from %s: %s", path, self.config())
+
+    def parse_arguments(self, argv=None):
         """
         Configure our command line arguments
         Options are:
-            greedy  - discard all found circles aside from one closest to center
+            greedy  - keep one circle, the tracked target (see TargetTracker.py)
+            no-track- w/ greedy, just take the circle closest to center every frame
             dev     - for local testing, use webcam instead of PiCameraModule
-            save    - save all frames
+            save    - record frames in the background (see the --save-* options)
             render  - render the computer vision on screen
+            preview - serve a decimated MJPEG preview on this port (localhost only
+                      unless --preview-host), see PreviewServer.py
             orig    - don't do any processing, for use w/ saving to get raw capture
             circles - only draw circles on image if true
             audio   - generate audio feedback
+            threaded- run capture, detection, audio and output as separate stages
+            roi     - only search a window around where the target is predicted to be
+            pyramid - find candidates on a downscaled frame, refine them at full size
+            duty-cycle - only detect when the frame moved, see DutyCycle.py
+            config  - json file w/ tuned detection settings, see Tuner.py
+            detector- circle finding backend: hough, or contour for blob contours
+            workers - split full frame searches into --tiles, over this many processes
+            log-level   - how chatty to be, per-frame messages are debug
+            metrics-file- json file the stage timers/counters are dumped to,
+                          every --metrics-interval sec, on SIGUSR1 and at exit
+            record-session - record frames, ranges, circles & cues, see Session.py
+            replay  - run on a recorded session instead of a camera
+            serial-init - bring camera, audio & lidar up one after another
             help    - show these arguments
+        :argv -> [str]: arguments to parse, defaults to sys.argv
         :returns -> {}: dict of flags to their values
         """
         ap = argparse.ArgumentParser()
-        ap.add_argument("-g", "--greedy", action="store_true", help="keep only center-most circle")
+        ap.add_argument("-g", "--greedy", action="store_true", help="keep only the tracked target's circle")
+        ap.add_argument("--no-track", action="store_true", help="greedy picks the center-most circle every frame, no tracking")
         ap.add_argument("-d", "--dev", action="store_true", help="use when testing on your local machine")
-        ap.add_argument("-s", "--save", action="store_true", help="save all seen frames to cwd/logs")
+        ap.add_argument("-s", "--save", action="store_true", help="record frames to --save-dir in the background")
+        ap.add_argument("--save-dir", default=os.path.join(os.getcwd(), "logs"), help="where --save writes")
+        ap.add_argument("--save-format", default="jpg", choices=FrameRecorder.formats, help="image files, a raw memmap or an MJPG video")
+        ap.add_argument("--save-fps", type=float, default=1.0, help="max frames recorded per second, 0 for every frame")
+        ap.add_argument("--save-queue", type=int, default=8, help="frames waiting to be written before dropping")
+        ap.add_argument("--save-drop", default="newest", choices=FrameRecorder.policies, help="what to drop when the queue is full")
+        ap.add_argument("--save-quality", type=int, default=85, help="jpg quality")
+        ap.add_argument("--save-max", type=int, default=150, help="frames the raw memmap is preallocated for, ~0.9 MB each at 640x480")
         ap.add_argument("-r", "--render", action="store_true", help="show output window")
+        ap.add_argument("--preview", type=int, default=None, help="serve an MJPEG preview on this port")
+        ap.add_argument("--preview-fps", type=float, default=5.0, help="max preview frames per second")
+        ap.add_argument("--preview-scale", type=int, default=2, help="downscale factor for the preview")
+        ap.add_argument("--preview-quality", type=int, default=70, help="preview jpg quality")
+        ap.add_argument("--preview-host", default="127.0.0.1", help="interface the preview listens on, 0.0.0.0 to share it w/ the network")
         ap.add_argument("-o", "--original", action="store_true", help="don't do any image processing")
         ap.add_argument("-c", "--circles", action="store_true", help="draw the circles on render")
         ap.add_argument("-a", "--audio", action="store_true", help="generate audio feedback")
-        return vars(ap.parse_args())
+        ap.add_argument("-t", "--threaded", action="store_true", help="run as a staged pipeline, dropping stale frames")
+        ap.add_argument("--roi", action="store_true", help="track the target and only search around its predicted position")
+        ap.add_argument("--roi-misses", type=int, default=3, help="frames w/o a hit before the roi search falls back to the full frame")
+        ap.add_argument("--pyramid", default=None, help="coarse-to-fine search: downscale factor (2, 4) or 'auto' to pick from --target-radius")
+        ap.add_argument("--target-radius", type=int, default=40, help="largest expected target radius in px")
+        ap.add_argument("--duty-cycle", action="store_true", help="skip detection on frames that didn't move, reusing the last result")
+        ap.add_argument("--min-rate", type=float, default=5.0, help="--duty-cycle detections per second while nothing moves")
+        ap.add_argument("--max-rate", type=float, default=0.0, help="--duty-cycle max detections per second, 0 for every frame")
+        ap.add_argument("--motion-threshold", type=int, default=12, help="gray level change of a downscaled cell that counts as motion")
+        ap.add_argument("--motion-cells", type=int, default=2, help="changed cells that count as a moving frame")
+        ap.add_argument("--detector", default="hough", choices=list(DETECTORS), help="circle finding backend, see Detector.py")
+        ap.add_argument("--config", default=None, help="json file of tuned detection settings (Tuner.py writes these)")
+        ap.add_argument("--workers", type=int, default=0, help="processes for tiled full frame detection, 0 for off")
+        ap.add_argument("--tiles", default="2x2", help="tile grid for --workers, rows x cols")
+        ap.add_argument("--log-level", default="info", choices=["debug", "info", "warning", "error"], help="log verbosity")
+        ap.add_argument("--log-interval", type=float, default=1.0, help="min seconds between repeats of a log message, 0 for no limit")
+        ap.add_argument("--metrics-file", default=None, help="dump stage timers & counters here as json")
+        ap.add_argument("--metrics-interval", type=float, default=10.0, help="seconds between --metrics-file dumps, 0 for only at exit")
+        ap.add_argument("--record-session", default=None, help="record a replayable session into this directory")
+        ap.add_argument("--record-max", type=int, default=3000, help="frames the session recording is preallocated for")
+        ap.add_argument("--replay", default=None, help="play a recorded session instead of using a camera")
+        ap.add_argument("--replay-speed", type=float, default=1.0, help="1 for real time, 0 for as fast as possible")
+        ap.add_argument("--replay-loop", action="store_true", help="start the replay over when it ends")
+        ap.add_argument("--serial-init", action="store_true", help="initialize camera, audio & lidar one after another instead of in parallel")
+        return vars(ap.parse_args(argv))
 
 ##################################################################################
 ################################ IMAGE OPERATIONS ################################
 ##################################################################################
 
-    def _process_find_circles(self, frame):
+    def _find_circles(self, frame, scale=1):
+        """
+        Find circles in a processed image w/ the --detector backend
+        :frame -> image object: blurred mask (or a window of one)
+        :scale -> int: how much frame was shrunk, distances & radii shrink w/ it
+        :returns -> np.array: [[[x,y,r], ...]] in frame coordinates, or None
+        """
+        return self.detector.detect(frame, scale)
+
+    def _process_find_circles(self, mask, frame=None):
         """
         Receive a processed images, and try to identify circles in it.
         If we are using the greedy flag, only return the circle closest
         to the center of the image.
-        :frame -> image object: array of the image
+        :mask -> image object: blurred colour mask
+        :frame -> image object: image to draw the circles on, defaults to mask
         :returns -> frame, [x,y]: where [x,y] is location of circle, or [0,0] if no cirlce
         """
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        circles = cv2.HoughCircles(gray, cv2.HOUGH_GRADIENT, 2.0, 
-              minDist=120,
-              param1=20,#80,
-              param2=40,#80,
-              minRadius=0,
-              maxRadius=40)
+        return self._mark_circles(mask if frame is None else frame, self._find_circles(mask))
+
+    def _mark_circles(self, frame, circles):
+        """
+        Move the circles found for a frame to output coordinates, pick (greedy) and draw them
+        :frame -> image object: image to draw on, as captured
+        :circles -> np.array: HoughCircles output in frame coordinates, or None
+        :returns -> frame, [x,y]: where [x,y] is location of circle, or [0,0] if no cirlce
+        """
+        if circles is not None and self.transform is not None:
+            circles = map_circles(circles, self.transform, self.boundaries)
+        if circles is None:
+            self.metrics.count("detect.missed")
+        else:
+            self.metrics.count("detect.found")
+        if self.args["greedy"]:
+            # the tracker has to see the frames w/o circles too
+            bestCircle = self.pick(circles)
+            if bestCircle is None:
+                return frame, [0, 0]
+            if self.args["circles"]:
+                center = self.frame_point(bestCircle)
+                cv2.circle(frame,center,int(bestCircle[2]),(0,255,0),2)
+                cv2.circle(frame,center,2,(0,0,255),3)
+            return frame, bestCircle
         if circles is not None:
-            if self.args["greedy"]:
-                bestCircle = self.discard_worst(circles)
-                if self.args["circles"]:
-                    cv2.circle(frame,(bestCircle[0],bestCircle[1]),bestCircle[2],(0,255,0),2)
-                    cv2.circle(frame,(bestCircle[0],bestCircle[1]),2,(0,0,255),3)
-                return frame, bestCircle
-            else:
-                circles = np.uint16(np.around(circles))
-                if self.args["circles"]:
-                    for i in circles[0,:]:
-                        # draw the outer circle
-                        cv2.circle(frame,(i[0],i[1]),i[2],(0,255,0),2)
-                        # draw the center of the circle
-                        cv2.circle(frame,(i[0],i[1]),2,(0,0,255),3)
-                return frame, circles
+            circles = np.uint16(np.around(circles))
+            if self.args["circles"]:
+                for i in circles[0,:]:
+                    # draw the outer circle
+                    cv2.circle(frame,self.frame_point(i),int(i[2]),(0,255,0),2)
+                    # draw the center of the circle
+                    cv2.circle(frame,self.frame_point(i),2,(0,0,255),3)
+            return frame, circles
         else:
             return frame, [0, 0]
     
-    def _process_filter_colors(self, frame):
+    def frame_point(self, circle):
         """
-        Receive an image (frame) and apply our colormatch. Any colors
-        in the masks will stay in the image, every other pixel will be discarded
-        Currently we only operate on bright green, set by the global var.
-        :frame -> image object: array of the image
-        :returns -> frame: frame w/ only selected colors intact
+        :circle -> [x,y,...]: circle in output coordinates
+        :returns -> (int, int): where to draw it on the frame as captured
+        """
+        if self.inverse is None:
+            return (int(circle[0]), int(circle[1]))
+        x, y = self.inverse[:, :2] @ np.array(circle[:2], np.float64) + self.inverse[:, 2]
+        return (int(round(x)), int(round(y)))
+
+    def set_color_ranges(self, ranges):
+        """
+        Set the target colours and rebuild the segmentation lookup table.
+        Each range gets one bit; the LUT maps every H, S and V value to the
+            bits of the ranges that value falls inside, so a pixel is a target
+            if some bit survives ANDing its three channels together.
+        :ranges -> [([h,s,v], [h,s,v]), ...]: lower/upper HSV bounds, up to 8
         """
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        if not 0 < len(ranges) <= 8:
+            raise ValueError("need between 1 and 8 colour ranges, got " + str(len(ranges)))
+        self.color_ranges = [(np.array(lower, np.uint8), np.array(upper, np.uint8)) for lower, upper in ranges]
+        values = np.arange(256)
+        lut = np.zeros((1, 256, 3), np.uint8)
+        for bit, (lower, upper) in enumerate(self.color_ranges):
+            for channel in range(3):
+                inside = (values >= lower[channel]) & (values <= upper[channel])
+                lut[0, inside, channel] |= np.uint8(1 << bit)
+        self.color_lut = lut
 
-        global GREEN_ONLY
+    def _process_segment(self, frame):
+        """
+        Receive an image (frame) and apply our colormatch in one pass.
+        Pixels inside any of color_ranges come out as 255, everything else 0.
+        One range is a single inRange, more go through the channel LUT so
+            we never touch the 3 channel image more than once.
+        :frame -> image object: BGR array of the image
+        :returns -> mask: single channel uint8 mask
+        """
+        began = self.metrics.clock()
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV, dst=self.pool.like("hsv", frame))
+        mask = self._segment_hsv(hsv)
+        self.metrics.record("filter", began)
+        return mask
 
-        if GREEN_ONLY:
-            lower_green = np.array([40, 100, 105])
-            upper_green = np.array([90, 255, 255])
-            green_mask = cv2.inRange(hsv, lower_green, upper_green)
-            green = cv2.bitwise_and(frame, frame, mask=green_mask)
-            return green
-        
+    def _segment_hsv(self, hsv):
+        """
+        The colour match part of _process_segment, for an already converted image
+        :hsv -> image object: HSV array
+        :returns -> mask: single channel uint8 mask, 255 where a colour range matched
+        """
+        mask = self.pool.get("mask", hsv.shape[0], hsv.shape[1])
+        if len(self.color_ranges) == 1:
+            lower, upper = self.color_ranges[0]
+            cv2.inRange(hsv, lower, upper, dst=mask)
         else:
-            # RED
-            lower_red = np.array([0, 140, 120])
-            upper_red = np.array([15, 255, 255])
-            lower_red_ = np.array([170, 140, 120])
-            upper_red_ = np.array([179, 255, 255])
-            red_mask = cv2.inRange(hsv, lower_red, upper_red)
-            red_mask_ = cv2.inRange(hsv, lower_red_, upper_red_)
-            
-            # BLUE
-            lower_blue = np.array([90, 40, 50])
-            upper_blue = np.array([140, 255, 255])
-            blue_mask = cv2.inRange(hsv, lower_blue, upper_blue)
-            
-            # YELLOW
-            lower_yellow = np.array([18, 80, 80])
-            # upper_yellow = np.array([35, 255, 255])
-            upper_yellow = np.array([35, 240, 200])
-            yellow_mask = cv2.inRange(hsv, lower_yellow, upper_yellow)
-
-            #GREEN
-            lower_green = np.array([50, 40, 50])
-            upper_green = np.array([80, 180, 180])
-            green_mask = cv2.inRange(hsv, lower_green, upper_green)
-            
-
-            red = cv2.bitwise_or(cv2.bitwise_and(frame,frame, mask=red_mask), cv2.bitwise_and(frame, frame, mask=red_mask_))
-            blue = cv2.bitwise_and(frame, frame, mask=blue_mask)
-            yellow = cv2.bitwise_and(frame, frame, mask=yellow_mask)
-            green = cv2.bitwise_and(frame, frame, mask=green_mask)
-            # return cv2.bitwise_or(red, blue)
-            acc = cv2.bitwise_or(red, blue)
-            acc = cv2.bitwise_or(acc, green)
-            # acc = cv2.bitwise_or(cv2.bitwise_not(black), acc)
-            return cv2.bitwise_or(acc, yellow)
-    
+            bits = cv2.LUT(hsv, self.color_lut, dst=self.pool.like("bits", hsv))
+            np.bitwise_and(bits[:, :, 0], bits[:, :, 1], out=mask)
+            np.bitwise_and(mask, bits[:, :, 2], out=mask)
+            cv2.compare(mask, 0, cv2.CMP_GT, dst=mask)
+        return mask
+
+    def _process_mask(self, frame):
+        """
+        Segment and blur, ready for _find_circles
+        :frame -> image object: BGR array of the image (or a window of one)
+        :returns -> mask: blurred single channel mask
+        """
+        return self._proc_blur(self._process_segment(frame))
+
+    def get_pyramid_scale(self):
+        """
+        Work out the downscale factor for the coarse pass. In auto mode,
+            shrink as far as possible while the target keeps a radius of
+            at least min_coarse_radius px, since HoughCircles can't find
+            anything much smaller than that.
+        :returns -> int: 1 (off), 2 or 4
+        """
+        pyramid = self.args["pyramid"]
+        if not pyramid:
+            return 1
+        if pyramid == "auto":
+            scale = 1
+            while scale < 4 and self.args["target_radius"] / (scale * 2) >= self.min_coarse_radius:
+                scale *= 2
+            return scale
+        return int(pyramid)
+
+    def _find_circles_pyramid(self, frame):
+        """
+        Coarse-to-fine circle search. Filter, blur and HoughCircles run on a
+            1/pyramid_scale copy of the frame to find candidates, then every
+            candidate is re-detected at full size in a small patch around it.
+        :frame -> image object: raw (unfiltered) frame
+        :returns -> np.array: [[[x,y,r], ...]] in full-size coordinates, or None
+        """
+        scale = self.pyramid_scale
+        size = (self.boundaries[0] // scale, self.boundaries[1] // scale)
+        small = cv2.resize(frame, size, dst=self.pool.get("small", size[1], size[0], 3), interpolation=cv2.INTER_AREA)
+        candidates = self._find_circles(self._process_mask(small), scale)
+        if candidates is None:
+            return None
+        refined = []
+        reach = self.args["target_radius"] + self.refine_margin
+        for cx, cy, cr in candidates[0][:self.max_candidates]:
+            cx, cy, cr = cx * scale, cy * scale, cr * scale
+            x0, y0 = int(max(0, cx - reach)), int(max(0, cy - reach))
+            x1, y1 = int(min(frame.shape[1], cx + reach)), int(min(frame.shape[0], cy + reach))
+            found = self._find_circles(self._process_mask(frame[y0:y1, x0:x1]))
+            if found is None:
+                # keep the coarse estimate rather than losing the target
+                refined.append([cx, cy, cr])
+                continue
+            found = found[0]
+            best = np.argmin(np.abs(found[:, 0] + x0 - cx) + np.abs(found[:, 1] + y0 - cy))
+            refined.append([found[best, 0] + x0, found[best, 1] + y0, found[best, 2]])
+        return np.array([refined], dtype=np.float32)
+
+    def _search_frame(self, frame):
+        """
+        Search a whole frame: tiled over --workers, single scale or coarse-to-fine
+        :returns -> frame, circles: image to draw on, HoughCircles style circles
+        """
+        if self.tiled is not None:
+            return frame, self.tiled.detect(frame)
+        if self.pyramid_scale > 1:
+            return frame, self._find_circles_pyramid(frame)
+        return frame, self._find_circles(self._process_mask(frame))
+
     def _proc_blur(self, frame):
         """
         Blur the image a little
         :frame -> image object: input frame to blur
         :returns -> frame: frame w/ blur
         """
-        return cv2.GaussianBlur(frame,(5,5), 0)
+        began = self.metrics.clock()
+        blurred = cv2.GaussianBlur(frame,(self.blur_size,self.blur_size), 0, dst=self.pool.like("blur", frame))
+        self.metrics.record("blur", began)
+        return blurred
     
     def process_chain(self, frame):
         """
-        Filter colors, then blur, then search for circles
+        Segment colors into a mask, blur it, then search it for circles
+        :frame -> image object: array of the image
+        :returns -> frame, [x,y]: frame w/ circles drawn on it (w/ --circles),
+                    and [x,y] the location of circle, or [0,0] if no cirlce
+        """
+        if self.roi_tracker is not None:
+            return self._process_chain_roi(frame)
+        if self.pyramid_scale > 1 or self.tiled is not None:
+            return self._mark_circles(*self._search_frame(frame))
+        return self._process_find_circles(self._process_mask(frame), frame)
+
+    def detect(self, frame, now=None):
+        """
+        process_chain for the run loops. w/ --duty-cycle a frame that didn't
+            move gets the last detection instead.
+        :now -> float: time.monotonic(), for testing
+        :returns -> frame, circles: same as process_chain
+        """
+        if self.duty is None:
+            return self.process_chain(frame)
+        # the first frame is always detected on, so there is a last detection to reuse
+        if not self.duty.should_detect(frame, now):
+            return frame, self.last_detection
+        frame, self.last_detection = self.process_chain(frame)
+        return frame, self.last_detection
+
+    def _process_chain_roi(self, frame):
+        """
+        process_chain, but only over the window RoiTracker predicts the
+            target to be in. Falls back to the full frame when the tracker
+            has lost the target. Circles are shifted back to frame space, so
+            the audio generator gets the same coordinates either way.
         :frame -> image object: array of the image
         :returns -> frame, [x,y]: where [x,y] is location of circle, or [0,0] if no cirlce
         """
-        frame = self._proc_blur(self._process_filter_colors(frame))
-        return self._process_find_circles(frame)
+        window = self.roi_tracker.predict()
+        if window is None:
+            frame, circles = self._search_frame(frame)
+        else:
+            x0, y0, x1, y1 = window
+            circles = self._find_circles(self._process_mask(frame[y0:y1, x0:x1]))
+            if circles is not None:
+                circles = circles + np.array([x0, y0, 0], dtype=circles.dtype)
+            if self.args["circles"]:
+                cv2.rectangle(frame, (x0, y0), (x1, y1), (255, 0, 0), 1)
+        if self.tracker is None or not self.args["greedy"]:
+            self.roi_tracker.update(None if circles is None else self.discard_worst(circles))
+            return self._mark_circles(frame, circles)
+        # search around the target the tracker follows
+        frame, best = self._mark_circles(frame, circles)
+        found = not (best[0] == 0 and best[1] == 0)
+        self.roi_tracker.update(self.frame_point(best) + (best[2],) if found else None)
+        return frame, best
 
 ##################################################################################
 ################################# RUNNERS/HELPERS ################################
 ##################################################################################
 
+    def pick(self, circles):
+        """
+        The greedy circle: the tracked target's, or w/ --no-track the center-most
+        :circles -> np.array: HoughCircles style circles in output coordinates, or None
+        :returns -> [x,y,r]: the circle, or None
+        """
+        if self.tracker is not None:
+            return self.tracker.update(circles)
+        if circles is None:
+            return None
+        return self.discard_worst(circles)
+
     def discard_worst(self, circles):
         """
         Get an array of circles, and using a shortest-distance heuristic,
@@ -226,7 +695,7 @@ class VideoProcessor:
         bestHeur = 9999999999
         bestCircle = None
         for circle in circles:
-            curHeur = abs(circle[0] - (self.boundaries[0]/2)) + abs(circle[1] - (self.boundaries[1]/2))
+            curHeur = math.hypot(circle[0] - (self.boundaries[0]/2), circle[1] - (self.boundaries[1]/2))
             if curHeur < bestHeur:
                 bestCircle = circle
                 bestHeur = curHeur
@@ -236,64 +705,221 @@ class VideoProcessor:
         """
         Detect our environment and run accordingly
         """
-        if self.args["dev"]:
-            self.run_local()
+        try:
+            if self.args["threaded"]:
+                self.run_pipeline()
+            elif self.args["dev"] or self.args["replay"]:
+                self.run_local()
+            else:
+                self.run_pi()
+        finally:
+            if self._camera_init is not None:
+                self._camera_init.join()
+            if self.source is not None:
+                self.source.close()
+            if self.preview is not None:
+                self.preview.close()
+                log.info("preview: %s", self.preview.stats())
+            if self.duty is not None:
+                log.info("duty cycle: %s", self.duty.stats())
+            if self.tiled is not None:
+                self.tiled.close()
+                log.info("tiled detection: %s", self.tiled.stats())
+            if self.session is not None:
+                self.session.close()
+                log.info("session: %d frames recorded, %d dropped", self.session.count, self.session.dropped)
+            if self.recorder is not None:
+                self.recorder.close()
+                log.info("recorder: %s", self.recorder.stats())
+            log.info("%s", self.metrics.summary())
+            if self.args["metrics_file"]:
+                self.metrics.dump(self.args["metrics_file"])
+
+    def frames(self, reuse=False):
+        """
+        Frames from whichever source we configured (camera or replay)
+        :reuse -> bool: write every frame into the same pool buffer. Only
+                        safe if each frame is done w/ before the next one
+                        is read, i.e. not in the threaded pipeline
+        :returns -> generator: frames, rotated/resized to boundaries
+        """
+        self.wait_camera()
+        if self.duty is None:
+            return self.source.frames(reuse)
+        return self._restart_duty(self.source.frames(reuse))
+
+    def _restart_duty(self, frames):
+        """
+        Reset the duty cycle whenever the source starts over (a new frames(),
+            or --replay-loop going back to the first frame), so the first
+            frame isn't scored against the last one of the previous pass
+        """
+        self.duty.reset()
+        position = -1
+        for frame in frames:
+            current = getattr(self.source, "position", position + 1)
+            if current < position:
+                self.duty.reset()
+            position = current
+            yield frame
+
+    def record_frame(self, frame):
+        """
+        Add a frame to the --record-session recording, before anything is
+            drawn on it
+        :returns -> int: frame index for annotate_frame, -1 if not recording
+        """
+        if self.session is None:
+            return -1
+        return self.session.record(frame)
+
+    def annotate_frame(self, index, circles=None, cued=False):
+        """
+        Attach a frame's results to the recording
+        :circles -> []: process_chain result
+        :cued -> bool: whether the audio generator ran on this frame
+        """
+        if self.session is None or index < 0:
+            return
+        if isinstance(circles, np.ndarray) and circles.ndim == 3:
+            circles = self.discard_worst(circles)
+        if cued:
+            au = self.audio_generator
+            classification = au.last_classification.name if au.last_classification is not None else None
+            self.session.annotate(index, circles, au.last_range, classification)
         else:
-            self.run_pi()
-    
+            self.session.annotate(index, circles)
+
+    def cue_audio(self, circles):
+        """
+        Hand the greedy circle to the audio generator
+        :circles -> [x,y,...]: best circle, or [0,0] if there is none
+        """
+        au_target = [0, 0]
+        au_target[0] = int(round(circles[0]))
+        au_target[1] = int(round(circles[1]))
+        self.audio_generator.run(au_target)
+
     def run_local(self):
-        # Master run loop for when testing on local machine
-        while self.capture.isOpened():
-            ret, frame = self.capture.read()
-            frame = cv2.resize(frame, (self.boundaries[0], self.boundaries[1]))
-            if ret:
-                if not self.args["original"]:
-                    frame, circles = self.process_chain(frame)
-                if self.args["audio"] and self.args["greedy"]:
-                    au_target = [0, 0]
-                    au_target[0] = int(round(circles[0]))
-                    au_target[1] = int(round(circles[1]))
-                    self.audio_generator.run(au_target)
-                if self.args["save"]:
-                    self.save_frame(frame)
-                if self.args["render"]:
-                    cv2.imshow('Frame', frame)
-                    if cv2.waitKey(25) & 0xFF == ord('q'):
-                        break
+        # Master run loop for when testing on local machine (or replaying)
+        cue = self.args["audio"] and self.args["greedy"]
+        for frame in self.frames(reuse=True):
+            index = self.record_frame(frame)
+            circles = None
+            if not self.args["original"]:
+                frame, circles = self.detect(frame)
+            if cue:
+                self.cue_audio(circles)
+            self.annotate_frame(index, circles, cue)
+            if self.args["save"]:
+                self.save_frame(frame)
+            if self.preview is not None:
+                self.preview.offer(frame, self.overlay(circles))
+            if self.args["render"]:
+                cv2.imshow('Frame', self.source.orient(frame))
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
     
     def run_pi(self):
         # Master run loop for when running in "production" mode
-        for frame in self.camera.capture_continuous(self.raw_capture, format="bgr", use_video_port=True):
-            image = frame.array
-            image = imutils.rotate(image, 270)
-
+        cue = self.args["audio"] and self.args["greedy"]
+        for image in self.frames(reuse=True):
+            index = self.record_frame(image)
+            circles = None
             if not self.args["original"]:
-                image, circles = self.process_chain(image)
-            if self.args["audio"] and self.args["greedy"]:
-                    au_target = [0, 0]
-                    au_target[0] = int(round(circles[0]))
-                    au_target[1] = int(round(circles[1]))
-                    self.audio_generator.run(au_target)
+                image, circles = self.detect(image)
+            if cue:
+                self.cue_audio(circles)
+            self.annotate_frame(index, circles, cue)
             if self.args["save"]:
                 self.save_frame(image)
+            if self.preview is not None:
+                self.preview.offer(image, self.overlay(circles))
             if self.args["render"]:
                 try:
-                    cv2.imshow("Frame", image)
+                    cv2.imshow("Frame", self.source.orient(image))
                 except:
                     pass
                 key = cv2.waitKey(1) & 0xFF
                 if key == ord("q"):
                     break
-            self.raw_capture.truncate(0)
+
+    def build_pipeline(self, frames=None):
+        """
+        Wire up capture -> detect -> (audio, output) as separate stages.
+        Every hand-off is a latest-wins slot, so a slow stage drops stale
+            frames instead of working through a backlog of them.
+        :frames -> iterator: frame source, defaults to our camera
+        :returns -> (Pipeline, LatestSlot): the pipeline and the slot the
+                    output stage (run on the main thread) reads from
+        """
+        frames = iter(self.frames() if frames is None else frames)
+        pipeline = Pipeline()
+        captured = pipeline.slot("captured")
+        cues = pipeline.slot("cues")
+        output = pipeline.slot("output")
+
+        def capture():
+            frame = next(frames)
+            return Packet(time.monotonic(), frame, index=self.record_frame(frame))
+
+        def detect(packet):
+            if not self.args["original"]:
+                packet.frame, packet.circles = self.detect(packet.frame)
+                self.annotate_frame(packet.index, packet.circles)
+            return packet
+
+        def audio(packet):
+            self.cue_audio(packet.circles)
+            self.annotate_frame(packet.index, packet.circles, True)
+
+        pipeline.stage("capture", capture, None, [captured])
+        if self.args["audio"] and self.args["greedy"] and not self.args["original"]:
+            pipeline.stage("detect", detect, captured, [cues, output])
+            pipeline.stage("audio", audio, cues)
+        else:
+            pipeline.stage("detect", detect, captured, [output])
+        return pipeline, output
+
+    def run_pipeline(self):
+        # Master run loop for the staged pipeline. Output stays on this
+        #   thread since the imshow window has to live on the main thread.
+        pipeline, output = self.build_pipeline()
+        pipeline.start()
+        try:
+            while True:
+                packet = output.get(0.5)
+                if packet is None:
+                    if output.closed:
+                        break
+                    continue
+                if self.args["save"]:
+                    self.save_frame(packet.frame)
+                if self.preview is not None:
+                    self.preview.offer(packet.frame, self.overlay(packet.circles))
+                if self.args["render"]:
+                    cv2.imshow("Frame", self.source.orient(packet.frame))
+                    if cv2.waitKey(1) & 0xFF == ord("q"):
+                        break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            pipeline.stop()
+            log.info("pipeline stats:\n%s", pipeline.summary())
     
+    def overlay(self, circles):
+        """
+        Circles for the preview to draw, unless --circles already drew them
+        """
+        if self.args["circles"]:
+            return None
+        return circles
+
     def save_frame(self, frame):
-        # If using the correct flag, will save an img every second for debugging.
-        timeString = str(datetime.datetime.now()).replace(" ", "_")[0:19]
-        pathStr = str(os.path.abspath(os.getcwd())) + '/logs/' \
-            + timeString + '.png'
-        if not os.path.isfile(pathStr):
-            cv2.imwrite(pathStr, frame)
+        # If using the correct flag, hands the frame to the background recorder,
+        #   which keeps --save-fps frames a second (1 by default) for debugging.
+        self.recorder.submit(frame)
 
 if __name__ == "__main__":
-    go = VideoProcessor([640, 480], AudioGenerator([640, 480]))
+    go = VideoProcessor([640, 480])
     go.run()
\ No newline at end of file
@@ -0,0 +1,65 @@
+from collections import OrderedDict
+
+"""
+Bounded LRU cache of ready-to-play PCM buffers.
+
+Rendering a cue w/ pydub costs tens of milliseconds, and the cue only
+    really changes when the target crosses into a different quantized cell.
+    AudioGenerator keys this cache on (classification, balance, volume,
+    pacing) rounded to a grid, so most TRACK frames become a dict lookup.
+"""
+
+
+class WaveCache:
+    """
+    :max_entries -> int: buffers kept before the least recently used one is dropped
+    :hits -> int: lookups served from the cache
+    :misses -> int: lookups that had to render
+    :evictions -> int: buffers dropped to stay under max_entries
+    """
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, render):
+        """
+        Look up a buffer, rendering and storing it on a miss
+        :key -> hashable: quantized cue parameters
+        :render -> callable: builds the buffer when it isn't cached
+        :returns -> bytes: the pcm buffer for key
+        """
+        try:
+            pcm = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            pcm = render()
+            self.entries[key] = pcm
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            return pcm
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return pcm
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }